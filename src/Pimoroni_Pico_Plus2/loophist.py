@@ -0,0 +1,131 @@
+# Per-stage latency histograms for a main loop
+#
+# Each stage of the loop has NBUCKETS log2 buckets of ticks_us() durations
+# (bucket b counts durations of 2**(b-1) .. 2**b - 1 us, bucket 0 counts
+# 0 us) plus the exact maximum, all in one preallocated array: recording a
+# sample allocates nothing. The loop threads one ticks_us() value through
+# its stages, so each stage costs one lap() call, and one branch when the
+# histograms are off:
+#
+#   >>> hist = LoopHist(("uart", "sensor", "display", "idle"))
+#   >>> t = time.ticks_us()
+#   >>> while True:
+#   ...     read_uart()
+#   ...     if use_hist: t = hist.lap(0, t)
+#   ...     read_sensor()
+#   ...     if use_hist: t = hist.lap(1, t)
+#   ...     ...
+#
+# dump() prints the count, the 50/90/99th percentiles (upper bucket
+# bounds) and the maximum per stage. poll_console() checks the USB console
+# without blocking: "h" dumps the histograms, "r" clears them.
+#
+# The same file is in the flash of the Pimoroni Pico Plus 2.
+#
+# License: MIT
+
+from micropython import const
+from array import array
+import micropython
+import time
+import sys
+
+NBUCKETS = const(24)  # the last bucket collects everything from 2**22 us (4.2 s) on
+
+
+@micropython.native
+def _bucket(us):
+    b = 0
+    while us and b < NBUCKETS - 1:
+        us >>= 1
+        b += 1
+    return b
+
+
+class LoopHist:
+    def __init__(self, names):
+        self.names = names
+        n = len(names)
+        self.counts = array("L", [0] * (n * NBUCKETS))
+        self.max = array("L", [0] * n)
+        self._poll = None
+
+    def lap(self, stage, t0):
+        """ Record the time since t0 for stage; returns the time now for the next stage. """
+        t = time.ticks_us()
+        us = time.ticks_diff(t, t0)
+        if us < 0:
+            us = 0
+        self.counts[stage * NBUCKETS + _bucket(us)] += 1
+        if us > self.max[stage]:
+            self.max[stage] = us
+        return t
+
+    def add(self, stage, us):
+        self.counts[stage * NBUCKETS + _bucket(us)] += 1
+        if us > self.max[stage]:
+            self.max[stage] = us
+
+    def reset(self):
+        c = self.counts
+        for i in range(len(c)):
+            c[i] = 0
+        for i in range(len(self.max)):
+            self.max[i] = 0
+
+    def count(self, stage):
+        c = self.counts
+        i = stage * NBUCKETS
+        n = 0
+        for b in range(NBUCKETS):
+            n += c[i + b]
+        return n
+
+    def percentile(self, stage, p):
+        """ Upper bound in us of the p-th percentile of stage, 0 without samples. """
+        n = self.count(stage)
+        if not n:
+            return 0
+        c = self.counts
+        i = stage * NBUCKETS
+        want = (n * p + 99) // 100
+        acc = 0
+        for b in range(NBUCKETS):
+            acc += c[i + b]
+            if acc >= want:
+                if b == 0:
+                    return 0
+                if b == NBUCKETS - 1:
+                    return self.max[stage]
+                return min((1 << b) - 1, self.max[stage])
+        return self.max[stage]
+
+    def dump(self, out=None):
+        """ Print the table; out is a stream (e.g. a UART) instead of the console. """
+        lines = ["{:<10s}{:>8s}{:>10s}{:>10s}{:>10s}{:>10s}".format(
+            "stage", "n", "p50 us", "p90 us", "p99 us", "max us")]
+        for s in range(len(self.names)):
+            lines.append("{:<10s}{:>8d}{:>10d}{:>10d}{:>10d}{:>10d}".format(
+                self.names[s], self.count(s), self.percentile(s, 50),
+                self.percentile(s, 90), self.percentile(s, 99), self.max[s]))
+        for ln in lines:
+            if out is None:
+                print(ln)
+            else:
+                out.write(ln + "\r\n")
+
+    def poll_console(self):
+        """ Handle "h" (dump) and "r" (reset) typed on the console; never blocks. """
+        if self._poll is None:
+            import select
+            self._poll = select.poll()
+            self._poll.register(sys.stdin, select.POLLIN)
+        while self._poll.poll(0):
+            c = sys.stdin.read(1)
+            if not c:
+                return
+            if c in "hH":
+                self.dump()
+            elif c in "rR":
+                self.reset()
+                print("loop histograms cleared")
@@ -8,10 +8,18 @@ import network
 import ntptime
 from machine import Pin, UART
 from rp2 import country
-from time import sleep, ticks_ms
+from time import sleep, ticks_ms, ticks_us, ticks_add, ticks_diff
 import utime
 from secrets import SSID, PASSWORD, TIMEZONE_OFFSET
 import struct
+
+use_loop_hist = False  # ticks_us histograms per loop stage; type "h" on the console to dump them
+if use_loop_hist:
+    from loophist import LoopHist
+    # stages of the main() loop; "send" includes the second the led stays on
+    ST_WIFI, ST_NTP, ST_SEND, ST_IDLE = range(4)
+    loop_hist = LoopHist(("wifi", "ntp", "send", "idle"))
+use_ping = False  # answer the time pings of the XIAO while waiting (set use_ping in its main.py too)
         
 unixtime = 0
 tz_offset = int(TIMEZONE_OFFSET)
@@ -23,6 +31,9 @@ tx = Pin(0, Pin.OUT)
 rx = Pin(1, Pin.IN)
 uart = UART(0, 9600, tx = machine.Pin.board.GP0, rx= machine.Pin.board.GP1)
 #uart.init(9600, bits=8, parity=None, stop=1)
+if use_ping:
+    from uartping import PingServer
+    ping = PingServer(uart)
 
 # connect to wifi
 wlan = network.WLAN(network.STA_IF, pin_on=32, pin_out=35, pin_in=35, pin_wake=35, pin_clock=34, pin_cs=33)
@@ -87,7 +98,12 @@ def handle_ntp():
     yd = 7 # 125 day of the year
     
     try:
+        t0 = ticks_us()
         ntp_time = ntptime.time()  # get datetime (UNIX TIME) (EPOCH)
+        t1 = ticks_us()
+        if use_ping:
+            # the server time is of about the middle of the query
+            ping.set_reference(ntp_time, ticks_add(t0, ticks_diff(t1, t0) // 2))
     except OSError as exc:
         print(f"OSError: {exc.args[0]}, {exc}")
 
@@ -122,9 +138,15 @@ def send_unix():
 
         uart.write(tx_buf)
         print(f"unixtime {unixtime}, tx_buf = {tx_buf}, list(tx_buf) = {list(tx_buf)} sent via UART")
-        sleep(1) # leave led on for one second
+        wait(1000) # leave led on for one second
         led.value(0)
 
+def wait(ms):
+    if use_ping:
+        ping.serve(ms)  # answers the pings of the XIAO meanwhile
+    else:
+        sleep(ms / 1000)
+
 start_t = ticks_ms()
 
 def main():
@@ -134,9 +156,11 @@ def main():
     elapsed_t = 0
     start = True
     print(f"main(): unixtime send interval = {int(interval_t/60000)} minutes")
+    t_lap = ticks_us() # start of the current loop stage
     while True:
         if wlan.isconnected() == False:
             do_connect()
+        if use_loop_hist: t_lap = loop_hist.lap(ST_WIFI, t_lap)
         # Check again at interval
         curr_t = ticks_ms()
         elapsed_t = curr_t - start_t
@@ -145,9 +169,14 @@ def main():
             start_t = curr_t
             if wlan.isconnected() == True:
                 handle_ntp()
+                if use_loop_hist: t_lap = loop_hist.lap(ST_NTP, t_lap)
                 send_unix()
+                if use_loop_hist: t_lap = loop_hist.lap(ST_SEND, t_lap)
  
-        sleep(10)
+        wait(10000)
+        if use_loop_hist:
+            t_lap = loop_hist.lap(ST_IDLE, t_lap)
+            loop_hist.poll_console()
     
 if __name__ == "__main__":
     main()
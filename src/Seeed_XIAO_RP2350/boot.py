@@ -1,7 +1,14 @@
 from lib.sdcard import SDCard
+from lib.sdcache import BlockCache
 from machine import Pin
 import os, sys
 
+use_sd_cache = True  # cache FAT/directory sectors and small writes in RAM
+sd_cache_blocks = 8  # number of 512-byte sectors in the cache
+sd_cache_flush_ms = 5000  # write back dirty sectors at least this often
+sd_read_ahead = 4  # blocks to prefetch while a file is read in sequence (0 = off)
+sd_crc = False  # CRC mode: verify every block read and let the card check writes
+
 def mount_sd():
     PIN_SD_SCK  = machine.Pin.board.GP2
     PIN_SD_MOSI = machine.Pin.board.GP3
@@ -14,10 +21,15 @@ def mount_sd():
         mosi=machine.Pin(PIN_SD_MOSI, machine.Pin.OUT),
         miso=machine.Pin(PIN_SD_MISO, machine.Pin.OUT))
 
-    sd = SDCard(sd_spi, machine.Pin(PIN_SD_CS))
+    # auto_baudrate: raise the SPI clock to what the card supports (CSD)
+    card = SDCard(sd_spi, machine.Pin(PIN_SD_CS), read_ahead=sd_read_ahead, auto_baudrate=True,
+                  crc_mode=sd_crc)
+    sd = card
+    if use_sd_cache:
+        sd = BlockCache(card, nblocks=sd_cache_blocks, flush_ms=sd_cache_flush_ms)
     try:
         os.mount(sd, "/sd")
-        print("SDCard mounted")
+        print("SDCard mounted, SPI clock = {:d} kHz".format(card.baudrate // 1000))
         return True
     except OSError as exc:
         print("mounting SDCard failed")
@@ -0,0 +1,206 @@
+"""
+LRU block cache with write-back for a block device like SDCard.
+
+Keeps a fixed number of 512-byte sectors in a preallocated pool. FAT and
+directory sectors that are read over and over are served from RAM, and
+small appends to a file only change the cached sector until it is written
+back. Dirty sectors are written back when the filesystem syncs (ioctl op 3,
+FatFS does this on file close and flush), when they are evicted, and
+optionally every flush_ms milliseconds.
+
+Multi-block reads and writes of sectors that are not cached go straight
+to the device, so large file transfers do not flush the cache.
+
+Example usage (boot.py):
+
+    sd = SDCard(sd_spi, machine.Pin(PIN_SD_CS))
+    os.mount(BlockCache(sd, nblocks=8, flush_ms=5000), "/sd")
+
+"""
+
+from micropython import const
+from array import array
+
+_BLOCK = const(512)
+
+
+class BlockCache:
+    def __init__(self, dev, nblocks=8, flush_ms=0):
+        self.dev = dev
+        self.nblocks = nblocks
+        self.pool = bytearray(nblocks * _BLOCK)
+        mv = memoryview(self.pool)
+        self.slots = [mv[i * _BLOCK : (i + 1) * _BLOCK] for i in range(nblocks)]
+        self.tags = array("l", [-1] * nblocks)  # block number per slot
+        self.used = array("L", [0] * nblocks)   # LRU stamp per slot
+        self.dirty = bytearray(nblocks)
+        self.stamp = 0
+        self.hits = 0
+        self.misses = 0
+        self.writebacks = 0
+        self._busy = False
+        self._flush_pending = False
+        self.timer = None
+        if flush_ms:
+            from machine import Timer
+            self.timer = Timer(period=flush_ms, mode=Timer.PERIODIC, callback=self._on_timer)
+
+    # --- timer flush ---
+
+    def _on_timer(self, t):
+        import micropython
+        try:
+            micropython.schedule(self._scheduled_flush, None)
+        except RuntimeError:
+            pass  # schedule queue full, try again next period
+
+    def _scheduled_flush(self, _):
+        if self._busy:
+            # the filesystem is inside a block access; flush when it is done
+            self._flush_pending = True
+        else:
+            self.flush()
+
+    def _done(self):
+        self._busy = False
+        if self._flush_pending:
+            self._flush_pending = False
+            self.flush()
+
+    # --- cache ---
+
+    def _find(self, block_num):
+        tags = self.tags
+        for i in range(self.nblocks):
+            if tags[i] == block_num:
+                return i
+        return -1
+
+    def _touch(self, i):
+        self.stamp += 1
+        self.used[i] = self.stamp
+
+    def _write_back(self, i):
+        if self.dirty[i]:
+            self.dev.writeblocks(self.tags[i], self.slots[i])
+            self.dirty[i] = 0
+            self.writebacks += 1
+
+    def _victim(self):
+        # free slot or least recently used one, written back if dirty
+        tags = self.tags
+        used = self.used
+        v = 0
+        for i in range(self.nblocks):
+            if tags[i] < 0:
+                return i
+            if used[i] < used[v]:
+                v = i
+        self._write_back(v)
+        self.tags[v] = -1
+        return v
+
+    def _load(self, block_num):
+        i = self._find(block_num)
+        if i >= 0:
+            self.hits += 1
+        else:
+            self.misses += 1
+            i = self._victim()
+            self.dev.readblocks(block_num, self.slots[i])
+            self.tags[i] = block_num
+        self._touch(i)
+        return i
+
+    def flush(self):
+        """ Write back all dirty sectors. """
+        for i in range(self.nblocks):
+            if self.tags[i] >= 0:
+                self._write_back(i)
+
+    def invalidate(self, first=0, count=-1, write_back=True):
+        """ Drop cached sectors, dirty ones are written back unless write_back is False. """
+        for i in range(self.nblocks):
+            b = self.tags[i]
+            if b >= first and (count < 0 or b < first + count):
+                if write_back:
+                    self._write_back(i)
+                self.dirty[i] = 0
+                self.tags[i] = -1
+
+    def erase(self, first, count):
+        """ Erase blocks on the device; cached copies are dropped. """
+        self.invalidate(first, count, write_back=False)
+        self.dev.erase(first, count)
+
+    def stats(self):
+        return self.hits, self.misses, self.writebacks
+
+    def print_stats(self):
+        total = self.hits + self.misses
+        print("BlockCache: hits {:d}, misses {:d} ({:d}% hits), writebacks {:d}".format(
+            self.hits, self.misses, (100 * self.hits // total) if total else 0, self.writebacks))
+
+    # --- block device protocol ---
+
+    def readblocks(self, block_num, buf):
+        self._busy = True
+        try:
+            nblocks = len(buf) // _BLOCK
+            if nblocks == 1:
+                buf[:] = self.slots[self._load(block_num)]
+                return
+            mv = memoryview(buf)
+            # serve cached sectors from RAM, read runs of the others in one go
+            i = 0
+            while i < nblocks:
+                s = self._find(block_num + i)
+                if s >= 0:
+                    self.hits += 1
+                    self._touch(s)
+                    mv[i * _BLOCK : (i + 1) * _BLOCK] = self.slots[s]
+                    i += 1
+                    continue
+                j = i + 1
+                while j < nblocks and self._find(block_num + j) < 0:
+                    j += 1
+                self.misses += j - i
+                self.dev.readblocks(block_num + i, mv[i * _BLOCK : j * _BLOCK])
+                i = j
+        finally:
+            self._done()
+
+    def writeblocks(self, block_num, buf):
+        self._busy = True
+        try:
+            nblocks = len(buf) // _BLOCK
+            if nblocks == 1:
+                i = self._find(block_num)
+                if i < 0:
+                    # no need to read a sector that is overwritten completely
+                    i = self._victim()
+                    self.tags[i] = block_num
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                self.slots[i][:] = buf
+                self.dirty[i] = 1
+                self._touch(i)
+                return
+            # bulk write goes through; keep cached copies up to date
+            self.dev.writeblocks(block_num, buf)
+            mv = memoryview(buf)
+            for i in range(self.nblocks):
+                b = self.tags[i] - block_num
+                if 0 <= b < nblocks:
+                    self.slots[i][:] = mv[b * _BLOCK : (b + 1) * _BLOCK]
+                    self.dirty[i] = 0
+        finally:
+            self._done()
+
+    def ioctl(self, op, arg):
+        if op == 3 or op == 2:  # sync, deinit
+            self.flush()
+        if op == 6:  # erase block
+            self.invalidate(arg, 1, write_back=False)
+        return self.dev.ioctl(op, arg)
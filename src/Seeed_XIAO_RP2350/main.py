@@ -8,7 +8,17 @@ import os
 
 use_bme280 = True
 use_mcp9808 = False
-my_debug = False
+log_level = 3  # console output: 0 off, 1 errors, 2 + warnings, 3 + the clock view each second, 4 + debug
+use_logger = True  # log sensor values and RTC sync offset to the SD card
+log_dir = "/sd/LOG"  # one log segment per day: YYYYMMDD.BIN and its index YYYYMMDD.IDX
+log_flush_s = 60  # write a partly filled log sector at most once a minute
+log_compress = True  # delta + varint encoded records, ~3x fewer sector writes
+log_keep_days = 30  # raw segments older than this are deleted after the rollup
+log_rollup_sectors = 8  # log sectors rolled up into the minute/hour aggregates per loop pass
+use_loop_hist = False  # ticks_us histograms per loop stage; "h" on the console or "?H" on the UART dumps them
+use_bus_trace = False  # record the I2C and UART traffic in RAM, dumped to trace_dir on errors or "?T" on the UART
+trace_dir = "/sd/TRACE"  # dumps 00.BTR .. 07.BTR, read with python -m mpsim.replay on a PC
+use_ping = False  # measure the UART delay with pings to the Pico and set the RTC at the start of an NTP second (set use_ping in its main.py too)
  
 # Micropython script for a Seeed XIAO RP2350 attached to a Seeed Expansion Board Base
 # Test to receive ntp unixtime from another device: Pimoroni Pico Plus 2 with RM2 module attached
@@ -45,17 +55,29 @@ my_debug = False
    That worked!
 """
 
-i2c=machine.I2C(1)
-
 try:
     os.chdir('/sd')
 
+    from lib.conlog import ConsoleLog, INFO, DEBUG
+    from lib.i2cbus import I2CBus, PRIO_RTC, PRIO_SENSOR, PRIO_DISPLAY, negotiate_speeds, print_speeds
+
     from lib.pcf8563 import *
     if use_mcp9808:
         from lib.mcp9808 import MCP9808
     if use_bme280:
         from lib.bme280_f import BME280
     from lib.ssd1306 import SSD1306_I2C
+    from lib.glyphs import GlyphCache, TextField, DEFAULT_CHARS
+    if use_logger:
+        from lib.tslog import TSLogger, FLAG_SYNCED, FLAG_BME280, FLAG_MCP9808
+        from lib.tsindex import TSIndex
+        from lib.tsrollup import Rollup, segment_path
+    if use_loop_hist:
+        from lib.loophist import LoopHist
+    if use_bus_trace:
+        from lib.bustrace import BusTrace, TracedI2C, TracedUART
+    if use_ping:
+        from lib.uartping import PingClient, PONG
     tz_offset = 0
     from lib.secrets import TIMEZONE_OFFSET # get the local timezone offset from GMT
     tz_offset = int(TIMEZONE_OFFSET)
@@ -67,17 +89,38 @@ except OSError as exc:
     print(f"Error: {exc}")
     raise
 
+# messages go to a ring buffer that the loop drains to the USB console
+# without waiting for it; "?L0" .. "?L4" on the UART sets the level
+log = ConsoleLog(level=log_level)
+LEVEL_CMD = b"?L"
+
+# All drivers share I2C(1) through the arbiter: RTC before sensors before display
+if use_bus_trace:
+    # 16 KiB of records (about 10 s of the loop), the first 4 KiB (setup)
+    # kept; the wrapper re-creates the bus at other clock speeds, so I2CBus
+    # gets no bus_id
+    bus_trace = BusTrace(16384, keep=4096)
+    i2c = I2CBus(TracedI2C(machine.I2C(1), bus_trace, bus_id=1))
+else:
+    i2c = I2CBus(machine.I2C(1), bus_id=1)
+i2c.configure(0x51, prio=PRIO_RTC, name="PCF8563")
+i2c.configure(0x18, prio=PRIO_SENSOR, name="MCP9808")
+i2c.configure(0x76, prio=PRIO_SENSOR, name="BME280")
+i2c.configure(0x3C, prio=PRIO_DISPLAY, name="SSD1306")
+# find the fastest reliable clock speed per device (default is 100 kHz)
+print_speeds(i2c, negotiate_speeds(i2c))
 
 if use_mcp9808:
     sensor = MCP9808(i2c) # create an instance of the MCP9808 sensor object
+    sensor.set_shutdown_mode(True) # only wake up for one-shot readings (saves ~200 uA)
 if use_bme280:
     bme280 = BME280(i2c=i2c)
+    bme_res = array.array("f", [0, 0, 0]) # temperature, pressure, humidity
 
 oled = SSD1306_I2C(128, 32, i2c) # create an instance of the OLED object
  
 rtc = PCF8563(i2c) # create an instance of the rtc object
-if my_debug:
-    print(f"type(rtc) = {type(rtc)}")
+log.debug("type(rtc) = {}", type(rtc))
 
 monthsLst = ["", "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
 
@@ -89,6 +132,14 @@ wdDict = {0: "Mon",
           5: "Sat",
           6: "Sun"}
 
+# pre-render the characters of the clock view once
+glyphs = GlyphCache(DEFAULT_CHARS + "TempPrsHuCha" + "".join(wdDict.values()))
+fld_sensor = TextField(glyphs, 0, 0)
+fld_date = TextField(glyphs, 0, 10)
+fld_wday = TextField(glyphs, 0, 20)
+fld_time = TextField(glyphs, 30, 20)
+clock_fields = (fld_sensor, fld_date, fld_wday, fld_time)
+
 brill = 10  # Let the RGB Led shine just a bit
 
 RED   = (0,   brill,     0)
@@ -98,17 +149,55 @@ BLACK = (0,       0,     0)
 
 
 uart = UART(0, 9600, tx = machine.Pin.board.GP0, rx= machine.Pin.board.GP1)
-if my_debug:
-    print(f"type(uart) = {type(uart)}")
+if use_bus_trace:
+    uart = TracedUART(uart, bus_trace, 0)
+log.debug("type(uart) = {}", type(uart))
+# after each unixtime received: PING_COUNT pings, the one of the smallest
+# delay gives the NTP time; the RTC is set when the first NTP second at
+# least PING_LEAD_US later starts (time for the work in between)
+PING_COUNT = 4
+PING_LEAD_US = 50000
+if use_ping:
+    ping = PingClient(uart)
 
 local_time_lst = []
 weekdayStr = ""
 yearday = 0
+sync_offset = 0 # RTC minus NTP time in seconds at the last sync
+synced = False
+
+# stages of the main() loop for the latency histograms
+ST_UART, ST_SENSOR, ST_LOG, ST_RTC, ST_CONSOLE, ST_DISPLAY, ST_IDLE = range(7)
+HIST_CMD = b"?H"  # received on the UART: send the histograms back
+if use_loop_hist:
+    loop_hist = LoopHist(("uart", "sensor", "log", "rtc", "console", "display", "idle"))
+TRACE_CMD = b"?T"  # received on the UART: dump the bus trace
+TRACE_FILES = 8
+TRACE_MIN_MS = 60000  # at most one dump on an error per minute
+trace_dumps = 0
+trace_reasons = set()  # errors dumped since the start, each only once
+trace_last_ms = None  # ticks_ms() of the last dump on an error
+if use_bus_trace:
+    try:
+        os.mkdir(trace_dir)
+    except OSError:
+        pass  # exists
+    trace_dumps = len(os.listdir(trace_dir))
+
+log_day = -1  # date of the open log segment, as (yy * 13 + mo) * 32 + dd
+tslogger = None
+tsindex = None
+if use_logger:
+    try:
+        os.mkdir(log_dir)
+    except OSError:
+        pass  # exists
+    rollup = Rollup(log_dir, keep_days=log_keep_days)
 #    yy, mo, dd, wd, hh, mm, ss
 # dt = (25, 5, 5, 0, 18, 20, 40) # pro-forma datetime tuple
 # rtc.DateTime(dt) # set the rtc
-if my_debug:
-    print(rtc.DateTime())
+if log.enabled(DEBUG):
+    log.debug("{}", rtc.DateTime())
 
 # setup for RGB Led:
 NUM_LEDS = 1
@@ -158,7 +247,7 @@ def set_led_color(color):
 
 
 def handle_rx_buf(rx_buf):
-    global unixtime, weekdayStr, yearday
+    global unixtime, weekdayStr, yearday, sync_offset, synced
     t1 = "Unable to get time from NTP server.\n\nCheck your network and try again."
     TAG = "handle_rx_buf(): "
     ret = False
@@ -168,8 +257,8 @@ def handle_rx_buf(rx_buf):
 
     if isinstance(rx_buf, bytes):
         set_led_color(GREEN)
-        print(line)
-        print(TAG + "unixtime data received via UART")
+        log.info(line)
+        log.info("{}unixtime data received via UART", TAG)
         # print(f"rx_buf = {rx_buf}, list(rx_buf) = {list(rx_buf)}")
         try:
             for i in range(3, 0, -1):
@@ -178,38 +267,49 @@ def handle_rx_buf(rx_buf):
         except IndexError: # occurred when something erratically occurred,
             #                for instance that the other device was reset.
             set_led_color(BLACK)
+            if use_bus_trace:
+                dump_bus_trace("short rx_buf")
             return ret
         if i > 0:
-            if my_debug:
-                print(TAG + f"nr of bytes (with a value > 0) = {i}")
+            log.debug("{}nr of bytes (with a value > 0) = {}", TAG, i)
             # Convert bytearray back to integer
             ux_val = struct.unpack(">L", rx_buf)[0]  # 'L' is for a 32-bit integer (unsigned long)
-            if my_debug:
-                print(TAG + f"rx_buf = {rx_buf}, ux_val = {ux_val}")
+            log.debug("{}rx_buf = {}, ux_val = {}", TAG, rx_buf, ux_val)
             if ux_val <= 0:
                 set_led_color(BLACK)
                 return ret
                 
         time.sleep(0.01)
+    set_at = None
+    if ux_val > 0 and use_ping and ping.burst(PING_COUNT) >= 0:
+        log.debug("{}ping delay = {} us, lost = {}", TAG, ping.delay, ping.lost)
+        ux_val, set_at = ping.next_second(PING_LEAD_US)
     if ux_val > 0:
         unixtime = ux_val + (tz_offset * 3600)
-        if my_debug:
-            print(TAG + f"ux_val = {ux_val}, unixtime (+ timezone offset) = {unixtime}")
+        log.debug("{}ux_val = {}, unixtime (+ timezone offset) = {}", TAG, ux_val, unixtime)
         #unix_to_rtc()
         gmtTime = utime.localtime(ux_val)
         loctime = utime.localtime(unixtime)
-        if my_debug:
-            print(TAG + f"gmtTime = {gmtTime}")
-            print(TAG + f"loctime = {loctime}")
+        log.debug("{}gmtTime = {}", TAG, gmtTime)
+        log.debug("{}loctime = {}", TAG, loctime)
         upd_time = ( loctime[0], loctime[1], loctime[2],
                      loctime[6],
                      loctime[3], loctime[4], loctime[5])
         weekdayStr = wdDict[loctime[6]]
         yearday = loctime[7]
+        if set_at is None:
+            sync_offset = rtc_unixtime() - unixtime
+        else:
+            sync_offset = rtc_unixtime() - (ping.now() + (tz_offset * 3600))
+            # the RTC restarts its second with the write
+            wait = time.ticks_diff(set_at, time.ticks_us())
+            if wait > 0:
+                time.sleep_us(wait)
+        synced = True
         rtc.DateTime(upd_time)
-        if not my_debug:
-            print(TAG + f"rtc updated from ntp: {rtc.DateTime()}")
-        print(line)
+        if log.enabled(INFO):
+            log.info("{}rtc updated from ntp: {}", TAG, rtc.DateTime())
+        log.info(line)
         time.sleep(1) # leave the RGB Led on for a while!
         
         ret = True
@@ -217,6 +317,74 @@ def handle_rx_buf(rx_buf):
     set_led_color(BLACK)
     return ret
 
+def dump_bus_trace(reason, on_error=True):
+    # on_error: only the first time of each reason and at most once per
+    # TRACE_MIN_MS, so that a lasting fault neither writes 16 KiB to the
+    # card every second nor overwrites the trace of its first occurrence
+    global trace_dumps, trace_last_ms
+    if on_error:
+        now = time.ticks_ms()
+        if reason in trace_reasons or (trace_last_ms is not None
+                                       and time.ticks_diff(now, trace_last_ms) < TRACE_MIN_MS):
+            return
+        trace_reasons.add(reason)
+        trace_last_ms = now
+    bus_trace.mark(reason)
+    path = "{:s}/{:02d}.BTR".format(trace_dir, trace_dumps % TRACE_FILES)
+    trace_dumps += 1
+    try:
+        stamp = rtc_unixtime()
+    except OSError:
+        stamp = 0
+    try:
+        n = bus_trace.dump(path, stamp)
+        log.warn("bus trace: {} records written to {} ({})", n, path, reason)
+    except OSError as exc:
+        log.error("bus trace: dump to {} failed: {}", path, exc)
+
+def rtc_unixtime():
+    dt = rtc.DateTime()
+    return utime.mktime((dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], dt[3], 0))
+
+def open_log_segment(day, ts):
+    # ts: unix time of 00:00 of the day, the base of the segment
+    global tslogger, tsindex, log_day
+    if tslogger:
+        tslogger.close()
+        tsindex.close()
+    path = segment_path(log_dir, ts)
+    tsindex = TSIndex(path, segment_path(log_dir, ts, ".IDX"))
+    tslogger = TSLogger(path, flush_s=log_flush_s, index=tsindex, compress=log_compress,
+                        base=ts)
+    tsindex.catch_up() # sectors logged while there was no index
+    log_day = day
+    # roll up the closed segments into minute/hour aggregates, see rollup_step()
+    rollup.start(current=path, now=ts)
+
+def rollup_step():
+    # a few sectors of the rollup per loop pass, so a backlog of days does
+    # not hold up the UART and the display
+    if not rollup.active or rollup.step(log_rollup_sectors):
+        return
+    n, n_min, n_hour, n_old = rollup.result
+    if n or n_old:
+        log.info("rollup: {} segments, {} minute and {} hour records, {} retired", n, n_min, n_hour, n_old)
+    if rollup.skipped:
+        log.warn("rollup: {} aggregates skipped, already in the files", rollup.skipped)
+
+def log_values(v0, v1, v2, flags):
+    global synced
+    # the date and the seconds of the day as small ints: a unix time is a
+    # long int on the heap, one more allocation every second
+    dt = rtc.DateTime()
+    day = (dt[0] * 13 + dt[1]) * 32 + dt[2]
+    if day != log_day:
+        open_log_segment(day, utime.mktime((dt[0], dt[1], dt[2], 0, 0, 0, dt[3], 0)))
+    if synced:
+        flags |= FLAG_SYNCED
+        synced = False
+    tslogger.add(dt[4] * 3600 + dt[5] * 60 + dt[6], v0, v1, v2, sync_offset, flags)
+
 def weekday():
     dt = rtc.DateTime()
     # print(f"weekday(): dt = {dt}")
@@ -228,8 +396,7 @@ def weekday():
  
 def dtToStr():
     loctime = rtc.DateTime()
-    if not my_debug:
-        print(f"dtToStr(): rtc.DateTime() = {loctime}")
+    log.debug("dtToStr(): rtc.DateTime() = {}", loctime)
     return "{:s} {:4d}-{:02d}-{:02d} {:02d}:{:02d}:{:02d}".format(
         wdDict[loctime[3]],
         loctime[0], loctime[1], loctime[2],
@@ -237,22 +404,17 @@ def dtToStr():
 
 def intro_msg():
     t_lst = ["XIAO RP2350 ", "NTP unixtime ", "via UART ", "from ", "Pimoroni ", "Pico Plus 2"]
+    log.info("".join(t_lst))
     oled.fill(0)
     oled.text(t_lst[0], 0, 0)
-    print(t_lst[0], end='')
     oled.text(t_lst[1], 0, 10)
-    print(t_lst[1], end='')
     oled.text(t_lst[2], 0, 20)
-    print(t_lst[2], end='')
     oled.show()
     time.sleep(3)
     oled.fill(0)
     oled.text(t_lst[3], 0, 0)
-    print(t_lst[3], end='')
     oled.text(t_lst[4], 0, 10)
-    print(t_lst[4], end='')
     oled.text(t_lst[5], 0, 20)
-    print(t_lst[5], end='\n')
     oled.show()
     time.sleep(3)
 
@@ -264,23 +426,48 @@ def main():
     show_keep_cnt = 0
     show_keep_max = 4
     intro_msg()
+    oled.fill(0)
+    for fld in clock_fields:
+        fld.invalidate()
     t2 = ""
+    t_lap = time.ticks_us() # start of the current loop stage
     while True:
         try:
             rx_buf = bytearray(buflen) # create a clean buffer
             rx_buf = uart.read()
             # print(f"type(rx_buf) = {type(rx_buf)}")
             if isinstance(rx_buf, bytes):
-                handle_rx_buf(rx_buf)
+                if use_loop_hist and rx_buf == HIST_CMD:
+                    loop_hist.dump(uart)
+                elif use_bus_trace and rx_buf == TRACE_CMD:
+                    dump_bus_trace("requested", on_error=False)
+                elif len(rx_buf) == 3 and rx_buf[:2] == LEVEL_CMD and 0x30 <= rx_buf[2] <= 0x34:
+                    log.set_level(rx_buf[2] - 0x30)
+                elif use_ping and rx_buf[:2] == PONG:
+                    log.debug("late ping answer")
+                else:
+                    handle_rx_buf(rx_buf)
+            if use_loop_hist: t_lap = loop_hist.lap(ST_UART, t_lap)
             if use_mcp9808:
-                tempC = sensor.get_temp()
+                tempC = sensor.get_temp_one_shot()
+                if use_loop_hist: t_lap = loop_hist.lap(ST_SENSOR, t_lap)
                 if isinstance(tempC, float):
                     t = "Temp: {:<5.2f}C".format(tempC)
+                    if use_logger:
+                        log_values(int(tempC * 100), 0, 0, FLAG_MCP9808)
+                if use_loop_hist: t_lap = loop_hist.lap(ST_LOG, t_lap)
             if use_bme280:
-                if not my_debug:
-                    v = bme280.values
-                    print(f"\nbme280.values = {v}")
+                bme280.read_compensated_data(bme_res)
+                if use_loop_hist: t_lap = loop_hist.lap(ST_SENSOR, t_lap)
+                v = ("{:.2f}C".format(bme_res[0]), "{:.2f}hPa".format(bme_res[1]/100),
+                     "{:.2f}%".format(bme_res[2]))
+                log.info("\nbme280.values = {}", v)
                     # example: bme280.values = ('22.40C', '1000.68hPa', '43.85%')
+                if use_loop_hist: t_lap = loop_hist.lap(ST_CONSOLE, t_lap)
+                if use_logger:
+                    # 0.01 C, Pa, 0.01 %rH
+                    log_values(int(bme_res[0] * 100), int(bme_res[1]), int(bme_res[2] * 100), FLAG_BME280)
+                if use_loop_hist: t_lap = loop_hist.lap(ST_LOG, t_lap)
 
   
                 t = ""
@@ -295,22 +482,32 @@ def main():
                 # to keep the view less nervous
                 t2 = t
             dt = rtc.Date()
-            print(f"date    = {dt}")
             tm = rtc.Time()
-            print(f"time    = {tm}")
-            print(f"weekday = {weekdayStr}")
-            print(f"yearday = {yearday}")
-            print(dtToStr(), end ='')
-            print(' ', end='')
-            print(t2)
+            if use_loop_hist: t_lap = loop_hist.lap(ST_RTC, t_lap)
+            log.info("date    = {}", dt)
+            log.info("time    = {}", tm)
+            log.info("weekday = {}", weekdayStr)
+            log.info("yearday = {}", yearday)
+            if log.enabled(INFO):
+                log.info("{} {}", dtToStr(), t2)
+            if use_loop_hist: t_lap = loop_hist.lap(ST_CONSOLE, t_lap)
             
-            oled.fill(0)
-            oled.text(t2,  0,  0)
-            oled.text(dt, 0, 10)
-            oled.text(weekday(), 0, 20)
-            oled.text(tm, 30, 20)
+            t_render = time.ticks_us()
+            fld_sensor.update(oled, t2)
+            fld_date.update(oled, dt)
+            fld_wday.update(oled, weekday())
+            fld_time.update(oled, tm)
+            t_render = time.ticks_diff(time.ticks_us(), t_render)
 
             oled.show()
+            if use_loop_hist: t_lap = loop_hist.lap(ST_DISPLAY, t_lap)
+            if use_logger:
+                rollup_step()
+                if use_loop_hist: t_lap = loop_hist.lap(ST_LOG, t_lap)
+            if log.enabled(DEBUG):
+                log.debug("render time = {} us, oled.bytes_sent = {}", t_render, oled.bytes_sent)
+                log.flush()
+                i2c.print_stats()
             if use_bme280 and show_keep_cnt == 0:
                 bme_val_idx += 1
                 if bme_val_idx >=3:
@@ -318,10 +515,22 @@ def main():
             show_keep_cnt += 1
             if show_keep_cnt > show_keep_max:
                 show_keep_cnt = 0
+            log.drain()
+            if use_loop_hist: t_lap = loop_hist.lap(ST_CONSOLE, t_lap)
             time.sleep(1)
+            if use_loop_hist:
+                t_lap = loop_hist.lap(ST_IDLE, t_lap)
+                loop_hist.poll_console()
             
         except OSError as exc:
-            print(f"Error: {exc.args[0]}")
+            log.error("Error: {}", exc.args[0])
+            if use_bus_trace:
+                dump_bus_trace(f"OSError {exc.args[0]}")
+        except RuntimeError as exc: # e.g. "Sensor BME280 not ready"
+            if use_bus_trace:
+                dump_bus_trace(str(exc))
+            log.flush()
+            raise
             
 if __name__ == '__main__':
     main()
@@ -0,0 +1,306 @@
+# I2C and UART traffic recorder
+#
+# TracedI2C and TracedUART wrap a machine.I2C / machine.UART object, pass
+# every call on and record it into a BusTrace: one preallocated bytearray,
+# so recording allocates nothing for the usual calls. Each record is a
+# 16 byte header plus data:
+#
+#   <IIBBHHH  ticks_us, ticks_ms, op, addr (UART id), reg (NOREG if none),
+#             n (bytes of the transfer), stored (data bytes that follow)
+#
+# Reads keep all their bytes, writes their first wmax bytes (display
+# frames would fill the buffer otherwise). A call that raised OSError is
+# recorded with ERR set in op and the errno as its one data byte.
+#
+# The first `keep` bytes of the buffer hold the first records after the
+# start (device probing, calibration reads) and are never overwritten;
+# the rest is a ring in which new records evict the oldest ones.
+# dump(path) writes both to a file:
+#
+#   <4sBBHIIIII  b"BTRC", version, wmax, 0, records in the head part,
+#                records in the ring part, records dropped in between,
+#                stamp (e.g. the RTC unixtime), ticks_ms at the dump
+#
+# followed by the records. The host package mpsim (src/host) lists a dump
+# and replays it into the unmodified drivers:
+#
+#   python -m mpsim.replay list TRACE/00.BTR
+#   python -m mpsim.replay run TRACE/00.BTR
+#
+# License: MIT
+
+from micropython import const
+import struct
+import time
+
+# ops
+OP_WRITE = const(1)   # writeto(), writevto()
+OP_READ = const(2)    # readfrom(), readfrom_into()
+OP_WMEM = const(3)    # writeto_mem()
+OP_RMEM = const(4)    # readfrom_mem(), readfrom_mem_into()
+OP_SCAN = const(5)    # scan(); the data are the addresses found
+OP_FREQ = const(6)    # clock speed change; n is the new speed in kHz
+OP_UTX = const(8)     # UART write()
+OP_URX = const(9)     # UART read(), readinto(), readline() that returned data
+OP_MARK = const(15)   # mark(): text of the caller
+ERR = const(0x80)     # the call raised OSError, data: errno
+
+NOREG = const(0xFFFF)
+HDR_FMT = "<IIBBHHH"
+HDR_SIZE = const(16)
+FILE_FMT = "<4sBBHIIIII"
+FILE_MAGIC = b"BTRC"
+VERSION = const(1)
+
+
+class BusTrace:
+    def __init__(self, size=8192, keep=1024, wmax=16):
+        # size: bytes of the buffer
+        # keep: bytes at the start of it for the first records, never evicted
+        # wmax: data bytes kept of a write
+        if keep < 0 or size - keep < 4 * HDR_SIZE:
+            raise ValueError("trace buffer too small")
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.hdr = bytearray(HDR_SIZE)
+        self.ebuf = bytearray(1)
+        self.wbuf = bytearray(wmax)  # the start of a writevto(), joined
+        self.keep = keep
+        self.rsize = size - keep
+        self.wmax = wmax
+        self.enabled = True
+        self.clear()
+
+    def clear(self):
+        self.hlen = 0  # bytes used in the head part
+        self.hfull = self.keep == 0
+        self.hrecs = 0
+        self.rstart = 0  # oldest record in the ring
+        self.rlen = 0
+        self.rrecs = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.hrecs + self.rrecs
+
+    def record(self, op, addr, reg, data, n, size=-1):
+        # size: bytes of data to keep, -1 for all of them
+        if not self.enabled:
+            return
+        stored = 0 if data is None else (len(data) if size < 0 else size)
+        if stored > self.wmax and (op & ~ERR) in (OP_WRITE, OP_WMEM, OP_UTX):
+            stored = self.wmax
+        struct.pack_into(HDR_FMT, self.hdr, 0, time.ticks_us(), time.ticks_ms(),
+                         op, addr, reg, n, stored)
+        need = HDR_SIZE + stored
+        if not self.hfull:
+            p = self.hlen
+            if p + need <= self.keep:
+                self.mv[p:p + HDR_SIZE] = self.hdr
+                if stored:
+                    self.mv[p + HDR_SIZE:p + need] = memoryview(data)[:stored]
+                self.hlen += need
+                self.hrecs += 1
+                return
+            self.hfull = True
+        if need > self.rsize:
+            self.dropped += 1
+            return
+        while self.rsize - self.rlen < need:
+            self._evict()
+        p = self._put((self.rstart + self.rlen) % self.rsize, self.hdr, HDR_SIZE)
+        if stored:
+            self._put(p, data, stored)
+        self.rlen += need
+        self.rrecs += 1
+
+    def error(self, op, addr, reg, exc, n):
+        e = exc.args[0] if exc.args else 0
+        self.ebuf[0] = e if isinstance(e, int) and 0 <= e < 256 else 0xFF
+        self.record(op | ERR, addr, reg, self.ebuf, n)
+
+    def mark(self, text):
+        """ Record a note, e.g. why the trace is dumped. """
+        b = text.encode()
+        self.record(OP_MARK, 0, NOREG, b, len(b))
+
+    def _put(self, p, data, n):
+        # copy n bytes of data into the ring at p, wrapping at its end
+        base = self.keep
+        k = min(n, self.rsize - p)
+        src = memoryview(data)
+        self.mv[base + p:base + p + k] = src[:k]
+        if k < n:
+            self.mv[base:base + n - k] = src[k:n]
+        return (p + n) % self.rsize
+
+    def _evict(self):
+        # stored, the last header field, gives the length of the oldest record
+        b = self.buf
+        base = self.keep
+        rs = self.rsize
+        p = self.rstart
+        need = HDR_SIZE + (b[base + (p + 14) % rs] | b[base + (p + 15) % rs] << 8)
+        self.rstart = (p + need) % rs
+        self.rlen -= need
+        self.rrecs -= 1
+        self.dropped += 1
+
+    def dump(self, path, stamp=0):
+        """ Write the records to a file; returns their number. """
+        with open(path, "wb") as f:
+            f.write(struct.pack(FILE_FMT, FILE_MAGIC, VERSION, self.wmax, 0, self.hrecs,
+                                self.rrecs, self.dropped, stamp, time.ticks_ms()))
+            f.write(self.mv[:self.hlen])
+            base = self.keep
+            p = self.rstart
+            k = min(self.rlen, self.rsize - p)
+            f.write(self.mv[base + p:base + p + k])
+            if k < self.rlen:
+                f.write(self.mv[base:base + self.rlen - k])
+        return self.hrecs + self.rrecs
+
+
+class TracedI2C:
+    """ machine.I2C that records its transactions into a BusTrace. """
+
+    def __init__(self, i2c, trace, bus_id=None):
+        # bus_id: id of the hardware bus, used to re-create it at another
+        #         clock speed (as I2CBus does; pass it here, not to I2CBus,
+        #         so the new bus object is traced too)
+        self.i2c = i2c
+        self.trace = trace
+        self.bus_id = bus_id
+
+    def init(self, freq=100000, **kw):
+        if self.bus_id is not None:
+            from machine import I2C
+            self.i2c = I2C(self.bus_id, freq=freq)
+        else:
+            self.i2c.init(freq=freq, **kw)
+        self.trace.record(OP_FREQ, 0, NOREG, None, freq // 1000)
+
+    def scan(self):
+        try:
+            r = self.i2c.scan()
+        except OSError as exc:
+            self.trace.error(OP_SCAN, 0, NOREG, exc, 0)
+            raise
+        self.trace.record(OP_SCAN, 0, NOREG, bytes(r), len(r))
+        return r
+
+    def writeto(self, addr, buf, stop=True):
+        try:
+            r = self.i2c.writeto(addr, buf, stop)
+        except OSError as exc:
+            self.trace.error(OP_WRITE, addr, NOREG, exc, len(buf))
+            raise
+        self.trace.record(OP_WRITE, addr, NOREG, buf, len(buf))
+        return r
+
+    def writevto(self, addr, vector, stop=True):
+        n = 0
+        for buf in vector:
+            n += len(buf)
+        try:
+            r = self.i2c.writevto(addr, vector, stop)
+        except OSError as exc:
+            self.trace.error(OP_WRITE, addr, NOREG, exc, n)
+            raise
+        # the first buffer is the command or register, the rest the data
+        t = self.trace
+        head = vector[0]
+        k = len(head)
+        if len(vector) > 1 and k < t.wmax:
+            # keep the start of the data too, joined in the trace's own buffer
+            w = t.wbuf
+            data = vector[1]
+            m = min(t.wmax, k + len(data))
+            for i in range(k):
+                w[i] = head[i]
+            for i in range(k, m):
+                w[i] = data[i - k]
+            t.record(OP_WRITE, addr, NOREG, w, n, m)
+        else:
+            t.record(OP_WRITE, addr, NOREG, head, n)
+        return r
+
+    def readfrom(self, addr, nbytes, stop=True):
+        try:
+            r = self.i2c.readfrom(addr, nbytes, stop)
+        except OSError as exc:
+            self.trace.error(OP_READ, addr, NOREG, exc, nbytes)
+            raise
+        self.trace.record(OP_READ, addr, NOREG, r, nbytes)
+        return r
+
+    def readfrom_into(self, addr, buf, stop=True):
+        try:
+            self.i2c.readfrom_into(addr, buf, stop)
+        except OSError as exc:
+            self.trace.error(OP_READ, addr, NOREG, exc, len(buf))
+            raise
+        self.trace.record(OP_READ, addr, NOREG, buf, len(buf))
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        try:
+            r = self.i2c.readfrom_mem(addr, memaddr, nbytes, addrsize=addrsize)
+        except OSError as exc:
+            self.trace.error(OP_RMEM, addr, memaddr, exc, nbytes)
+            raise
+        self.trace.record(OP_RMEM, addr, memaddr, r, nbytes)
+        return r
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        try:
+            self.i2c.readfrom_mem_into(addr, memaddr, buf, addrsize=addrsize)
+        except OSError as exc:
+            self.trace.error(OP_RMEM, addr, memaddr, exc, len(buf))
+            raise
+        self.trace.record(OP_RMEM, addr, memaddr, buf, len(buf))
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        try:
+            self.i2c.writeto_mem(addr, memaddr, buf, addrsize=addrsize)
+        except OSError as exc:
+            self.trace.error(OP_WMEM, addr, memaddr, exc, len(buf))
+            raise
+        self.trace.record(OP_WMEM, addr, memaddr, buf, len(buf))
+
+
+class TracedUART:
+    """ machine.UART that records the bytes sent and received into a BusTrace. """
+
+    def __init__(self, uart, trace, uart_id=0):
+        self.uart = uart
+        self.trace = trace
+        self.id = uart_id
+
+    def __getattr__(self, name):
+        # any(), flush(), txdone(), init(), ... are passed on unrecorded
+        return getattr(self.uart, name)
+
+    def read(self, nbytes=-1):
+        r = self.uart.read() if nbytes < 0 else self.uart.read(nbytes)
+        if r:
+            self.trace.record(OP_URX, self.id, NOREG, r, len(r))
+        return r
+
+    def readinto(self, buf, nbytes=None):
+        n = self.uart.readinto(buf) if nbytes is None else self.uart.readinto(buf, nbytes)
+        if n:
+            self.trace.record(OP_URX, self.id, NOREG, memoryview(buf)[:n], n)
+        return n
+
+    def readline(self):
+        r = self.uart.readline()
+        if r:
+            self.trace.record(OP_URX, self.id, NOREG, r, len(r))
+        return r
+
+    def write(self, buf):
+        n = self.uart.write(buf)
+        if isinstance(buf, str):
+            buf = buf.encode()
+        self.trace.record(OP_UTX, self.id, NOREG, buf, len(buf))
+        return n
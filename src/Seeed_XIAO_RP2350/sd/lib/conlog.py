@@ -0,0 +1,130 @@
+# Levelled console log that does not block the caller
+#
+# print() on the USB console waits while the host does not read (a busy or
+# suspended terminal), which makes a loop late. ConsoleLog instead formats
+# a message only when its level is enabled, copies it into one
+# preallocated ring buffer and returns; drain() writes a bounded number of
+# bytes from the ring to sys.stdout when the console can take them, e.g.
+# once per loop before the sleep. A message that does not fit into the ring
+# is dropped and counted, never waited for.
+#
+#   >>> log = ConsoleLog(level=INFO)
+#   >>> log.info("date    = {}", dt)       # formatted only at INFO or DEBUG
+#   >>> log.debug("ux_val = {}", ux_val)   # costs one comparison at INFO
+#   >>> if log.enabled(DEBUG):             # for arguments that cost to compute
+#   ...     log.debug("stats {}", expensive())
+#   >>> log.drain()                        # at most `budget` bytes
+#
+# Level OFF drops everything, ERROR only errors; flush() writes the whole
+# ring, blocking, e.g. before a reset.
+#
+# License: MIT
+
+from micropython import const
+import sys
+
+OFF = const(0)
+ERROR = const(1)
+WARN = const(2)
+INFO = const(3)
+DEBUG = const(4)
+
+_CHUNK = const(64)  # bytes per write, one USB full-speed packet
+
+
+class ConsoleLog:
+    def __init__(self, size=2048, level=INFO, budget=512):
+        # size:   bytes of the ring buffer
+        # budget: bytes written per drain() call at most
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.size = size
+        self.level = level
+        self.budget = budget
+        self.head = 0  # oldest byte not written yet
+        self.used = 0
+        self.dropped = 0
+        self._poll = None
+        self._can_poll = True
+
+    def set_level(self, level):
+        if not OFF <= level <= DEBUG:
+            raise ValueError("invalid log level")
+        self.level = level
+
+    def enabled(self, level):
+        return level <= self.level
+
+    def log(self, level, fmt, *args):
+        if level > self.level:
+            return
+        self._put(fmt.format(*args) if args else fmt)
+
+    def error(self, fmt, *args):
+        if ERROR <= self.level:
+            self._put(fmt.format(*args) if args else fmt)
+
+    def warn(self, fmt, *args):
+        if WARN <= self.level:
+            self._put(fmt.format(*args) if args else fmt)
+
+    def info(self, fmt, *args):
+        if INFO <= self.level:
+            self._put(fmt.format(*args) if args else fmt)
+
+    def debug(self, fmt, *args):
+        if DEBUG <= self.level:
+            self._put(fmt.format(*args) if args else fmt)
+
+    def _put(self, s):
+        b = s.encode()
+        n = len(b) + 1
+        if n > self.size - self.used:
+            self.dropped += 1
+            return
+        if not self.used:
+            self.head = 0  # fewer wrapped messages
+        p = (self.head + self.used) % self.size
+        k = min(n - 1, self.size - p)
+        src = memoryview(b)
+        self.mv[p:p + k] = src[:k]
+        if k < n - 1:
+            self.mv[0:n - 1 - k] = src[k:]
+        self.buf[(p + n - 1) % self.size] = 0x0A
+        self.used += n
+
+    def _writable(self):
+        # POLLOUT of the console where the port reports it, else assume so
+        if self._poll is None and self._can_poll:
+            try:
+                import select
+                self._poll = select.poll()
+                self._poll.register(sys.stdout, select.POLLOUT)
+            except Exception:
+                self._poll = None
+                self._can_poll = False
+        return self._poll is None or bool(self._poll.poll(0))
+
+    def drain(self, budget=None, block=False):
+        """ Write up to budget bytes of the ring; returns the bytes left in it. """
+        n = self.budget if budget is None else budget
+        out = sys.stdout
+        while self.used and n > 0:
+            if not block and not self._writable():
+                break
+            k = min(self.used, n, _CHUNK, self.size - self.head)
+            out.write(self.mv[self.head:self.head + k])
+            self.head = (self.head + k) % self.size
+            self.used -= k
+            n -= k
+        if self.dropped:
+            msg = "[{} log messages dropped]".format(self.dropped)
+            if len(msg) < self.size - self.used:
+                self.dropped = 0
+                self._put(msg)
+        return self.used
+
+    def flush(self):
+        """ Write all of the ring, waiting for the console as print() does. """
+        while self.drain(self.size, block=True):
+            pass
@@ -0,0 +1,161 @@
+# Pre-rendered glyph cache and blit-based text fields for MONO_VLSB displays
+# (e.g. the SSD1306 OLED of the Seeed Expansion Board Base)
+#
+# Characters are rasterised once with framebuf.text() into 8x8 FrameBuffer
+# tiles. Optionally digits are also rendered in a larger 7-segment style.
+# A TextField remembers what it shows and only blits the characters that
+# changed, so together with the partial refresh of ssd1306.show() a clock
+# update only touches a few columns.
+#
+# License: MIT
+
+from micropython import const
+import framebuf
+
+GLYPH_W = const(8)
+GLYPH_H = const(8)
+
+DIGITS = "0123456789"
+DEFAULT_CHARS = DIGITS + " :-.%"
+
+# 7-segment masks, bit 0 = segment a ... bit 6 = segment g
+#    a
+#  f   b
+#    g
+#  e   c
+#    d
+_SEG_MASKS = (0x3F, 0x06, 0x5B, 0x4F, 0x66, 0x6D, 0x7D, 0x07, 0x7F, 0x6F)
+
+
+def _new_tile(w, h):
+    buf = bytearray(w * ((h + 7) // 8))
+    return framebuf.FrameBuffer(buf, w, h, framebuf.MONO_VLSB)
+
+
+class GlyphCache:
+    """
+    Cache of pre-rendered character tiles.
+    chars: the characters to render up front, others are rendered and
+    cached on first use.
+    seg_w, seg_h: size of the 7-segment digit tiles (0 = no 7-segment font).
+    """
+
+    def __init__(self, chars=DEFAULT_CHARS, seg_w=0, seg_h=0):
+        self._glyphs = {}
+        for ch in chars:
+            self.glyph(ch)
+        self.seg_w = seg_w
+        self.seg_h = seg_h
+        self._seg = None
+        if seg_w and seg_h:
+            self._seg = [self._render_seg(m) for m in _SEG_MASKS]
+            self._seg_colon = self._render_seg_colon()
+
+    def glyph(self, ch):
+        g = self._glyphs.get(ch)
+        if g is None:
+            g = _new_tile(GLYPH_W, GLYPH_H)
+            g.text(ch, 0, 0, 1)
+            self._glyphs[ch] = g
+        return g
+
+    def _render_seg(self, mask):
+        w, h = self.seg_w, self.seg_h
+        t = max(1, w // 6)  # segment thickness
+        m = (h - t) // 2    # top of the middle segment
+        tile = _new_tile(w, h)
+        if mask & 0x01:
+            tile.fill_rect(t, 0, w - 2 * t, t, 1)          # a
+        if mask & 0x02:
+            tile.fill_rect(w - t, t, t, m - t, 1)          # b
+        if mask & 0x04:
+            tile.fill_rect(w - t, m + t, t, h - m - 2 * t, 1)  # c
+        if mask & 0x08:
+            tile.fill_rect(t, h - t, w - 2 * t, t, 1)      # d
+        if mask & 0x10:
+            tile.fill_rect(0, m + t, t, h - m - 2 * t, 1)  # e
+        if mask & 0x20:
+            tile.fill_rect(0, t, t, m - t, 1)              # f
+        if mask & 0x40:
+            tile.fill_rect(t, m, w - 2 * t, t, 1)          # g
+        return tile
+
+    def _render_seg_colon(self):
+        w, h = self.seg_w, self.seg_h
+        t = max(1, w // 6)
+        tile = _new_tile(w, h)
+        x = (w - t) // 2
+        tile.fill_rect(x, h // 3 - t // 2, t, t, 1)
+        tile.fill_rect(x, 2 * h // 3 - t // 2, t, t, 1)
+        return tile
+
+    def big(self, ch):
+        """ Returns the 7-segment tile for a digit or ':', None otherwise. """
+        if self._seg is None:
+            return None
+        if ch == ":":
+            return self._seg_colon
+        if "0" <= ch <= "9":
+            return self._seg[ord(ch) - 48]
+        return None
+
+    def draw(self, fb, s, x, y):
+        """ Blit the whole string s at x, y. """
+        for ch in s:
+            fb.blit(self.glyph(ch), x, y)
+            x += GLYPH_W
+
+
+class TextField:
+    """
+    A fixed position text area on a FrameBuffer. update() only blits the
+    characters that differ from what the field shows now.
+    """
+
+    def __init__(self, cache, x, y, big=False):
+        self.cache = cache
+        self.x = x
+        self.y = y
+        self.big = big
+        if big:
+            self.cw = cache.seg_w + max(1, cache.seg_w // 6)  # plus spacing
+            self.ch = cache.seg_h
+        else:
+            self.cw = GLYPH_W
+            self.ch = GLYPH_H
+        self.text = ""
+
+    def invalidate(self):
+        """ Forget the shown text, e.g. after fb.fill(0). """
+        self.text = ""
+
+    def _tile(self, c):
+        if self.big:
+            t = self.cache.big(c)
+            if t is not None:
+                return t
+        return self.cache.glyph(c)
+
+    def update(self, fb, s):
+        """
+        Show s in the field. Returns the number of characters blitted
+        (0 when nothing changed).
+        """
+        old = self.text
+        if s == old:
+            return 0
+        n = 0
+        x = self.x
+        for i in range(len(s)):
+            c = s[i]
+            if i >= len(old) or old[i] != c:
+                if self.big:
+                    fb.fill_rect(x, self.y, self.cw, self.ch, 0)
+                fb.blit(self._tile(c), x, self.y)
+                n += 1
+            x += self.cw
+        if len(old) > len(s):
+            # clear what is left of the longer old text
+            fb.fill_rect(x, self.y, (len(old) - len(s)) * self.cw, self.ch, 0)
+        self.text = s
+        return n
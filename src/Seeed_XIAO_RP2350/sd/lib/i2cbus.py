@@ -0,0 +1,376 @@
+# I2C bus arbiter for devices sharing one machine.I2C object
+# (on the XIAO RP2350: PCF8563, BME280 or MCP9808 and the SSD1306 on I2C(1))
+#
+# I2CBus has the same methods as machine.I2C, so the drivers take it instead
+# of the raw bus object. Each call is one transaction: it takes the bus lock,
+# waits while a transaction of a higher priority is pending, switches to the
+# clock speed configured for the device and counts transactions and bytes
+# per device address.
+#
+# Several calls can be grouped into one transaction with begin()/end(),
+# e.g. to read a set of registers without another device slipping in.
+#
+# negotiate_speeds() probes each detected device at increasing clock speeds
+# and configures the fastest one at which its readback stays correct. Every
+# device decodes the address of every transaction, so by default no device
+# is clocked faster than the slowest one present allows. The SSD1306 has no
+# readback over I2C, so it is only checked for an ACK and never exceeds the
+# 400 kHz of its data sheet.
+#
+# License: MIT
+
+from micropython import const
+import time
+
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+# Priorities, lower value goes first
+PRIO_RTC = const(0)
+PRIO_SENSOR = const(1)
+PRIO_DISPLAY = const(2)
+_N_PRIO = const(3)
+
+
+class _NoLock:
+    # stand-in for _thread.allocate_lock() on builds without threads
+    def __init__(self):
+        self._locked = False
+
+    def acquire(self, waitflag=1, timeout=-1):
+        if self._locked:
+            if not waitflag:
+                return False
+            raise RuntimeError("I2CBus lock already held")
+        self._locked = True
+        return True
+
+    def release(self):
+        self._locked = False
+
+    def locked(self):
+        return self._locked
+
+
+def _allocate_lock():
+    if _thread is not None:
+        return _thread.allocate_lock()
+    return _NoLock()
+
+
+def _get_ident():
+    if _thread is not None:
+        return _thread.get_ident()
+    return 0
+
+
+class I2CBus:
+    def __init__(self, i2c, bus_id=None, default_prio=PRIO_SENSOR):
+        # i2c:    the machine.I2C object
+        # bus_id: id of the hardware bus, used to re-create it at another
+        #         clock speed (otherwise i2c.init(freq=...) is tried)
+        self.i2c = i2c
+        self.bus_id = bus_id
+        self.default_prio = default_prio
+        self.freq = None  # current clock speed, None = as created
+        self._lock = _allocate_lock()
+        self._state = _allocate_lock()  # guards the counters below
+        self._waiting = [0] * _N_PRIO
+        self._owner = None
+        self._depth = 0
+        self._prio = {}
+        self._freq = {}
+        self.names = {}
+        self._stats = {}  # addr: [transactions, bytes]
+
+    def configure(self, addr, prio=None, freq=None, name=None):
+        """ Set the priority, clock speed and display name of a device. """
+        if prio is not None:
+            if not 0 <= prio < _N_PRIO:
+                raise ValueError("invalid priority")
+            self._prio[addr] = prio
+        if freq is not None:
+            self._freq[addr] = freq
+        if name is not None:
+            self.names[addr] = name
+
+    def set_freq(self, freq):
+        if freq == self.freq:
+            return
+        if self.bus_id is not None:
+            from machine import I2C
+            self.i2c = I2C(self.bus_id, freq=freq)
+        elif hasattr(self.i2c, "init"):
+            self.i2c.init(freq=freq)
+        else:
+            raise ValueError("bus_id needed to change the I2C clock speed")
+        self.freq = freq
+
+    def _higher_waiting(self, prio):
+        for p in range(prio):
+            if self._waiting[p]:
+                return True
+        return False
+
+    def _wait(self, prio, delta):
+        self._state.acquire()
+        self._waiting[prio] += delta
+        self._state.release()
+
+    def _take(self, addr):
+        self._owner = _get_ident()
+        self._depth = 1
+        f = self._freq.get(addr)
+        if f is not None:
+            self.set_freq(f)
+
+    def begin(self, addr):
+        """
+        Start a transaction for the device at addr. Blocks while the bus is
+        used by another thread or a higher priority transaction is pending.
+        Calls can be nested by the owner of the bus.
+        """
+        if self._depth and self._owner == _get_ident():
+            self._depth += 1
+            return
+        prio = self._prio.get(addr, self.default_prio)
+        self._wait(prio, 1)
+        while True:
+            self._lock.acquire()
+            if not self._higher_waiting(prio):
+                break
+            self._lock.release()
+            time.sleep_us(20)
+        self._wait(prio, -1)
+        self._take(addr)
+
+    async def begin_async(self, addr):
+        """ Same as begin() but yields to other uasyncio tasks while waiting. """
+        try:
+            import uasyncio as asyncio
+        except ImportError:
+            import asyncio
+        if self._depth and self._owner == _get_ident():
+            self._depth += 1
+            return
+        prio = self._prio.get(addr, self.default_prio)
+        self._wait(prio, 1)
+        while True:
+            if self._lock.acquire(0):
+                if not self._higher_waiting(prio):
+                    break
+                self._lock.release()
+            await asyncio.sleep(0)
+        self._wait(prio, -1)
+        self._take(addr)
+
+    def end(self):
+        """ End the transaction started with begin(). """
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            self._lock.release()
+
+    def _count(self, addr, nbytes):
+        s = self._stats.get(addr)
+        if s is None:
+            s = self._stats[addr] = [0, 0]
+        s[0] += 1
+        s[1] += nbytes
+
+    def stats(self):
+        """ Returns {addr: (transactions, bytes)} since the last reset. """
+        return {a: (s[0], s[1]) for a, s in self._stats.items()}
+
+    def reset_stats(self):
+        self._stats = {}
+
+    def print_stats(self):
+        for addr, s in sorted(self._stats.items()):
+            print("I2C 0x{:02x} {:<8s} transactions: {:6d}, bytes: {:8d}".format(
+                addr, self.names.get(addr, ""), s[0], s[1]))
+
+    # --- machine.I2C methods ---
+
+    def scan(self):
+        self.begin(None)
+        try:
+            return self.i2c.scan()
+        finally:
+            self.end()
+
+    def writeto(self, addr, buf, stop=True):
+        self.begin(addr)
+        try:
+            r = self.i2c.writeto(addr, buf, stop)
+        finally:
+            self.end()
+        self._count(addr, len(buf))
+        return r
+
+    def writevto(self, addr, vector, stop=True):
+        self.begin(addr)
+        try:
+            r = self.i2c.writevto(addr, vector, stop)
+        finally:
+            self.end()
+        n = 0
+        for buf in vector:
+            n += len(buf)
+        self._count(addr, n)
+        return r
+
+    def readfrom(self, addr, nbytes, stop=True):
+        self.begin(addr)
+        try:
+            r = self.i2c.readfrom(addr, nbytes, stop)
+        finally:
+            self.end()
+        self._count(addr, nbytes)
+        return r
+
+    def readfrom_into(self, addr, buf, stop=True):
+        self.begin(addr)
+        try:
+            self.i2c.readfrom_into(addr, buf, stop)
+        finally:
+            self.end()
+        self._count(addr, len(buf))
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        self.begin(addr)
+        try:
+            r = self.i2c.readfrom_mem(addr, memaddr, nbytes, addrsize=addrsize)
+        finally:
+            self.end()
+        self._count(addr, nbytes + addrsize // 8)
+        return r
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        self.begin(addr)
+        try:
+            self.i2c.readfrom_mem_into(addr, memaddr, buf, addrsize=addrsize)
+        finally:
+            self.end()
+        self._count(addr, len(buf) + addrsize // 8)
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        self.begin(addr)
+        try:
+            self.i2c.writeto_mem(addr, memaddr, buf, addrsize=addrsize)
+        finally:
+            self.end()
+        self._count(addr, len(buf) + addrsize // 8)
+
+
+# --- clock speed negotiation ---
+
+# Clock speeds to try, in increasing order. The RP2350 I2C block does up to
+# 1 MHz (fast-mode plus).
+PROBE_FREQS = (100000, 400000, 1000000)
+
+
+def _is_bcd(b):
+    return (b & 0x0F) < 10 and (b >> 4) < 10
+
+
+def _probe_mcp9808(i2c, addr):
+    # manufacturer ID 0x0054, device ID 0x04
+    return (i2c.readfrom_mem(addr, 0x06, 2) == b"\x00T"
+            and i2c.readfrom_mem(addr, 0x07, 2)[0] == 0x04)
+
+
+def _probe_bme280(i2c, addr):
+    # chip ID register
+    return i2c.readfrom_mem(addr, 0xD0, 1)[0] == 0x60
+
+
+def _probe_pcf8563(i2c, addr):
+    # two burst reads of the time registers must be valid BCD and
+    # at most one second apart
+    a = i2c.readfrom_mem(addr, 0x02, 7)
+    b = i2c.readfrom_mem(addr, 0x02, 7)
+    for r in (a, b):
+        for v in (r[0] & 0x7F, r[1] & 0x7F, r[2] & 0x3F, r[3] & 0x3F, r[5] & 0x1F, r[6]):
+            if not _is_bcd(v):
+                return False
+    if a[1:] != b[1:] and (b[0] & 0x7F) != 0:
+        return False  # other fields changed without a minute roll-over
+    sa = ((a[0] >> 4) & 7) * 10 + (a[0] & 0x0F)
+    sb = ((b[0] >> 4) & 7) * 10 + (b[0] & 0x0F)
+    return (sb - sa) % 60 <= 1
+
+
+def _probe_ssd1306(i2c, addr):
+    # write-only on I2C, nothing to read back: a stream of NOP commands
+    # must be acknowledged, which proves the address phase and not much more
+    i2c.writeto(addr, b"\x00\xe3\xe3\xe3")
+    return True
+
+
+# addr: (name, probe function, highest speed of the data sheet,
+#        True if the probe reads something back that it can check)
+PROBES = {
+    0x18: ("MCP9808", _probe_mcp9808, 400000, True),
+    0x3C: ("SSD1306", _probe_ssd1306, 400000, False),
+    0x51: ("PCF8563", _probe_pcf8563, 400000, True),
+    0x76: ("BME280", _probe_bme280, 1000000, True),
+    0x77: ("BME280", _probe_bme280, 1000000, True),
+}
+
+
+def negotiate_speeds(bus, freqs=PROBE_FREQS, tries=3, within_spec=True):
+    """
+    Probe each device found on the bus at increasing clock speeds and
+    configure the fastest speed at which all probes passed. Unknown devices
+    keep the lowest speed. With within_spec no device is clocked faster than
+    the lowest data sheet maximum of the devices found (unknown ones count
+    as the lowest speed), as they all listen to every address byte. Without
+    it each device may go as fast as its probes pass, except that a device
+    without readback (the SSD1306) never exceeds its data sheet.
+    Returns {addr: freq}.
+    """
+    bus.set_freq(freqs[0])
+    chosen = {}
+    found = bus.scan()
+    bus_max = freqs[-1]
+    for addr in found:
+        bus_max = min(bus_max, PROBES.get(addr, (None, None, freqs[0], False))[2])
+    for addr in found:
+        name, probe, f_max, readback = PROBES.get(addr, (None, None, freqs[0], False))
+        if within_spec:
+            f_max = bus_max
+        elif readback:
+            f_max = freqs[-1]
+        best = freqs[0]
+        if probe is not None:
+            bus.begin(addr)
+            try:
+                for f in freqs:
+                    if f > f_max:
+                        break
+                    bus.set_freq(f)
+                    try:
+                        ok = True
+                        for _ in range(tries):
+                            if not probe(bus.i2c, addr):
+                                ok = False
+                                break
+                    except OSError:
+                        ok = False
+                    if not ok:
+                        break  # fall back to the last good speed
+                    best = f
+                bus.set_freq(freqs[0])
+            finally:
+                bus.end()
+        bus.configure(addr, freq=best, name=name)
+        chosen[addr] = best
+    return chosen
+
+
+def print_speeds(bus, chosen):
+    for addr, f in sorted(chosen.items()):
+        print("I2C 0x{:02x} {:<8s} {:4d} kHz".format(addr, bus.names.get(addr) or "?", f // 1000))
@@ -1,5 +1,6 @@
 # Imports
 from machine import I2C
+import time
 
 
 # Register pointers
@@ -19,6 +20,9 @@ TEMP_RESOLUTION_LOW = const(1) # +0.25 C, refresh rate 65 ms
 TEMP_RESOLUTION_AVG = const(2) # +0.125 C, refresh rate 130 ms
 TEMP_RESOLUTION_MAX = const(3) # +0.0625 C, refresh rate 250 ms [Default]
 
+# Conversion time in ms, indexed by the resolution values above
+CONV_TIME_MS = (30, 65, 130, 250)
+
 
 # Alert selectors
 ALERT_SELECT_ALL = const(0) # ambient > upper || ambient > critical || ambient < lower [Default]
@@ -48,9 +52,15 @@ class MCP9808(object):
         # print(f"MCP9808().__init__(): i2c.__class__ = {i2c.__class__}")
         #if i2c == None or i2c.__class__ != isinstance(i2c, SoftI2C): # or i2c.__class__ != 'I2C':
         #    raise ValueError('I2C object needed as argument!')
-        if isinstance(i2c, I2C): # SoftI2C):
+        if isinstance(i2c, I2C) or hasattr(i2c, "writeto"): # SoftI2C or I2CBus
             self._i2c = i2c
             self._addr = addr
+            self._res = TEMP_RESOLUTION_MAX
+            # buffers for one-shot sampling which stay allocated
+            self._reg_buf = bytearray(1)
+            self._cfg_buf = bytearray(3)
+            self._raw_buf = bytearray(2)
+            self._t_start = None
             self._check_device()
         else:
             raise ValueError('I2C object needed as argument')
@@ -83,6 +93,16 @@ class MCP9808(object):
         else:
             raise Exception("Invalid I2C object. Unknown Micropython/platform?")
 
+    def _recv_into(self, buf):
+        """
+        Read len(buf) bytes from the sensor into the given buffer without
+        allocating a new one.
+        """
+        if hasattr(self._i2c, "readfrom_into"):
+            self._i2c.readfrom_into(self._addr, buf)
+        else:
+            buf[:] = self._recv(len(buf))
+
     def _check_device(self):
         """
         Tries to identify the manufacturer and device identifiers.
@@ -198,15 +218,86 @@ class MCP9808(object):
         b.append(REG_RESOLUTION)
         b.append(r)
         self._send(b)
+        self._res = r
 
-    def get_temp(self):
+    def conversion_time_ms(self):
         """
-        Read temperature in degree celsius and return float value.
+        Returns the conversion time in ms for the configured resolution.
+        """
+        return CONV_TIME_MS[self._res]
+
+    def _set_shutdown_bit(self, shdn):
+        """
+        Same as set_shutdown_mode() but using the preallocated buffers.
+        """
+        self._reg_buf[0] = REG_CONFIG
+        self._send(self._reg_buf)
+        cfg = self._cfg_buf
+        self._recv_into(memoryview(cfg)[1:])
+        cfg[0] = REG_CONFIG
+        if shdn:
+            cfg[1] |= 1
+        else:
+            cfg[1] &= ~1
+        self._send(cfg)
+
+    def start_one_shot(self):
+        """
+        Wake the sensor from shutdown to start a temperature conversion.
+        Returns the conversion time in ms after which read_one_shot() can be
+        called.
+        """
+        self._set_shutdown_bit(False)
+        self._t_start = time.ticks_ms()
+        return CONV_TIME_MS[self._res]
+
+    def one_shot_ready(self):
+        """
+        Returns True when a conversion started by start_one_shot() is done.
+        """
+        if self._t_start is None:
+            return False
+        return time.ticks_diff(time.ticks_ms(), self._t_start) >= CONV_TIME_MS[self._res]
+
+    def read_one_shot(self):
+        """
+        Burst-read the temperature of a finished one-shot conversion,
+        put the sensor back into shutdown and return the temperature
+        in degree celsius.
+        """
+        self._reg_buf[0] = REG_TEMP
+        self._send(self._reg_buf)
+        self._recv_into(self._raw_buf)
+        self._set_shutdown_bit(True)
+        self._t_start = None
+        return self._raw_to_temp(self._raw_buf)
+
+    def poll_one_shot(self):
+        """
+        Non-blocking one-shot sampling for cooperative schedulers.
+        Starts a conversion if none is pending. Returns None while the
+        conversion is busy and the temperature once it is done.
+        """
+        if self._t_start is None:
+            self.start_one_shot()
+            return None
+        if not self.one_shot_ready():
+            return None
+        return self.read_one_shot()
+
+    def get_temp_one_shot(self):
+        """
+        Blocking one-shot sampling: wake the sensor, wait the conversion
+        time of the configured resolution, read and shut down again.
+        """
+        time.sleep_ms(self.start_one_shot())
+        return self.read_one_shot()
+
+    def _raw_to_temp(self, raw):
+        """
+        Convert the two bytes of the ambient temperature register into
+        degree celsius.
         """
-        b = bytearray()
-        b.append(REG_TEMP)
-        self._send(b)
-        raw = self._recv(2)
         u = (raw[0] & 0x0f) << 4
         l = raw[1] / 16
         if raw[0] & 0x10 == 0x10:
@@ -215,6 +306,15 @@ class MCP9808(object):
             temp = u + l
         return temp
 
+    def get_temp(self):
+        """
+        Read temperature in degree celsius and return float value.
+        """
+        b = bytearray()
+        b.append(REG_TEMP)
+        self._send(b)
+        return self._raw_to_temp(self._recv(2))
+
     def get_temp_int(self):
         """
         Read a temperature in degree celsius and return a tuple of two parts.
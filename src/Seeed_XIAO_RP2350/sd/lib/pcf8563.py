@@ -107,13 +107,13 @@ class PCF8563():
                     self.Day(),self.Wday(),
                     self.Hr(), self.Mins(), self.Sec()]
         else:
-            self.Yr(dat[0])
-            self.Mon(dat[1])
-            self.Day(dat[2])
-            self.Wday(dat[3])
-            self.Hr(dat[4])
-            self.Mins(dat[5])
-            self.Sec(dat[6])
+            # one write, seconds first: the clock restarts its second with
+            # it and cannot carry into the registers between the writes
+            self._i2c.writeto(self._addr, bytearray([REG_SEC,
+                self.DecToHex(dat[6]%60), self.DecToHex(dat[5]%60),
+                self.DecToHex(dat[4]%24), self.DecToHex(dat[2]%32),
+                self.DecToHex(dat[3]%7), self.DecToHex(dat[1]%13),
+                self.DecToHex(dat[0]%100)]))
 
     def Time(self, h=None, m=None, s=None):
         if (h==None) and (m==None) and (s==None):
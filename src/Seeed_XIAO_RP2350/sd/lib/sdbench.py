@@ -0,0 +1,192 @@
+# Simple throughput benchmarks for the SD card mounted on /sd
+#
+# Usage (in the REPL, after boot.py has mounted the card):
+#   >>> import os; os.chdir('/sd')
+#   >>> from lib import sdbench
+#   >>> sdbench.write_bench()
+#
+# Run it before and after a change of lib/sdcard.py to compare.
+# License: MIT
+
+import os
+import time
+
+BENCH_FILE = "/sd/bench.bin"
+
+
+def write_bench(path=BENCH_FILE, kbytes=256, chunk=4096):
+    """
+    Sustained write: write kbytes in pieces of chunk bytes to a new file.
+    Returns the throughput in kB/s.
+    """
+    buf = bytearray(chunk)
+    for i in range(chunk):
+        buf[i] = i & 0xFF
+    n = (kbytes * 1024) // chunk
+    t0 = time.ticks_ms()
+    with open(path, "wb") as f:
+        for _ in range(n):
+            f.write(buf)
+    if hasattr(os, "sync"):
+        os.sync()
+    dt = time.ticks_diff(time.ticks_ms(), t0)
+    kbs = (n * chunk / 1024) / (max(dt, 1) / 1000)
+    print("write: {:d} kB in {:d} ms = {:.1f} kB/s (chunk {:d})".format(n * chunk // 1024, dt, kbs, chunk))
+    return kbs
+
+
+def read_bench(path=BENCH_FILE, chunk=512):
+    """
+    Sequential read of a file (e.g. the one of write_bench()) in pieces of
+    chunk bytes. Returns the throughput in kB/s.
+    """
+    buf = bytearray(chunk)
+    total = 0
+    t0 = time.ticks_ms()
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            total += n
+    dt = time.ticks_diff(time.ticks_ms(), t0)
+    kbs = (total / 1024) / (max(dt, 1) / 1000)
+    print("read: {:d} kB in {:d} ms = {:.1f} kB/s (chunk {:d})".format(total // 1024, dt, kbs, chunk))
+    return kbs
+
+
+def random_read_bench(path=BENCH_FILE, n=200, size=64, sd=None):
+    """
+    Small reads at random offsets of a file. Returns the mean time per read
+    in us. Pass the SDCard object as sd to also print its token latency.
+    Note: with the BlockCache of boot.py many reads are served from RAM.
+    """
+    import random
+    buf = bytearray(size)
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        span = f.tell() - size
+        t0 = time.ticks_us()
+        for _ in range(n):
+            f.seek(random.randrange(span))
+            f.readinto(buf)
+        dt = time.ticks_diff(time.ticks_us(), t0)
+    print("random read: {:d} x {:d} bytes, {:d} us per read".format(n, size, dt // n))
+    if sd is not None:
+        print("token latency: last {:d} us, max {:d} us".format(sd.read_latency_us, sd.read_latency_max_us))
+    return dt // n
+
+
+def import_bench(names=("lib.bme280_f", "lib.mcp9808", "lib.pcf8563", "lib.ssd1306")):
+    """
+    Time the import of driver modules from /sd/lib. Run it in a fresh
+    session, modules that are already imported are not loaded again.
+    """
+    import sys
+    total = 0
+    for name in names:
+        sys.modules.pop(name, None)
+        t0 = time.ticks_us()
+        __import__(name)
+        dt = time.ticks_diff(time.ticks_us(), t0)
+        total += dt
+        print("import {:s}: {:d} us".format(name, dt))
+    print("import total: {:d} us".format(total))
+    return total
+
+
+def crc_bench(n=100):
+    """
+    Time of the CRC16 over one 512-byte block and of a CRC7 over a
+    command, as used by SDCard(check_crc=True) and SDCard(crc_mode=True).
+    Compare the block time with the transfer time of a block at the SPI
+    clock (about 200 us at 20 MHz). Returns us per block.
+    """
+    from lib import sdcard
+    sdcard.make_crc_tables()
+    buf = bytearray(512)
+    t0 = time.ticks_us()
+    for _ in range(n):
+        sdcard.crc16(buf)
+    per_block = time.ticks_diff(time.ticks_us(), t0) / n
+    t0 = time.ticks_us()
+    for _ in range(n):
+        sdcard.crc7(buf, 5)
+    per_cmd = time.ticks_diff(time.ticks_us(), t0) / n
+    print("crc16: {:.1f} us per block, crc7: {:.1f} us per command".format(per_block, per_cmd))
+    return per_block
+
+
+def append_bench(path="/sd/APPEND.BIN", kbytes=128, record=512, dev=None):
+    """
+    Append records of record bytes to a log file and report the mean and
+    the worst time per write. With dev (the mounted SDCard or BlockCache)
+    the file is first preallocated and pre-erased with lib.sdextent and
+    filled in place, else it grows by appending.
+    """
+    n = kbytes * 1024 // record
+    buf = bytearray(record)
+    if dev is not None:
+        from lib.sdextent import preallocate
+        preallocate(dev, path, n * record)
+        f = open(path, "r+b")
+    else:
+        f = open(path, "wb")
+    worst = 0
+    t0 = time.ticks_us()
+    for _ in range(n):
+        t1 = time.ticks_us()
+        f.write(buf)
+        f.flush()
+        dt = time.ticks_diff(time.ticks_us(), t1)
+        if dt > worst:
+            worst = dt
+    total = time.ticks_diff(time.ticks_us(), t0)
+    f.close()
+    print("append{:s}: {:d} x {:d} bytes, mean {:d} us, worst {:d} us".format(
+        " (pre-erased)" if dev is not None else "", n, record, total // n, worst))
+    return total // n, worst
+
+
+def codec_bench(n=3600):
+    """
+    Encode n records that look like 1 Hz BME280 readings with lib.tscodec,
+    as TSLogger(compress=True) does, and decode them again. Reports us per
+    record, bytes per record and the sector writes saved against the
+    20-byte raw records. Returns the compression ratio.
+    """
+    from lib import tscodec
+    import random
+    buf = bytearray(512)
+    enc = tscodec.BlockEncoder(buf, 16)
+    ts, t, p, h = 1746700000, 2240, 100068, 4385
+    sectors = 1
+    nbytes = 0
+    t0 = time.ticks_us()
+    for i in range(n):
+        enc.add(ts + i, t + random.getrandbits(3) - 4, p + random.getrandbits(5) - 16,
+                h + random.getrandbits(4) - 8, 0, 2)
+        if enc.full():
+            nbytes += enc.used()
+            enc.reset()
+            sectors += 1
+    t_enc = time.ticks_diff(time.ticks_us(), t0)
+    count = enc.count
+    nbytes += enc.used()
+    t0 = time.ticks_us()
+    for _ in tscodec.decode(buf, 16, count):
+        pass
+    t_dec = time.ticks_diff(time.ticks_us(), t0)
+    raw_sectors = (n + 23) // 24
+    ratio = n * 20 / nbytes
+    print("codec: encode {:.1f} us, decode {:.1f} us per record".format(t_enc / n, t_dec / max(count, 1)))
+    print("codec: {:.2f} bytes per record, ratio {:.2f}, {:d} instead of {:d} sectors".format(
+        nbytes / n, ratio, sectors, raw_sectors))
+    return ratio
+
+
+def cleanup(path=BENCH_FILE):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
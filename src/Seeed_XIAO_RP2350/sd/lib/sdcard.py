@@ -21,10 +21,18 @@ Example usage on ESP8266:
 """
 
 from micropython import const
+from array import array
+import micropython
 import time
 
 
 _CMD_TIMEOUT = const(100)
+_WRITE_TIMEOUT_MS = const(500)  # max. busy time after a block write
+_BUSY_SPINS = const(64)  # tight polls before backing off
+_BUSY_MAX_SLEEP_US = const(1000)
+_READ_TIMEOUT_US = const(100000)  # max. time to wait for a data block
+_TOKEN_SPINS = const(32)  # tight polls for the start token before backing off
+_ERASE_TIMEOUT_MS = const(1000)  # plus 1 ms per 2 blocks, see erase()
 
 _R1_IDLE_STATE = const(1 << 0)
 # R1_ERASE_RESET = const(1 << 1)
@@ -37,21 +45,111 @@ _TOKEN_CMD25 = const(0xFC)
 _TOKEN_STOP_TRAN = const(0xFD)
 _TOKEN_DATA = const(0xFE)
 
+# SPI clock rates tried by negotiate_baudrate(), in increasing order
+_BAUDRATES = (1320000, 4000000, 8000000, 12500000, 16000000, 20000000, 25000000, 31250000, 37500000, 50000000)
+# highest SPI clock of the RP2350 (clk_peri / 2 at 150 MHz)
+_SPI_MAX_BAUDRATE = const(75000000)
+
+# CSD TRAN_SPEED: rate unit (bits 2:0) and time value x 10 (bits 6:3)
+_TRAN_UNIT = (100000, 1000000, 10000000, 100000000)
+_TRAN_VALUE = (0, 10, 12, 13, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 70, 80)
+
+_CRC_RETRIES = const(3)
+_DATA_RESP_CRC_ERROR = const(0x0B)
+
+# CRC lookup tables, built by make_crc_tables()
+_crc7_table = None
+_crc16_table = None
+
+
+class SDCardCRCError(OSError):
+    pass
+
+
+def make_crc_tables():
+    # CRC7 (x^7 + x^3 + 1) is kept left aligned in a byte,
+    # CRC16 is CRC-CCITT (x^16 + x^12 + x^5 + 1), initial value 0
+    global _crc7_table, _crc16_table
+    if _crc7_table is not None:
+        return
+    t7 = bytearray(256)
+    t16 = array("H", bytes(512))
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = ((c << 1) ^ 0x12) if c & 0x80 else (c << 1)
+        t7[i] = c & 0xFF
+        c = i << 8
+        for _ in range(8):
+            c = ((c << 1) ^ 0x1021) if c & 0x8000 else (c << 1)
+        t16[i] = c & 0xFFFF
+    _crc7_table = t7
+    _crc16_table = t16
+
+
+@micropython.native
+def crc7(buf, n):
+    # CRC7 of the first n bytes of buf, with end bit, as sent in a command
+    t = _crc7_table
+    crc = 0
+    for i in range(n):
+        crc = t[crc ^ buf[i]]
+    return crc | 1
+
+
+@micropython.native
+def crc16(buf, crc=0):
+    # CRC16 of buf; crc continues the CRC of the bytes before it
+    t = _crc16_table
+    for b in buf:
+        crc = ((crc << 8) & 0xFFFF) ^ t[(crc >> 8) ^ b]
+    return crc
+
 
 class SDCard:
-    def __init__(self, spi, cs, baudrate=1320000):
+    def __init__(self, spi, cs, baudrate=1320000, read_ahead=0, auto_baudrate=False,
+                 check_crc=False, crc_mode=False):
         self.spi = spi
         self.cs = cs
 
+        # check_crc: verify the CRC16 of each data block read, retry on errors
+        # crc_mode:  also switch the card to CRC mode (CMD59), so it checks
+        #            the CRC of commands and written blocks (implies check_crc)
+        self.crc_mode = crc_mode
+        self.check_crc = check_crc or crc_mode
+        self.crc_errors = 0
+        self.retries = 0
+        self.read_latency_us = 0  # wait for the data token of the last block
+        self.read_latency_max_us = 0
+        if self.check_crc:
+            make_crc_tables()
+        self.baudrate = baudrate
+        self.max_baudrate = 25000000  # from the CSD TRAN_SPEED field
+
+        # read-ahead: keep a CMD18 stream open while blocks are read in
+        # sequence and prefetch read_ahead blocks into a buffer
+        self.read_ahead = read_ahead
+        self.ra_buf = bytearray(read_ahead * 512)
+        self.ra_mv = memoryview(self.ra_buf)
+        self.ra_first = 0  # block number of the first unused prefetched block
+        self.ra_off = 0  # its index in ra_buf
+        self.ra_count = 0  # number of unused prefetched blocks
+        self.stream_next = -1  # next block of the open CMD18 stream, -1 = none
+        self.seq_next = -1  # block that would continue a sequential read
+
         self.cmdbuf = bytearray(6)
         self.dummybuf = bytearray(512)
         self.tokenbuf = bytearray(1)
+        self.crcbuf = bytearray(2)  # CRC16 of the last data block read
+        self.wcrcbuf = bytearray(b"\xff\xff")  # CRC16 of a block to write
         for i in range(512):
             self.dummybuf[i] = 0xFF
         self.dummybuf_memoryview = memoryview(self.dummybuf)
 
         # initialise the card
         self.init_card(baudrate)
+        if auto_baudrate:
+            self.negotiate_baudrate(baudrate)
 
     def init_spi(self, baudrate):
         try:
@@ -90,6 +188,10 @@ class SDCard:
         else:
             raise OSError("couldn't determine SD card version")
 
+        # CMD59: CRC on
+        if self.crc_mode and self.cmd(59, 1, 0) != 0:
+            raise OSError("can't enable CRC mode")
+
         # get the number of sectors
         # CMD9: response R2 (R1 byte + 16-byte block read)
         if self.cmd(9, 0, 0, 0, False) != 0:
@@ -107,6 +209,9 @@ class SDCard:
         else:
             raise OSError("SD card CSD format not supported")
         # print('sectors', self.sectors)
+        ts = csd[3]
+        if ts & 0x07 < len(_TRAN_UNIT) and ts >> 3:
+            self.max_baudrate = _TRAN_UNIT[ts & 0x07] * _TRAN_VALUE[(ts >> 3) & 0x0F] // 10
 
         # CMD16: set block length to 512 bytes
         if self.cmd(16, 512, 0) != 0:
@@ -114,6 +219,60 @@ class SDCard:
 
         # set to high data rate now that it's initialised
         self.init_spi(baudrate)
+        self.baudrate = baudrate
+
+    def negotiate_baudrate(self, start=1320000, sector=0, tries=2):
+        # Step the SPI clock up to the highest rate that both the card
+        # (CSD TRAN_SPEED) and the RP2350 support. At each step the given
+        # sector is read and compared, data and CRC bytes, with a read at the
+        # start rate; on a mismatch or a CRC error fall back one step. The
+        # trial reads are not retried, so a marginal clock is not hidden.
+        # After a failed trial the card is brought back in step and the
+        # reference read again at the rate chosen.
+        limit = min(self.max_baudrate, _SPI_MAX_BAUDRATE)
+        self.init_spi(start)
+        ref = bytearray(512)
+        self.readblocks(sector, ref)
+        ref_crc = bytes(self.crcbuf)
+        buf = bytearray(512)
+        best = start
+        ok = True
+        for rate in _BAUDRATES:
+            if rate <= best:
+                continue
+            if rate > limit:
+                break
+            self.init_spi(rate)
+            ok = True
+            try:
+                for _ in range(tries):
+                    self.seq_next = -1  # a fresh CMD17, not the prefetch
+                    self.readblocks_once(sector, buf)
+                    if buf != ref or self.crcbuf != ref_crc:
+                        ok = False
+                        break
+            except OSError:
+                ok = False
+            if not ok:
+                break
+            best = rate
+        self.init_spi(best)
+        self.baudrate = best
+        if not ok:
+            # the card may still be in the block or the response of the
+            # failed trial: stop any transfer, then it must read right
+            for _ in range(tries):
+                try:
+                    self.cmd(12, 0, 0xFF, skip1=True)
+                    self.seq_next = -1
+                    self.readblocks_once(sector, buf)
+                    if buf == ref:
+                        break
+                except OSError:
+                    pass
+            else:
+                raise OSError(5)  # EIO
+        return best
 
     def init_card_v1(self):
         for i in range(_CMD_TIMEOUT):
@@ -150,11 +309,11 @@ class SDCard:
         # create and send the command
         buf = self.cmdbuf
         buf[0] = 0x40 | cmd
-        buf[1] = arg >> 24
-        buf[2] = arg >> 16
-        buf[3] = arg >> 8
-        buf[4] = arg
-        buf[5] = crc
+        buf[1] = (arg >> 24) & 0xFF
+        buf[2] = (arg >> 16) & 0xFF
+        buf[3] = (arg >> 8) & 0xFF
+        buf[4] = arg & 0xFF
+        buf[5] = crc7(buf, 5) if self.crc_mode else crc
         self.spi.write(buf)
 
         if skip1:
@@ -185,15 +344,30 @@ class SDCard:
     def readinto(self, buf):
         self.cs(0)
 
-        # read until start byte (0xff)
-        for i in range(_CMD_TIMEOUT):
-            self.spi.readinto(self.tokenbuf, 0xFF)
-            if self.tokenbuf[0] == _TOKEN_DATA:
+        # read until start byte (0xfe): a burst of tight polls first,
+        # then with growing sleeps until the timeout
+        tokenbuf = self.tokenbuf
+        t0 = time.ticks_us()
+        for i in range(_TOKEN_SPINS):
+            self.spi.readinto(tokenbuf, 0xFF)
+            if tokenbuf[0] == _TOKEN_DATA:
                 break
-            time.sleep_ms(1)
         else:
-            self.cs(1)
-            raise OSError("timeout waiting for response")
+            delay = 10
+            while True:
+                self.spi.readinto(tokenbuf, 0xFF)
+                if tokenbuf[0] == _TOKEN_DATA:
+                    break
+                if time.ticks_diff(time.ticks_us(), t0) > _READ_TIMEOUT_US:
+                    self.cs(1)
+                    raise OSError("timeout waiting for response")
+                time.sleep_us(delay)
+                if delay < _BUSY_MAX_SLEEP_US:
+                    delay <<= 1
+        lat = time.ticks_diff(time.ticks_us(), t0)
+        self.read_latency_us = lat
+        if lat > self.read_latency_max_us:
+            self.read_latency_max_us = lat
 
         # read data
         mv = self.dummybuf_memoryview
@@ -202,52 +376,161 @@ class SDCard:
         self.spi.write_readinto(mv, buf)
 
         # read checksum
-        self.spi.write(b"\xff")
-        self.spi.write(b"\xff")
+        self.spi.readinto(self.crcbuf, 0xFF)
 
         self.cs(1)
         self.spi.write(b"\xff")
 
+        if self.check_crc and crc16(buf) != (self.crcbuf[0] << 8 | self.crcbuf[1]):
+            self.crc_errors += 1
+            raise SDCardCRCError("CRC error in data block")
+
+    def wait_not_busy(self, timeout_ms=_WRITE_TIMEOUT_MS):
+        # the card holds MISO low while busy; poll with the preallocated
+        # token buffer, first in a tight loop, then with growing sleeps
+        tokenbuf = self.tokenbuf
+        for i in range(_BUSY_SPINS):
+            self.spi.readinto(tokenbuf, 0xFF)
+            if tokenbuf[0] != 0:
+                return
+        start = time.ticks_ms()
+        delay = 10
+        while True:
+            self.spi.readinto(tokenbuf, 0xFF)
+            if tokenbuf[0] != 0:
+                return
+            if time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                self.cs(1)
+                self.spi.write(b"\xff")
+                raise OSError("timeout waiting for write")
+            time.sleep_us(delay)
+            if delay < _BUSY_MAX_SLEEP_US:
+                delay <<= 1
+
     def write(self, token, buf):
         self.cs(0)
 
         # send: start of block, data, checksum
-        self.spi.read(1, token)
+        self.tokenbuf[0] = token
+        self.spi.write(self.tokenbuf)
         self.spi.write(buf)
-        self.spi.write(b"\xff")
-        self.spi.write(b"\xff")
+        if self.crc_mode:
+            c = crc16(buf)
+            self.wcrcbuf[0] = c >> 8
+            self.wcrcbuf[1] = c & 0xFF
+        self.spi.write(self.wcrcbuf)
 
         # check the response
-        if (self.spi.read(1, 0xFF)[0] & 0x1F) != 0x05:
+        self.spi.readinto(self.tokenbuf, 0xFF)
+        resp = self.tokenbuf[0] & 0x1F
+        if resp != 0x05:
             self.cs(1)
             self.spi.write(b"\xff")
-            return
+            if resp == _DATA_RESP_CRC_ERROR:
+                self.crc_errors += 1
+                raise SDCardCRCError("CRC error in written block")
+            raise OSError(5)  # EIO, write error
 
         # wait for write to finish
-        while self.spi.read(1, 0xFF)[0] == 0:
-            pass
+        self.wait_not_busy()
 
         self.cs(1)
         self.spi.write(b"\xff")
 
     def write_token(self, token):
         self.cs(0)
-        self.spi.read(1, token)
+        self.tokenbuf[0] = token
+        self.spi.write(self.tokenbuf)
         self.spi.write(b"\xff")
         # wait for write to finish
-        while self.spi.read(1, 0xFF)[0] == 0x00:
-            pass
+        self.wait_not_busy()
 
         self.cs(1)
         self.spi.write(b"\xff")
 
+    def stream_open(self, block_num):
+        # CMD18: start a multi-block read and keep it open
+        if self.cmd(18, block_num * self.cdv, 0, release=False) != 0:
+            # release the card
+            self.cs(1)
+            raise OSError(5)  # EIO
+        self.stream_next = block_num
+
+    def stream_read(self, mv):
+        # read len(mv) // 512 blocks from the open CMD18 stream
+        offset = 0
+        while offset < len(mv):
+            self.readinto(mv[offset : offset + 512])
+            offset += 512
+            self.stream_next += 1
+
+    def stop_stream(self):
+        # end an open CMD18 stream and drop the prefetched blocks;
+        # must be done before any other command is sent to the card
+        self.ra_count = 0
+        if self.stream_next >= 0:
+            self.stream_next = -1
+            if self.cmd(12, 0, 0xFF, skip1=True):
+                raise OSError(5)  # EIO
+
+    def read_sequential(self, block_num, buf):
+        nblocks = len(buf) // 512
+        mv = memoryview(buf)
+        pos = 0
+        # first use what was prefetched
+        if self.ra_count and self.ra_first == block_num:
+            k = min(nblocks, self.ra_count)
+            off = self.ra_off * 512
+            mv[: k * 512] = self.ra_mv[off : off + k * 512]
+            pos = k
+            self.ra_first += k
+            self.ra_off += k
+            self.ra_count -= k
+        end = block_num + nblocks
+        if pos < nblocks:
+            # read the rest straight from the stream
+            self.ra_count = 0
+            if self.stream_next != block_num + pos:
+                self.stop_stream()
+                self.stream_open(block_num + pos)
+            self.stream_read(mv[pos * 512 :])
+        if self.ra_count == 0:
+            # prefetch the next blocks
+            cnt = min(self.read_ahead, self.sectors - end)
+            if cnt > 0:
+                if self.stream_next != end:
+                    self.stop_stream()
+                    self.stream_open(end)
+                self.stream_read(self.ra_mv[: cnt * 512])
+                self.ra_first = end
+                self.ra_off = 0
+                self.ra_count = cnt
+
     def readblocks(self, block_num, buf):
+        # retry after a CRC error
+        for attempt in range(_CRC_RETRIES + 1):
+            try:
+                return self.readblocks_once(block_num, buf)
+            except SDCardCRCError:
+                if attempt == _CRC_RETRIES:
+                    raise
+                self.retries += 1
+                self.seq_next = -1
+                self.stop_stream()
+
+    def readblocks_once(self, block_num, buf):
         # workaround for shared bus, required for (at least) some Kingston
         # devices, ensure MOSI is high before starting transaction
         self.spi.write(b"\xff")
 
         nblocks = len(buf) // 512
         assert nblocks and not len(buf) % 512, "Buffer length is invalid"
+        if self.read_ahead and block_num == self.seq_next:
+            self.read_sequential(block_num, buf)
+            self.seq_next = block_num + nblocks
+            return
+        self.seq_next = block_num + nblocks
+        self.stop_stream()
         if nblocks == 1:
             # CMD17: set read address for single block
             if self.cmd(17, block_num * self.cdv, 0, release=False) != 0:
@@ -264,21 +547,39 @@ class SDCard:
                 raise OSError(5)  # EIO
             offset = 0
             mv = memoryview(buf)
-            while nblocks:
-                # receive the data and release card
-                self.readinto(mv[offset : offset + 512])
-                offset += 512
-                nblocks -= 1
-            if self.cmd(12, 0, 0xFF, skip1=True):
-                raise OSError(5)  # EIO
+            try:
+                while nblocks:
+                    # receive the data and release card
+                    self.readinto(mv[offset : offset + 512])
+                    offset += 512
+                    nblocks -= 1
+            finally:
+                # also after a CRC error, or the card would still be in the
+                # multi-block read when the next command comes; that error
+                # (retried by readblocks()) is kept over a failed CMD12
+                if self.cmd(12, 0, 0xFF, skip1=True) and not nblocks:
+                    raise OSError(5)  # EIO
 
     def writeblocks(self, block_num, buf):
+        # retry after a CRC error
+        for attempt in range(_CRC_RETRIES + 1):
+            try:
+                return self.writeblocks_once(block_num, buf)
+            except SDCardCRCError:
+                if attempt == _CRC_RETRIES:
+                    raise
+                self.retries += 1
+
+    def writeblocks_once(self, block_num, buf):
         # workaround for shared bus, required for (at least) some Kingston
         # devices, ensure MOSI is high before starting transaction
         self.spi.write(b"\xff")
 
         nblocks, err = divmod(len(buf), 512)
         assert nblocks and not err, "Buffer length is invalid"
+        # prefetched blocks may be overwritten
+        self.seq_next = -1
+        self.stop_stream()
         if nblocks == 1:
             # CMD24: set write address for single block
             if self.cmd(24, block_num * self.cdv, 0) != 0:
@@ -287,19 +588,54 @@ class SDCard:
             # send the data
             self.write(_TOKEN_DATA, buf)
         else:
+            # ACMD23: pre-erase the blocks to be written, so the card can
+            # erase them in one go (optional, the response is ignored)
+            self.cmd(55, 0, 0)
+            self.cmd(23, nblocks, 0)
             # CMD25: set write address for first block
             if self.cmd(25, block_num * self.cdv, 0) != 0:
                 raise OSError(5)  # EIO
             # send the data
             offset = 0
             mv = memoryview(buf)
-            while nblocks:
-                self.write(_TOKEN_CMD25, mv[offset : offset + 512])
-                offset += 512
-                nblocks -= 1
-            self.write_token(_TOKEN_STOP_TRAN)
+            try:
+                while nblocks:
+                    self.write(_TOKEN_CMD25, mv[offset : offset + 512])
+                    offset += 512
+                    nblocks -= 1
+            finally:
+                # always end the multi-block write, also after an error
+                self.write_token(_TOKEN_STOP_TRAN)
+
+    def erase(self, first, count):
+        # CMD32/CMD33/CMD38: erase the blocks first .. first + count - 1,
+        # so later writes to them do not pay for the erase inside the card
+        if count <= 0:
+            return
+        self.seq_next = -1
+        self.stop_stream()
+        if self.cmd(32, first * self.cdv, 0) != 0:
+            raise OSError(5)  # EIO
+        if self.cmd(33, (first + count - 1) * self.cdv, 0) != 0:
+            raise OSError(5)  # EIO
+        if self.cmd(38, 0, 0, release=False) != 0:
+            self.cs(1)
+            self.spi.write(b"\xff")
+            raise OSError(5)  # EIO
+        # R1b response: wait while busy
+        self.wait_not_busy(_ERASE_TIMEOUT_MS + count // 2)
+        self.cs(1)
+        self.spi.write(b"\xff")
 
     def ioctl(self, op, arg):
+        if op == 2:  # deinit
+            self.stop_stream()
+        if op == 3:  # sync, nothing is buffered; end an open read stream
+            self.stop_stream()
+            return 0
+        if op == 6:  # erase block
+            self.erase(arg, 1)
+            return 0
         if op == 4:  # get number of blocks
             return self.sectors
         if op == 5:  # get block size in bytes
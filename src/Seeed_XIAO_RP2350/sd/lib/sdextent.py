@@ -0,0 +1,172 @@
+# Preallocated, pre-erased file extents on the FAT formatted SD card
+#
+# preallocate() creates a file of a fixed size on /sd, finds the blocks the
+# filesystem gave it by reading the FAT through the block device, checks
+# they are contiguous and erases them on the card (SDCard.erase(), CMD38).
+# Writes that later fill the file in place (open with "r+b") then go to
+# erased blocks, so the card does not stall on its internal erase.
+#
+# Only FAT16 and FAT32 are supported, and all path components must be
+# 8.3 names (e.g. "/sd/log/TEMP0001.BIN").
+#
+# Example:
+#   >>> from lib.sdextent import preallocate
+#   >>> preallocate(sd, "/sd/log/TEMP0001.BIN", 1024 * 1024)
+#   (8832, 2048)
+#
+# License: MIT
+
+from struct import unpack_from
+
+_CHUNK = 4096
+
+
+class FatVolume:
+    """ Minimal read-only view of a FAT16/FAT32 volume on a block device. """
+
+    def __init__(self, dev):
+        self.dev = dev
+        self.buf = bytearray(512)
+        self.fat_block = -1  # block number of the FAT sector in self.fatbuf
+        self.fatbuf = bytearray(512)
+        b = self.buf
+        dev.readblocks(0, b)
+        start = 0
+        if not (b[0] in (0xEB, 0xE9) and unpack_from("<H", b, 11)[0] == 512):
+            # MBR, use the first partition
+            start = unpack_from("<I", b, 0x1C6)[0]
+            dev.readblocks(start, b)
+        bps, spc, reserved, nfats, root_ents, tot16, fatsz16 = unpack_from("<HBHBHHxH", b, 11)
+        if bps != 512:
+            raise OSError("FAT: sector size {:d} not supported".format(bps))
+        tot32, fatsz32, root_clus = unpack_from("<II4xI", b, 32)
+        fatsz = fatsz16 or fatsz32
+        total = tot16 or tot32
+        root_blocks = (root_ents * 32 + 511) // 512
+        self.spc = spc
+        self.fat_start = start + reserved
+        self.root_start = self.fat_start + nfats * fatsz
+        self.data_start = self.root_start + root_blocks
+        clusters = (total - (self.data_start - start)) // spc
+        if clusters < 4085:
+            raise OSError("FAT12 not supported")
+        self.fat32 = clusters >= 65525
+        self.root_blocks = root_blocks
+        self.root_clus = root_clus if self.fat32 else 0
+
+    def cluster_block(self, clus):
+        return self.data_start + (clus - 2) * self.spc
+
+    def next_cluster(self, clus):
+        """ Next cluster of a chain, or None at the end. """
+        off = clus * (4 if self.fat32 else 2)
+        blk = self.fat_start + off // 512
+        if blk != self.fat_block:
+            self.dev.readblocks(blk, self.fatbuf)
+            self.fat_block = blk
+        if self.fat32:
+            n = unpack_from("<I", self.fatbuf, off % 512)[0] & 0x0FFFFFFF
+            return None if n >= 0x0FFFFFF8 else n
+        n = unpack_from("<H", self.fatbuf, off % 512)[0]
+        return None if n >= 0xFFF8 else n
+
+    def _dir_blocks(self, clus):
+        if clus == 0:
+            # FAT16 root directory, a fixed region
+            for i in range(self.root_blocks):
+                yield self.root_start + i
+            return
+        while clus is not None:
+            first = self.cluster_block(clus)
+            for i in range(self.spc):
+                yield first + i
+            clus = self.next_cluster(clus)
+
+    def find(self, path):
+        """ Returns (first cluster, size) of a file given by its path on the volume. """
+        clus = self.root_clus
+        size = 0
+        for name in path.strip("/").split("/"):
+            sfn = _short_name(name)
+            for blk in self._dir_blocks(clus):
+                self.dev.readblocks(blk, self.buf)
+                found = False
+                for off in range(0, 512, 32):
+                    e = self.buf[off]
+                    if e == 0:
+                        raise OSError(2)  # ENOENT, end of directory
+                    if e == 0xE5 or self.buf[off + 11] == 0x0F:
+                        continue  # deleted or long name entry
+                    if self.buf[off : off + 11] == sfn:
+                        hi, lo, size = unpack_from("<H4xHI", self.buf, off + 20)
+                        clus = hi << 16 | lo if self.fat32 else lo
+                        found = True
+                        break
+                if found:
+                    break
+            else:
+                raise OSError(2)  # ENOENT
+        return clus, size
+
+    def extent(self, clus):
+        """ Returns (first block, number of blocks) if the chain is contiguous, else None. """
+        first = clus
+        n = 1
+        nxt = self.next_cluster(clus)
+        while nxt is not None:
+            if nxt != clus + 1:
+                return None
+            clus = nxt
+            n += 1
+            nxt = self.next_cluster(clus)
+        return self.cluster_block(first), n * self.spc
+
+
+def _short_name(name):
+    name = name.upper()
+    i = name.find(".")
+    base, ext = (name, "") if i < 0 else (name[:i], name[i + 1 :])
+    if not 0 < len(base) <= 8 or len(ext) > 3:
+        raise ValueError("not an 8.3 name: " + name)
+    return (base + " " * (8 - len(base)) + ext + " " * (3 - len(ext))).encode()
+
+
+def file_extent(dev, path, mount="/sd"):
+    """
+    Returns (first block, number of blocks) of a file on the volume of dev
+    (the SDCard or BlockCache mounted at mount), or None when the file
+    is fragmented.
+    """
+    if path.startswith(mount + "/"):
+        path = path[len(mount) :]
+    vol = FatVolume(dev)
+    clus, size = vol.find(path)
+    if clus == 0:
+        return None  # empty file
+    return vol.extent(clus)
+
+
+def preallocate(dev, path, nbytes, mount="/sd", erase=True):
+    """
+    Create a file of nbytes (rounded up to blocks) and erase its blocks
+    on the card. Returns (first block, number of blocks). Raises OSError
+    when the filesystem did not allocate one contiguous extent.
+    Erased blocks read back as all 0x00 or all 0xFF, depending on the card.
+    """
+    nbytes = (nbytes + 511) // 512 * 512
+    buf = bytearray(_CHUNK)
+    with open(path, "wb") as f:
+        left = nbytes
+        while left:
+            n = min(left, _CHUNK)
+            f.write(buf if n == _CHUNK else memoryview(buf)[:n])
+            left -= n
+    # the FAT and directory entry are on the card after close (ioctl sync)
+    ext = file_extent(dev, path, mount)
+    if ext is None:
+        raise OSError("file is fragmented, no contiguous extent")
+    first, count = ext
+    count = min(count, nbytes // 512)
+    if erase:
+        dev.erase(first, count)
+    return first, count
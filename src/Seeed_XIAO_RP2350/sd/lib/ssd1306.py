@@ -32,6 +32,11 @@ class SSD1306(framebuf.FrameBuffer):
         self.external_vcc = external_vcc
         self.pages = self.height // 8
         self.buffer = bytearray(self.pages * self.width)
+        # copy of the frame as last sent to the display, for partial refresh
+        self.shadow = bytearray(self.pages * self.width)
+        self.shadow_valid = False
+        self.partial = True
+        self.bytes_sent = 0  # framebuffer bytes sent by the last show()
         super().__init__(self.buffer, self.width, self.height, framebuf.MONO_VLSB)
         self.init_display()
 
@@ -70,7 +75,7 @@ class SSD1306(framebuf.FrameBuffer):
         ):  # on
             self.write_cmd(cmd)
         self.fill(0)
-        self.show()
+        self.show(full=True)
 
     def poweroff(self):
         self.write_cmd(SET_DISP | 0x00)
@@ -85,20 +90,86 @@ class SSD1306(framebuf.FrameBuffer):
     def invert(self, invert):
         self.write_cmd(SET_NORM_INV | (invert & 1))
 
-    def show(self):
-        x0 = 0
-        x1 = self.width - 1
+    def set_window(self, col0, col1, page0, page1):
         if self.width == 64:
             # displays with width of 64 pixels are shifted by 32
-            x0 += 32
-            x1 += 32
+            col0 += 32
+            col1 += 32
         self.write_cmd(SET_COL_ADDR)
-        self.write_cmd(x0)
-        self.write_cmd(x1)
+        self.write_cmd(col0)
+        self.write_cmd(col1)
         self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
-        self.write_data(self.buffer)
+        self.write_cmd(page0)
+        self.write_cmd(page1)
+
+    def _dirty_pages(self, full=False):
+        # yields (page, first column, last column) of each page to send;
+        # _send_page() updates the shadow copy with what it sent
+        buf = self.buffer
+        shadow = self.shadow
+        w = self.width
+        for page in range(self.pages):
+            start = page * w
+            end = start + w
+            if full:
+                c0 = start
+                c1 = end - 1
+            else:
+                c0 = start
+                while c0 < end and buf[c0] == shadow[c0]:
+                    c0 += 1
+                if c0 == end:
+                    continue  # page unchanged
+                c1 = end - 1
+                while buf[c1] == shadow[c1]:
+                    c1 -= 1
+            yield page, c0 - start, c1 - start
+
+    def _send_page(self, page, c0, c1):
+        start = page * self.width + c0
+        end = start + c1 + 1 - c0
+        data = memoryview(self.buffer)[start:end]
+        self.set_window(c0, c1, page, page)
+        self.write_data(data)
+        # the bytes just sent, even if the buffer is redrawn before the next page
+        self.shadow[start:end] = data
+        return c1 + 1 - c0
+
+    def show(self, full=False):
+        if full or not self.partial or not self.shadow_valid:
+            self.set_window(0, self.width - 1, 0, self.pages - 1)
+            self.write_data(self.buffer)
+            self.shadow[:] = self.buffer
+            self.shadow_valid = True
+            self.bytes_sent = len(self.buffer)
+            return
+        # only send the changed column range of each changed page
+        sent = 0
+        for page, c0, c1 in self._dirty_pages():
+            sent += self._send_page(page, c0, c1)
+        self.bytes_sent = sent
+
+    def show_iter(self, full=False):
+        # Chunked refresh for a cooperative scheduler: sends at most one page
+        # per step and yields in between, so other devices on a shared bus
+        # can be serviced between two chunks.
+        full = full or not self.partial or not self.shadow_valid
+        sent = 0
+        for page, c0, c1 in self._dirty_pages(full):
+            sent += self._send_page(page, c0, c1)
+            self.bytes_sent = sent
+            yield sent
+        self.shadow_valid = True
+        self.bytes_sent = sent
+
+    async def show_async(self, full=False):
+        # show_iter() driven by uasyncio
+        try:
+            import uasyncio as asyncio
+        except ImportError:
+            import asyncio
+        for _ in self.show_iter(full):
+            await asyncio.sleep(0)
 
 
 class SSD1306_I2C(SSD1306):
@@ -0,0 +1,156 @@
+# Delta + zig-zag varint encoding of lib.tslog records
+#
+# A compressed sector holds a keyframe, the first record in full (the same
+# 20-byte layout as a raw tslog record), followed by the differences of each
+# next record to the one before it. Every field difference is zig-zag coded
+# (0, -1, 1, -2, ... -> 0, 1, 2, 3, ...) and written as a varint: 7 bits per
+# byte, low bits first, the top bit set on all bytes but the last.
+#
+# At 1 Hz the time steps by 1 and the sensor values by a few LSBs, so most
+# records take 6 bytes instead of 20, and none less than NFIELDS bytes. Each
+# sector decodes on its own; a bad sector loses only its own records.
+#
+# Example:
+#   >>> buf = bytearray(512)
+#   >>> enc = BlockEncoder(buf, 16)
+#   >>> enc.add(1746700000, 2240, 100068, 4385, 0, 2)
+#   >>> list(decode(buf, 16, enc.count, 16 + enc.used()))
+#
+# With a base, e.g. the start of the day, the encoder takes the times as
+# seconds after it. They stay small ints on MicroPython, where a unix time
+# is a long int on the heap, so adding a record allocates nothing.
+#
+# License: MIT
+
+import struct
+import micropython
+
+KEY_FMT = "<IiiihH"  # = tslog.REC_FMT
+_SPLIT_FMT = "<HHiiihH"  # the same with ts as its low and high 16 bits
+KEY_SIZE = 20
+NFIELDS = 6
+MAX_DELTA_SIZE = 26  # 4 x 5 bytes for the 32-bit fields, 2 x 3 for sync/flags
+
+
+@micropython.native
+def _put(buf, pos, d):
+    z = d << 1 if d >= 0 else ((-d) << 1) - 1
+    while z > 0x7F:
+        buf[pos] = (z & 0x7F) | 0x80
+        z >>= 7
+        pos += 1
+    buf[pos] = z
+    return pos + 1
+
+
+def split(base):
+    """ The low and high 16 bits of a time base, for pack_record(). """
+    return base & 0xFFFF, base >> 16
+
+
+def pack_record(buf, pos, base_lo, base_hi, ts, v0, v1, v2, sync, flags):
+    """ Packs a KEY_FMT record at time base + ts, with the base split(). """
+    lo = base_lo + ts
+    struct.pack_into(_SPLIT_FMT, buf, pos, lo & 0xFFFF, base_hi + (lo >> 16),
+                     v0, v1, v2, sync, flags)
+
+
+class BlockEncoder:
+    """ Encodes records into buf[start:end], e.g. the payload of a log sector. """
+
+    def __init__(self, buf, start, end=None, base=0):
+        # base: unix time that the ts of add() count from
+        self.buf = buf
+        self.start = start
+        self.end = len(buf) if end is None else end
+        self.base = base
+        self.base_lo, self.base_hi = split(base)
+        self.prev = [0] * NFIELDS
+        self.pos = start
+        self.count = 0
+
+    def reset(self):
+        """ Start a new block; the caller clears the buffer. """
+        self.pos = self.start
+        self.count = 0
+
+    def full(self):
+        """ True when the worst-case record does not fit anymore. """
+        return self.end - self.pos < MAX_DELTA_SIZE
+
+    def add(self, ts, v0, v1, v2, sync, flags):
+        prev = self.prev
+        if self.count == 0:
+            pack_record(self.buf, self.start, self.base_lo, self.base_hi,
+                        ts, v0, v1, v2, sync, flags)
+            self.pos = self.start + KEY_SIZE
+        else:
+            buf = self.buf
+            pos = _put(buf, self.pos, ts - prev[0])
+            pos = _put(buf, pos, v0 - prev[1])
+            pos = _put(buf, pos, v1 - prev[2])
+            pos = _put(buf, pos, v2 - prev[3])
+            pos = _put(buf, pos, sync - prev[4])
+            self.pos = _put(buf, pos, flags - prev[5])
+        prev[0] = ts
+        prev[1] = v0
+        prev[2] = v1
+        prev[3] = v2
+        prev[4] = sync
+        prev[5] = flags
+        self.count += 1
+
+    def load(self, count, used):
+        """
+        Continue a partly filled block of count records in used bytes that is
+        already in the buffer. Raises ValueError when they do not decode.
+        """
+        self.count = 0
+        self.pos = self.start
+        for rec in decode(self.buf, self.start, count, self.start + used, self):
+            pass
+        self.prev[0] -= self.base
+        self.count = count
+
+    def used(self):
+        return self.pos - self.start
+
+
+def max_count(used):
+    """ The most records a block of used bytes can hold. """
+    return 0 if used < KEY_SIZE else 1 + (used - KEY_SIZE) // NFIELDS
+
+
+def decode(buf, start, count, end=None, state=None):
+    """
+    Yields the count records (ts, v0, v1, v2, sync, flags) of the block in
+    buf[start:end]. Raises ValueError when a record runs past end.
+    With state (a BlockEncoder) the position and last record are left there.
+    """
+    if count == 0:
+        return
+    if end is None:
+        end = len(buf)
+    if start + KEY_SIZE > end:
+        raise ValueError("block too short")
+    rec = list(struct.unpack_from(KEY_FMT, buf, start))
+    yield tuple(rec)
+    pos = start + KEY_SIZE
+    for _ in range(count - 1):
+        for i in range(NFIELDS):
+            z = 0
+            shift = 0
+            while True:
+                if pos >= end:
+                    raise ValueError("block too short")
+                b = buf[pos]
+                pos += 1
+                z |= (b & 0x7F) << shift
+                if b < 0x80:
+                    break
+                shift += 7
+            rec[i] += (z >> 1) ^ -(z & 1)
+        yield tuple(rec)
+    if state is not None:
+        state.pos = pos
+        state.prev[:] = rec
@@ -0,0 +1,124 @@
+# Sparse time index for the time-series logs of lib.tslog
+#
+# The index is a sidecar file of 8-byte entries (ts, sector): the timestamp
+# of the first record of a log sector and the sector number. An entry is
+# added for the first sector of every hour, and at least every `every`
+# sectors. TSLogger calls add() when it starts a new sector, so the index
+# grows with the log; catch_up() indexes sectors written without it.
+#
+# query(t0, t1) finds the start sector with a binary search over the index
+# file and then reads only the sectors of the range: O(log n) seeks plus
+# the size of the range. Both rely on the times of a log never decreasing,
+# which TSLogger.add() guarantees.
+#
+# Example:
+#   >>> idx = TSIndex("/sd/TSLOG.BIN", "/sd/TSLOG.IDX")
+#   >>> for rec in idx.query(t0, t1):
+#   ...     print(rec)
+#
+# License: MIT
+
+from micropython import const
+import struct
+import os
+
+try:
+    from lib import tslog
+except ImportError:
+    import tslog
+
+ENTRY_FMT = "<II"
+ENTRY_SIZE = const(8)
+
+
+class TSIndex:
+    def __init__(self, log_path, idx_path, every=64):
+        self.log_path = log_path
+        self.idx_path = idx_path
+        self.every = every
+        self.entry = bytearray(ENTRY_SIZE)
+        self.n = 0
+        self.last_ts = 0
+        self.last_sector = -1
+        try:
+            size = os.stat(idx_path)[6]
+        except OSError:
+            size = 0
+        self.n = size // ENTRY_SIZE
+        if size % ENTRY_SIZE:
+            # torn last entry: rewrite the file without it
+            with open(idx_path, "rb") as f:
+                data = f.read(self.n * ENTRY_SIZE)
+            with open(idx_path, "wb") as f:
+                f.write(data)
+        if self.n:
+            self.last_ts, self.last_sector = self._entry_at(self.n - 1)
+        self.f = open(idx_path, "ab")
+
+    def _entry_at(self, i, f=None):
+        own = f is None
+        if own:
+            f = open(self.idx_path, "rb")
+        try:
+            f.seek(i * ENTRY_SIZE)
+            f.readinto(self.entry)
+        finally:
+            if own:
+                f.close()
+        return struct.unpack_from(ENTRY_FMT, self.entry, 0)
+
+    def add(self, ts, sector):
+        """ Called with the first record of each log sector. """
+        if sector <= self.last_sector:
+            return
+        if (self.n and ts // 3600 == self.last_ts // 3600
+                and sector - self.last_sector < self.every):
+            return
+        struct.pack_into(ENTRY_FMT, self.entry, 0, ts, sector)
+        self.f.write(self.entry)
+        self.f.flush()
+        self.n += 1
+        self.last_ts = ts
+        self.last_sector = sector
+
+    def catch_up(self):
+        """ Index the log sectors written after the last index entry. """
+        tslog.make_crc_tables()
+        buf = bytearray(tslog.SECTOR)
+        sector = max(self.last_sector + 1, 0)
+        with open(self.log_path, "rb") as f:
+            f.seek(sector * tslog.SECTOR)
+            while f.readinto(buf) == tslog.SECTOR:
+                state, seq, count = tslog.read_sector(buf)
+                if state == tslog.SECT_EMPTY:
+                    break
+                if count:
+                    self.add(struct.unpack_from("<I", buf, tslog.HDR_SIZE)[0], sector)
+                sector += 1
+
+    def seek(self, t):
+        """ Returns the log sector to start reading at for records from time t. """
+        lo, hi = 0, self.n
+        with open(self.idx_path, "rb") as f:
+            # last entry with ts <= t
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._entry_at(mid, f)[0] <= t:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo == 0:
+                return 0
+            return self._entry_at(lo - 1, f)[1]
+
+    def query(self, t0, t1):
+        """ Yields the log records (see tslog.iter_records) with t0 <= ts < t1. """
+        for rec in tslog.iter_records(self.log_path, self.seek(t0)):
+            ts = rec[1]
+            if ts >= t1:
+                return
+            if ts >= t0:
+                yield rec
+
+    def close(self):
+        self.f.close()
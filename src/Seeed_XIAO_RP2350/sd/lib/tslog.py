@@ -0,0 +1,325 @@
+# Block-aligned binary time-series logger for the SD card on /sd
+#
+# Records of fixed size are collected in one preallocated 512-byte sector
+# buffer. A sector is written to the file in one write when it is full, so at
+# one record per second the card sees one write every 24 seconds. Optionally
+# a partly filled sector is written in place at most every flush_s seconds,
+# to limit what is lost at a power failure.
+#
+# The times in a log file never decrease: when the RTC is set back, add()
+# logs the time of the record before until the clock has caught up.
+# lib.tsindex relies on that.
+#
+# Sector layout (all little endian):
+#   0  magic     4s  b"TSL1"
+#   4  seq       I   sector sequence number, +1 per sector
+#   8  count     H   number of valid records in this sector
+#  10  rec_size  H   size of one record
+#  12  crc       H   CRC16 over bytes 0..11 and 14..511, all but itself
+#                    (unused record slots are zero)
+#  14  reserved  H   compressed sectors: bytes used, bit 15 set when closed
+#  16  records, REC_PER_SECTOR x REC_SIZE bytes, rest zero
+#
+# A logger created with compress=True writes sectors with the magic b"TSZ1"
+# whose records are delta + varint encoded (see lib.tscodec), about 80
+# instead of 24 records per sector. iter_records() reads both kinds.
+#
+# Record:
+#   ts      I   local unix time (seconds)
+#   v0..v2  iii sensor values, e.g. temperature in 0.01 C, pressure in Pa,
+#               humidity in 0.01 %rH
+#   sync    h   offset in seconds between RTC and NTP at the last sync
+#   flags   H   FLAG_* bits
+#
+# A sector with a wrong magic or CRC, e.g. one torn by a power failure, or
+# with more records than fit, and a count below REC_PER_SECTOR (a partial
+# sector) are detected by read_sector(). Erased sectors (all 0x00 or 0xFF)
+# end the log.
+#
+# License: MIT
+
+from micropython import const
+import struct
+import os
+
+try:
+    from lib.sdcard import make_crc_tables, crc16
+    from lib import tscodec
+except ImportError:
+    from sdcard import make_crc_tables, crc16
+    import tscodec
+
+SECTOR = const(512)
+HDR_SIZE = const(16)
+_CRC_POS = const(12)  # of the crc field in the header
+_USED_POS = const(14)  # of the used field
+MAGIC = b"TSL1"
+MAGIC_Z = b"TSZ1"
+HDR_FMT = "<4sIHHHH"
+REC_FMT = "<IiiihH"
+REC_SIZE = const(20)
+REC_PER_SECTOR = (SECTOR - HDR_SIZE) // REC_SIZE  # 24
+
+_ZERO_SECTOR = bytes(SECTOR)
+_CLOSED = const(0x8000)
+
+def _crc(mv):
+    # CRC16 of a sector (a memoryview) without its crc field
+    return crc16(mv[_CRC_POS + 2 :], crc16(mv[:_CRC_POS]))
+
+
+def _used(buf):
+    # bytes used by the records of a compressed sector
+    return struct.unpack_from("<H", buf, _USED_POS)[0] & ~_CLOSED
+
+
+FLAG_SYNCED = const(1)  # the RTC was set from NTP in this second
+FLAG_BME280 = const(2)
+FLAG_MCP9808 = const(4)
+
+# read_sector() results
+SECT_OK = const(0)
+SECT_PARTIAL = const(1)
+SECT_EMPTY = const(2)
+SECT_BAD = const(3)
+
+
+def read_sector(buf):
+    """
+    Check a 512-byte sector. Returns (state, seq, count) with state one of
+    SECT_OK, SECT_PARTIAL, SECT_EMPTY or SECT_BAD.
+    """
+    magic = buf[0:4]
+    if magic != MAGIC and magic != MAGIC_Z:
+        first = buf[0]
+        if first in (0x00, 0xFF):
+            for i in range(1, 16):
+                if buf[i] != first:
+                    return SECT_BAD, 0, 0
+            return SECT_EMPTY, 0, 0
+        return SECT_BAD, 0, 0
+    _, seq, count, rec_size, crc, used = struct.unpack_from(HDR_FMT, buf, 0)
+    if magic == MAGIC:
+        full = count == REC_PER_SECTOR
+        if count > REC_PER_SECTOR:
+            return SECT_BAD, seq, 0
+    else:
+        full = used & _CLOSED
+        used &= ~_CLOSED
+        if used > SECTOR - HDR_SIZE or count > tscodec.max_count(used):
+            return SECT_BAD, seq, 0
+    if rec_size != REC_SIZE:
+        return SECT_BAD, seq, 0
+    if _crc(memoryview(buf)) != crc:
+        return SECT_BAD, seq, 0
+    return (SECT_OK if full else SECT_PARTIAL), seq, count
+
+
+class TSLogger:
+    def __init__(self, path, flush_s=0, dev=None, prealloc=0, mount="/sd", index=None,
+                 compress=False, base=0):
+        # path:     log file, 8.3 names if prealloc is used
+        # flush_s:  write a partly filled sector at most every flush_s seconds
+        #           (0 = only write full sectors)
+        # dev:      the mounted block device, with prealloc > 0 the file is
+        #           preallocated with that many bytes and pre-erased
+        #           (see lib.sdextent) when it does not exist yet
+        # index:    a lib.tsindex.TSIndex, told about the first record of
+        #           each sector
+        # compress: delta + varint encoded records (lib.tscodec)
+        # base:     unix time that the ts of add() count from, e.g. the start
+        #           of the day of the file: the ts then stay small ints and
+        #           add() allocates nothing on MicroPython
+        make_crc_tables()
+        self.base = base
+        self.base_lo, self.base_hi = tscodec.split(base)
+        self.index = index
+        self.path = path
+        self.flush_s = flush_s
+        self.buf = bytearray(SECTOR)
+        self.mv = memoryview(self.buf)
+        self.rec_mv = self.mv[HDR_SIZE:]
+        self.magic = MAGIC_Z if compress else MAGIC
+        self.enc = tscodec.BlockEncoder(self.buf, HDR_SIZE, base=base) if compress else None
+        self.count = 0
+        self.seq = 0
+        self.sector = 0  # sector index of self.buf in the file
+        self.capacity = 0  # sectors in a preallocated file, 0 = grows
+        self.last_write = None  # ts of the last write, the first add() until then
+        self.last_ts = None  # ts of the last record, None for none
+        self.writes = 0
+        self.lost = 0  # records that did not fit in a full preallocated file
+        exists = True
+        try:
+            size = os.stat(path)[6]
+        except OSError:
+            exists = False
+            size = 0
+        if prealloc and dev is not None:
+            if not exists:
+                from lib.sdextent import preallocate
+                preallocate(dev, path, prealloc, mount)
+                size = os.stat(path)[6]
+            self.capacity = size // SECTOR
+            self.f = open(path, "r+b")
+            n_used = self._find_end(self.capacity)
+        else:
+            self.f = open(path, "r+b" if exists else "wb")
+            n_used = size // SECTOR
+        self._resume(n_used)
+
+    def _state(self, idx):
+        self.f.seek(idx * SECTOR)
+        self.f.readinto(self.buf)
+        return read_sector(self.buf)
+
+    def _find_end(self, n):
+        # binary search for the first empty sector of a preallocated file
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._state(mid)[0] == SECT_EMPTY:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _resume(self, n_used):
+        # continue after the last sector, or in it when it is partial
+        self.sector = n_used
+        self.count = 0
+        if n_used:
+            state, seq, count = self._state(n_used - 1)
+            self.seq = seq + 1
+            self._last_time(state, count)
+            if state == SECT_PARTIAL and self.buf[0:4] == self.magic:
+                try:
+                    if self.enc:
+                        self.enc.load(count, _used(self.buf))
+                except ValueError:
+                    state = SECT_BAD  # the records do not decode
+                else:
+                    self.sector = n_used - 1
+                    self.seq = seq
+                    self.count = count
+                    return
+            if state == SECT_BAD:
+                # torn by a power failure: overwrite it
+                self.sector = n_used - 1
+                self.seq = 0
+                if n_used > 1:
+                    state, seq, count = self._state(n_used - 2)
+                    self.seq = seq + 1
+                    self._last_time(state, count)
+        self.buf[:] = _ZERO_SECTOR
+
+    def _last_time(self, state, count):
+        # last_ts from the last record of the sector in the buffer
+        if (state != SECT_OK and state != SECT_PARTIAL) or not count:
+            return
+        buf = self.buf
+        if buf[0:4] == MAGIC_Z:
+            try:
+                for rec in tscodec.decode(buf, HDR_SIZE, count, HDR_SIZE + _used(buf)):
+                    ts = rec[0]
+            except ValueError:
+                return
+        else:
+            ts = struct.unpack_from("<I", buf, HDR_SIZE + (count - 1) * REC_SIZE)[0]
+        self.last_ts = ts - self.base
+
+    def _write(self, closed=False):
+        used = 0
+        if self.enc:
+            used = self.enc.used() | (_CLOSED if closed else 0)
+        struct.pack_into(HDR_FMT, self.buf, 0, self.magic, self.seq, self.count, REC_SIZE,
+                         0, used)
+        struct.pack_into("<H", self.buf, _CRC_POS, _crc(self.mv))
+        self.f.seek(self.sector * SECTOR)
+        self.f.write(self.mv)
+        self.f.flush()
+        self.writes += 1
+
+    def add(self, ts, v0=0, v1=0, v2=0, sync=0, flags=0):
+        """
+        Add one record at time base + ts, or at the time of the record
+        before if that is later. Writes to the card only when a sector is
+        full or flush_s passed.
+        """
+        if self.capacity and self.sector >= self.capacity:
+            self.lost += 1
+            return
+        last = self.last_ts
+        if last is not None and ts < last:
+            ts = last  # the RTC was set back
+        self.last_ts = ts
+        if self.last_write is None:
+            self.last_write = ts
+        if self.count == 0 and self.index is not None:
+            self.index.add(self.base + ts, self.sector)
+        sync = max(-32768, min(32767, sync))
+        enc = self.enc
+        if enc:
+            enc.add(ts, v0, v1, v2, sync, flags)
+            self.count = enc.count
+            full = enc.full()
+        else:
+            tscodec.pack_record(self.buf, HDR_SIZE + self.count * REC_SIZE,
+                                self.base_lo, self.base_hi, ts, v0, v1, v2, sync, flags)
+            self.count += 1
+            full = self.count == REC_PER_SECTOR
+        if full:
+            self._write(True)
+            self.last_write = ts
+            self.sector += 1
+            self.seq += 1
+            self.count = 0
+            self.buf[:] = _ZERO_SECTOR
+            if enc:
+                enc.reset()
+        elif self.flush_s and ts - self.last_write >= self.flush_s:
+            self.flush()
+            self.last_write = ts
+
+    def flush(self):
+        """ Write the partly filled sector in place. """
+        if self.count:
+            self._write()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def iter_records(path, start_sector=0):
+    """
+    Yields (seq, ts, v0, v1, v2, sync, flags) for each record of a log file,
+    skipping bad sectors and stopping at the first empty one.
+    """
+    make_crc_tables()
+    buf = bytearray(SECTOR)
+    with open(path, "rb") as f:
+        f.seek(start_sector * SECTOR)
+        while f.readinto(buf) == SECTOR:
+            state, seq, count = read_sector(buf)
+            if state == SECT_EMPTY:
+                return
+            if state != SECT_BAD:
+                for rec in sector_records(buf, seq, count):
+                    yield rec
+
+
+def sector_records(buf, seq, count):
+    """
+    Yields (seq, ts, v0, v1, v2, sync, flags) for each record of a sector
+    that read_sector() found good, with the seq and count it returned.
+    """
+    if buf[0:4] == MAGIC_Z:
+        try:
+            for rec in tscodec.decode(buf, HDR_SIZE, count, HDR_SIZE + _used(buf)):
+                yield (seq,) + rec
+        except ValueError:
+            pass  # the rest of the sector does not decode: skip it
+        return
+    for i in range(count):
+        yield (seq,) + struct.unpack_from(REC_FMT, buf, HDR_SIZE + i * REC_SIZE)
@@ -0,0 +1,379 @@
+# Rollup of the lib.tslog log segments into minute and hour aggregates
+#
+# The logger writes one segment file per day, named after the date
+# (e.g. "/sd/LOG/20250508.BIN", see segment_path()). Once a day is over its
+# segment is closed, and Rollup reads it in one pass and appends one
+# aggregate record per minute and per hour to two compact files:
+#
+#   MINUTES.AGG  1440 records per day
+#   HOURS.AGG      24 records per day
+#
+# Aggregate record (little endian, AGG_SIZE bytes):
+#   ts      I    start of the minute or hour (local unix time)
+#   count   H    number of raw records
+#   flags   H    OR of the record flags
+#   v0..v2  3 x (min i, max i, mean i)
+#
+# RAM use is two accumulators and one sector buffer, whatever the size of
+# a segment. After a segment is done its name goes to the state file.
+# After a reset partway through, the segment is rolled up again from the
+# start; aggregates that are already in a file (ts not above its last
+# record) are skipped, and a torn last record is overwritten. The times of
+# a log never decrease (see lib.tslog), so only these are skipped; the
+# number of the last pass is in Rollup.skipped.
+#
+# start() queues the work and each step() does a few sectors of it, so a
+# main loop can roll up a backlog of days between two passes. run() does
+# it all at once.
+#
+# Segments older than keep_days that are rolled up are deleted together
+# with their index file, or moved to the archive directory.
+#
+# Example:
+#   >>> r = Rollup("/sd/LOG", keep_days=30)
+#   >>> r.run(current="/sd/LOG/20250508.BIN")
+#   (2, 2880, 48, 1)
+#   >>> r.start(current="/sd/LOG/20250509.BIN")
+#   >>> while r.step(8):                 # 8 sectors per loop pass
+#   ...     pass
+#   >>> r.result
+#   (1, 1440, 24, 1)
+#
+# License: MIT
+
+from micropython import const
+from array import array
+import struct
+import time
+import os
+
+try:
+    from lib import tslog
+except ImportError:
+    import tslog
+
+AGG_FMT = "<IHHiiiiiiiii"
+AGG_SIZE = const(44)
+
+_MINUTE = const(60)
+_HOUR = const(3600)
+_DAY = const(86400)
+
+
+def segment_name(ts):
+    """ 8.3 base name of the segment for local unix time ts, e.g. "20250508". """
+    t = time.localtime(ts)
+    return "{:04d}{:02d}{:02d}".format(t[0], t[1], t[2])
+
+
+def segment_path(log_dir, ts, ext=".BIN"):
+    return log_dir + "/" + segment_name(ts) + ext
+
+
+class _Bucket:
+    """ min/max/sum/count of the three values over one minute or hour. """
+
+    def __init__(self):
+        self.t = -1
+        self.n = 0
+        self.flags = 0
+        self.mn = array("l", (0, 0, 0))
+        self.mx = array("l", (0, 0, 0))
+        self.sm = [0, 0, 0]  # ints, a day of pressures in Pa overflows 32 bits
+
+    def add(self, v0, v1, v2, flags):
+        mn = self.mn
+        mx = self.mx
+        sm = self.sm
+        if self.n == 0:
+            mn[0] = mx[0] = sm[0] = v0
+            mn[1] = mx[1] = sm[1] = v1
+            mn[2] = mx[2] = sm[2] = v2
+        else:
+            if v0 < mn[0]:
+                mn[0] = v0
+            elif v0 > mx[0]:
+                mx[0] = v0
+            if v1 < mn[1]:
+                mn[1] = v1
+            elif v1 > mx[1]:
+                mx[1] = v1
+            if v2 < mn[2]:
+                mn[2] = v2
+            elif v2 > mx[2]:
+                mx[2] = v2
+            sm[0] += v0
+            sm[1] += v1
+            sm[2] += v2
+        self.n += 1
+        self.flags |= flags
+
+    def pack_into(self, buf):
+        n = self.n
+        mn = self.mn
+        mx = self.mx
+        sm = self.sm
+        struct.pack_into(AGG_FMT, buf, 0, self.t, min(n, 0xFFFF), self.flags,
+                         mn[0], mx[0], sm[0] // n,
+                         mn[1], mx[1], sm[1] // n,
+                         mn[2], mx[2], sm[2] // n)
+
+    def reset(self, t):
+        self.t = t
+        self.n = 0
+        self.flags = 0
+
+
+class _AggFile:
+    """ Append-only aggregate file that skips records it already has. """
+
+    def __init__(self, path):
+        self.path = path
+        self.buf = bytearray(AGG_SIZE)
+        self.last_ts = -1
+        self.written = 0
+        self.skipped = 0  # buckets not above last_ts
+        try:
+            size = os.stat(path)[6]
+        except OSError:
+            size = 0
+        self.pos = size // AGG_SIZE * AGG_SIZE  # a torn record is overwritten
+        if self.pos:
+            with open(path, "rb") as f:
+                f.seek(self.pos - AGG_SIZE)
+                f.readinto(self.buf)
+            self.last_ts = struct.unpack_from("<I", self.buf, 0)[0]
+        self.f = open(path, "r+b" if size else "wb")
+        self.f.seek(self.pos)
+
+    def emit(self, bucket):
+        if bucket.n == 0:
+            return
+        if bucket.t <= self.last_ts:
+            self.skipped += 1
+            return
+        bucket.pack_into(self.buf)
+        self.f.write(self.buf)
+        self.pos += AGG_SIZE
+        self.last_ts = bucket.t
+        self.written += 1
+
+    def close(self):
+        self.f.close()
+
+
+class Rollup:
+    def __init__(self, log_dir, keep_days=30, archive_dir=None,
+                 state_name="ROLLUP.ST", min_name="MINUTES.AGG", hour_name="HOURS.AGG"):
+        # log_dir:     directory with the daily segments "YYYYMMDD.BIN"
+        # keep_days:   raw segments older than this are deleted once rolled
+        #              up (0 = keep all)
+        # archive_dir: move them there instead of deleting them
+        self.log_dir = log_dir
+        self.keep_days = keep_days
+        self.archive_dir = archive_dir
+        self.state_path = log_dir + "/" + state_name
+        self.min_path = log_dir + "/" + min_name
+        self.hour_path = log_dir + "/" + hour_name
+        self.done = self._load_state()
+        self.buf = bytearray(tslog.SECTOR)
+        self.m = _Bucket()
+        self.h = _Bucket()
+        self.names = []  # closed segments
+        self.todo = []  # of them still to roll up, the first one open in f
+        self.f = None
+        self.mins = self.hours = None
+        self.now = 0
+        self.active = False  # start() queued work that step() has not done
+        self.rolled = 0
+        self.result = None  # (segments, minute records, hour records, retired) of the last pass
+        self.skipped = 0  # aggregates already in the files, in the last pass
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r") as f:
+                return f.read(8)
+        except OSError:
+            return ""
+
+    def _save_state(self, name):
+        with open(self.state_path, "w") as f:
+            f.write(name)
+        self.done = name
+
+    def segments(self):
+        """ Sorted base names of the segment files in log_dir. """
+        names = []
+        for name in os.listdir(self.log_dir):
+            if len(name) == 12 and name.endswith(".BIN") and name[:8].isdigit():
+                names.append(name[:8])
+        names.sort()
+        return names
+
+    def start(self, current=None, now=None):
+        """
+        Queue all closed segments not done yet for step(), and the
+        retirement of the old ones. current is the path of the segment that
+        is being written (skipped; by default the newest one). A pass that
+        is still going on starts over.
+        """
+        self._close()
+        self.skipped = 0
+        names = self.segments()
+        if current is None:
+            names = names[:-1]
+        else:
+            names = [n for n in names if self.log_dir + "/" + n + ".BIN" != current]
+        self.names = names
+        self.todo = [n for n in names if n > self.done]
+        self.now = time.time() if now is None else now
+        self.rolled = 0
+        self.result = None
+        self.active = True
+        if self.todo:
+            self.mins = _AggFile(self.min_path)
+            self.hours = _AggFile(self.hour_path)
+
+    def step(self, sectors=8):
+        """
+        Roll up at most `sectors` log sectors of the queued segments.
+        Returns True while there is more to do. At the end the old segments
+        are retired and result is set.
+        """
+        if not self.active:
+            return False
+        try:
+            while sectors > 0 and self.todo:
+                if self.f is None:
+                    self.f = open(self.log_dir + "/" + self.todo[0] + ".BIN", "rb")
+                    self.m.reset(-1)
+                    self.h.reset(-1)
+                if self._roll_sector():
+                    sectors -= 1
+                else:
+                    self._end_segment()
+            if self.todo:
+                return True
+        except Exception:
+            # given up until the next start()
+            self._close()
+            self.active = False
+            raise
+        self._finish()
+        return False
+
+    def run(self, current=None, now=None):
+        """
+        Roll up all closed segments not done yet and retire the old ones,
+        all at once. Returns result.
+        """
+        self.start(current, now)
+        while self.step(64):
+            pass
+        return self.result
+
+    def _roll_sector(self):
+        # one sector of the open segment; False at its end
+        buf = self.buf
+        if self.f.readinto(buf) != tslog.SECTOR:
+            return False
+        state, seq, count = tslog.read_sector(buf)
+        if state == tslog.SECT_EMPTY:
+            return False
+        if state == tslog.SECT_BAD:
+            return True
+        m = self.m
+        h = self.h
+        mins = self.mins
+        hours = self.hours
+        for rec in tslog.sector_records(buf, seq, count):
+            ts = rec[1]
+            t = ts - ts % _MINUTE
+            if t != m.t:
+                mins.emit(m)
+                m.reset(t)
+            t = ts - ts % _HOUR
+            if t != h.t:
+                hours.emit(h)
+                h.reset(t)
+            m.add(rec[2], rec[3], rec[4], rec[6])
+            h.add(rec[2], rec[3], rec[4], rec[6])
+        return True
+
+    def _end_segment(self):
+        # a segment ends at midnight, the last buckets are complete
+        self.f.close()
+        self.f = None
+        self.mins.emit(self.m)
+        self.hours.emit(self.h)
+        # the aggregates must be on the card before the state says so
+        self.mins.f.flush()
+        self.hours.f.flush()
+        self._save_state(self.todo.pop(0))
+        self.rolled += 1
+
+    def _close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        for agg in (self.mins, self.hours):
+            if agg is not None:
+                self.skipped += agg.skipped
+                agg.close()
+        self.mins = self.hours = None
+
+    def _finish(self):
+        n_min = self.mins.written if self.mins else 0
+        n_hour = self.hours.written if self.hours else 0
+        self._close()
+        retired = 0
+        if self.keep_days:
+            cutoff = segment_name(self.now - self.keep_days * _DAY)
+            for name in self.names:
+                if name < cutoff and name <= self.done:
+                    self._retire(name)
+                    retired += 1
+        self.result = (self.rolled, n_min, n_hour, retired)
+        self.active = False
+
+    def _retire(self, name):
+        for ext in (".BIN", ".IDX"):
+            src = self.log_dir + "/" + name + ext
+            try:
+                if self.archive_dir:
+                    os.rename(src, self.archive_dir + "/" + name + ext)
+                else:
+                    os.remove(src)
+            except OSError:
+                pass  # no index file
+
+
+def iter_aggregates(path, t0=0, t1=0xFFFFFFFF):
+    """
+    Yields (ts, count, flags, min0, max0, mean0, min1, max1, mean1,
+    min2, max2, mean2) for the aggregates of a file with t0 <= ts < t1.
+    """
+    buf = bytearray(AGG_SIZE)
+    try:
+        size = os.stat(path)[6]
+    except OSError:
+        return
+    n = size // AGG_SIZE
+    with open(path, "rb") as f:
+        # binary search for the first record at or after t0
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(mid * AGG_SIZE)
+            f.readinto(buf)
+            if struct.unpack_from("<I", buf, 0)[0] < t0:
+                lo = mid + 1
+            else:
+                hi = mid
+        f.seek(lo * AGG_SIZE)
+        for _ in range(lo, n):
+            f.readinto(buf)
+            rec = struct.unpack_from(AGG_FMT, buf, 0)
+            if rec[0] >= t1:
+                return
+            yield rec
@@ -0,0 +1,175 @@
+# NTP-style time and delay measurement over a UART
+#
+# The client (the XIAO) sends a ping and stamps T1 with ticks_us() just
+# before the write and T4 when the whole answer is in. The server (the
+# Pico) stamps T2 when the whole ping is in and T3 just before its answer,
+# both as microseconds after the NTP time it got last. Both messages have
+# the same length, so both legs take the same time on the wire:
+#
+#   delay        = (T4 - T1) - (T3 - T2)   the round trip without the server
+#   time at T4   = NTP seconds + (T3 + delay / 2) us
+#
+#   ping  "?P" + >L  T1, then 12 zero bytes
+#   pong  "!P" + >LLll  T1 (echoed), NTP seconds, T2, T3
+#
+# A late stamp (a poll interval, an interrupt) adds to the delay of its
+# exchange, and half of it to the error, so burst() does a few exchanges
+# and keeps the one with the smallest delay. The server answers only while
+# it waits in serve(), and only for 5 minutes after set_reference().
+#
+#   >>> ping = PingClient(uart)              # XIAO
+#   >>> if ping.burst(4) >= 0:
+#   ...     sec, at = ping.next_second()     # set the RTC to sec at ticks_us() at
+#
+#   >>> ping = PingServer(uart)              # Pico
+#   >>> ping.set_reference(ntp_time, ticks)  # ntp_time was current at ticks_us() ticks
+#   >>> ping.serve(10000)                    # instead of sleep(10)
+#
+# The same file is in the flash of the Pimoroni Pico Plus 2.
+#
+# License: MIT
+
+from micropython import const
+import struct
+import time
+
+PING = b"?P"
+PONG = b"!P"
+MSG_LEN = const(18)  # both messages, 18.75 ms at 9600 baud
+_POLL_US = const(100)  # polling while a message comes in
+_IDLE_MS = const(5)  # polling before, shorter than a message takes
+_STALE_US = const(100000)  # an incomplete message this old is dropped
+_MAX_AGE_MS = const(300000)  # no answers from an older reference (ticks_us() wraps in 17.9 min)
+
+
+def _is(buf, tag):
+    return buf[0] == tag[0] and buf[1] == tag[1]
+
+
+class PingServer:
+    def __init__(self, uart):
+        self.uart = uart
+        self.rx = bytearray(MSG_LEN)
+        self.tx = bytearray(MSG_LEN)
+        self.tx[0:2] = PONG
+        self.sec = 0  # NTP seconds of the reference, 0 before the first
+        self.ticks = 0  # ticks_us() at which they were current
+        self.ms = 0  # ticks_ms() of the same
+        self.answered = 0
+
+    def set_reference(self, sec, ticks):
+        """ The NTP time sec was current at ticks_us() ticks. """
+        self.sec = sec
+        self.ticks = ticks
+        self.ms = time.ticks_ms()
+
+    def serve(self, ms):
+        """ Sleep for ms, answering pings meanwhile. """
+        u = self.uart
+        t0 = time.ticks_ms()
+        first = None  # ticks_us() when a message started to come in
+        while True:
+            left = ms - time.ticks_diff(time.ticks_ms(), t0)
+            if left <= 0:
+                return
+            n = u.any()
+            if n >= MSG_LEN:
+                self._answer(time.ticks_us())
+                first = None
+            elif n:
+                t = time.ticks_us()
+                if first is None:
+                    first = t
+                elif time.ticks_diff(t, first) > _STALE_US:
+                    u.read()
+                    first = None
+                time.sleep_us(_POLL_US)
+            else:
+                time.sleep_ms(min(left, _IDLE_MS))
+
+    def _answer(self, t2):
+        u = self.uart
+        rx = self.rx
+        u.readinto(rx, MSG_LEN)
+        if not _is(rx, PING):
+            u.read()  # something else: drop it all
+            return
+        if not self.sec or time.ticks_diff(time.ticks_ms(), self.ms) > _MAX_AGE_MS:
+            return
+        tx = self.tx
+        tx[2:6] = rx[2:6]
+        struct.pack_into(">Ll", tx, 6, self.sec, time.ticks_diff(t2, self.ticks))
+        t3 = time.ticks_us()
+        struct.pack_into(">l", tx, 14, time.ticks_diff(t3, self.ticks))
+        u.write(tx)
+        self.answered += 1
+
+
+class PingClient:
+    def __init__(self, uart, timeout_ms=100):
+        self.uart = uart
+        self.timeout_us = timeout_ms * 1000
+        self.tx = bytearray(MSG_LEN)
+        self.tx[0:2] = PING
+        self.rx = bytearray(MSG_LEN)
+        # the exchange with the smallest delay of the last burst()
+        self.delay = -1  # us, -1 for none
+        self.sec = 0  # the NTP time at ticks_us() ticks is sec + us
+        self.us = 0
+        self.ticks = 0
+        self.lost = 0  # pings without a valid answer
+
+    def exchange(self):
+        """ One ping; returns its delay in us, or -1 without a valid answer. """
+        u = self.uart
+        if u.any():
+            u.read()  # nothing else is expected now
+        tx = self.tx
+        t1 = time.ticks_us()
+        struct.pack_into(">L", tx, 2, t1)
+        u.write(tx)
+        while True:
+            n = u.any()
+            if n >= MSG_LEN:
+                t4 = time.ticks_us()
+                break
+            if time.ticks_diff(time.ticks_us(), t1) > self.timeout_us:
+                self.lost += 1
+                return -1
+            if n:
+                time.sleep_us(_POLL_US)
+            else:
+                time.sleep_ms(1)
+        rx = self.rx
+        u.readinto(rx, MSG_LEN)
+        e1, sec, t2, t3 = struct.unpack_from(">LLll", rx, 2)
+        if not _is(rx, PONG) or e1 != t1 or not sec:
+            self.lost += 1
+            return -1
+        d = time.ticks_diff(t4, t1) - (t3 - t2)
+        if d < 0:
+            d = 0
+        if self.delay < 0 or d < self.delay:
+            self.delay = d
+            self.sec = sec
+            self.us = t3 + d // 2
+            self.ticks = t4
+        return d
+
+    def burst(self, n=4):
+        """ n exchanges; returns the smallest delay in us, or -1 without any answer. """
+        self.delay = -1
+        for _ in range(n):
+            self.exchange()
+        return self.delay
+
+    def now(self):
+        """ The NTP second now. """
+        return self.sec + (self.us + time.ticks_diff(time.ticks_us(), self.ticks)) // 1000000
+
+    def next_second(self, lead_us=0):
+        """ The NTP second that starts at least lead_us from now, and the ticks_us() of its start. """
+        t = time.ticks_us()
+        us = self.us + time.ticks_diff(t, self.ticks)  # after self.sec, now
+        k = (us + lead_us) // 1000000 + 1
+        return self.sec + k, time.ticks_add(t, k * 1000000 - us)
@@ -0,0 +1,20 @@
+"""
+Host-side simulator for the MicroPython boards of this repository.
+
+Runs the unmodified boot.py and main.py of the Seeed XIAO RP2350 and the
+Pimoroni Pico Plus 2 on CPython against models of their hardware: the
+machine, rp2, network, ntptime and framebuf modules (mpsim/fakes), the
+PCF8563, BME280, MCP9808 and SSD1306 on I2C, an SD card on SPI and the UART
+between the boards. Time is virtual, so an hour of device time runs in
+seconds and a run is repeatable.
+
+    >>> from mpsim import Simulation
+    >>> sim = Simulation("/tmp/sim", boards=("xiao", "pico"), seconds=3600)
+    >>> sim.report(sim.run())
+
+or from the shell: python -m mpsim --help
+"""
+
+from .clock import Clock, SimStop
+from .board import Board
+from .runner import Simulation
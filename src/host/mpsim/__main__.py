@@ -0,0 +1,48 @@
+# Command line: python -m mpsim [xiao|pico|both] --seconds N ...
+#
+# License: MIT
+
+import argparse
+import os
+import tempfile
+
+from .runner import Simulation
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="mpsim", description="Run the board scripts on the "
+                                "simulated hardware in virtual time.")
+    p.add_argument("boards", nargs="?", default="both", choices=("xiao", "pico", "both"))
+    p.add_argument("-s", "--seconds", type=float, default=600,
+                   help="simulated time to run (default 600)")
+    p.add_argument("-d", "--workdir", help="flash copies, /sd files and card image "
+                   "(default: a new temporary directory); kept between runs")
+    p.add_argument("--epoch", type=int, default=1746700000, help="unix time at the start")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--rtc-offset", type=float, default=-3.0,
+                   help="PCF8563 minus true time at the start, seconds")
+    p.add_argument("--rtc-ppm", type=float, default=20.0, help="PCF8563 crystal error")
+    p.add_argument("--sync-every", type=float, default=60,
+                   help="send interval of the scripted peer when only the XIAO runs")
+    p.add_argument("--console-bps", type=float,
+                   help="bytes per second the USB host reads from the consoles (default: no limit)")
+    p.add_argument("-q", "--quiet", action="store_true", help="hide the board output")
+    p.add_argument("--pbm", help="save the last OLED frame to this PBM file")
+    args = p.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="mpsim-")
+    boards = ("xiao", "pico") if args.boards == "both" else (args.boards,)
+    sim = Simulation(workdir, boards, seconds=args.seconds, epoch=args.epoch, seed=args.seed,
+                     rtc_offset_s=args.rtc_offset, rtc_ppm=args.rtc_ppm,
+                     sync_every_s=args.sync_every, quiet=args.quiet,
+                     console_bps=args.console_bps)
+    wall = sim.run()
+    sim.report(wall)
+    print("files in", os.path.abspath(workdir))
+    if args.pbm and "oled" in sim.devices:
+        sim.devices["oled"].save_pbm(args.pbm)
+    return 1 if sim.errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,359 @@
+# Loop benchmark: what one iteration of the XIAO main() loop, or one pass of
+# the Pico sender loop, costs per stage
+#
+#   python -m mpsim.bench run xiao -n 100 -o base.json
+#   python -m mpsim.bench run pico -n 30 -o base-pico.json
+#   python -m mpsim.bench compare base.json new.json
+#
+# main.py runs unmodified in the simulator; the harness wraps the objects and
+# functions of its globals to tell the stages apart:
+#
+#   xiao  uart    uart.read()/write(), handle_rx_buf()
+#         sensor  bme280.read_compensated_data(), sensor.get_temp_one_shot()
+#         rtc     rtc.DateTime(), Date() and Time()
+#         log     log_values() (the SD card logger)
+#         display oled methods and the TextField updates
+#         console log.drain()/flush() (lib/conlog.py)
+#         timer   machine.Timer callbacks of the mounted block device (the
+#                 write-back of lib/sdcache.py), which run during the sleeps
+#         idle    time.sleep*()
+#         format  the rest of the loop: string formatting and print()
+#   pico  wifi    wlan methods and do_connect()
+#         ntp     handle_ntp()
+#         uart    uart.write()
+#         idle    sleep()
+#         format  the rest
+#
+# Per stage and iteration it reports the simulated time (bus transfers and
+# sleeps, so deterministic), the host CPU time (includes the models, for
+# comparing runs on one PC only), the gc.mem_alloc() delta and the
+# transactions and bytes per I2C/SPI device and UART. gc.mem_alloc() is
+# backed by tracemalloc here, so a delta is the net change of the heap; on
+# the device it also counts what the next collection frees.
+#
+# License: MIT
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time as _time
+
+from .clock import SimStop
+from .runner import Simulation
+
+STAGES = {
+    "xiao": ("uart", "sensor", "rtc", "log", "display", "console", "timer", "format", "idle"),
+    "pico": ("wifi", "ntp", "uart", "format", "idle"),
+}
+
+# a change counts only above these absolute amounts per iteration
+MIN_DELTA = {"t_us": 20, "cpu_us": 200, "mem": 256, "transactions": 0.5, "bytes": 1}
+
+
+class Meter:
+    """ Splits the simulated time, CPU time, heap and bus traffic of a board into stages. """
+
+    def __init__(self, b, iterations, warmup=1):
+        self.board = b
+        self.clock = b.clock
+        self.iterations = iterations
+        self.warmup = warmup
+        self.stack = ["setup"]
+        self.cur = {}
+        self.iters = []
+        self.seen = 0
+        self.last = self.snapshot()
+
+    def snapshot(self):
+        s = {"t_us": self.clock.now_us, "cpu_us": _time.thread_time_ns() // 1000,
+             "mem": gc.mem_alloc()}
+        for bus in self.board.i2c.values():
+            for addr, (n, nbytes) in bus.per_addr.items():
+                dev = bus.devices.get(addr)
+                name = "I2C%d.%s" % (bus.id, type(dev).__name__ if dev else "scan")
+                s[name + ".transactions"] = n
+                s[name + ".bytes"] = nbytes
+        for bus in self.board.spi.values():
+            for dev, (n, nbytes) in bus.per_device.items():
+                s["SPI%d.%s.transactions" % (bus.id, dev)] = n
+                s["SPI%d.%s.bytes" % (bus.id, dev)] = nbytes
+        for u in self.board.uarts.values():
+            s["UART%d.transactions" % u.id] = u.writes + u.reads
+            s["UART%d.bytes" % u.id] = u.tx_bytes + u.rx_bytes
+        return s
+
+    def _account(self):
+        now = self.snapshot()
+        acc = self.cur.setdefault(self.stack[-1], {})
+        last = self.last
+        for k, v in now.items():
+            d = v - last.get(k, 0)
+            if d:
+                acc[k] = acc.get(k, 0) + d
+        self.last = now
+
+    def enter(self, stage):
+        self._account()
+        self.stack.append(stage)
+
+    def leave(self):
+        self._account()
+        self.stack.pop()
+
+    def iteration(self):
+        """ Called at the top of each loop pass. """
+        self._account()
+        if self.seen > self.warmup:
+            self.iters.append(self.cur)
+        self.seen += 1
+        self.cur = {}
+        self.stack[:] = ["format"]
+        if len(self.iters) >= self.iterations:
+            self.clock.stop()
+            raise SimStop()
+
+    # --- wrapping ---
+
+    def wrap(self, fn, stage, mark=False):
+        def wrapper(*args, **kw):
+            if mark:
+                self.iteration()
+            self.enter(stage)
+            try:
+                return fn(*args, **kw)
+            finally:
+                self.leave()
+
+        return wrapper
+
+    def wrap_methods(self, obj, stage, names):
+        for n in names:
+            fn = getattr(obj, n, None)
+            if fn is not None:
+                setattr(obj, n, self.wrap(fn, stage))
+
+    # --- results ---
+
+    def summary(self):
+        n = len(self.iters)
+        stages = {}
+        for it in self.iters:
+            for stage, acc in it.items():
+                dst = stages.setdefault(stage, {})
+                for k, v in acc.items():
+                    dst[k] = dst.get(k, 0) + v
+        for dst in stages.values():
+            for k in dst:
+                dst[k] = round(dst[k] / n, 3)
+        work = sorted(sum(acc.get("t_us", 0) for stage, acc in it.items() if stage != "idle")
+                      for it in self.iters)
+        return {
+            "iterations": n,
+            "stages": stages,
+            "total": _total(stages),
+            "busy_us": {"min": work[0], "median": work[n // 2], "max": work[-1]} if n else {},
+        }
+
+
+class _TimeProxy:
+    """ The time module for main.py, with the sleeps counted as idle. """
+
+    def __init__(self, meter, module):
+        self._m = module
+        for name in ("sleep", "sleep_ms", "sleep_us"):
+            setattr(self, name, meter.wrap(getattr(module, name), "idle"))
+
+    def __getattr__(self, name):
+        return getattr(self._m, name)
+
+
+def _total(stages):
+    tot = {}
+    for stage, acc in stages.items():
+        if stage == "idle":
+            continue
+        for k, v in acc.items():
+            tot[k] = round(tot.get(k, 0) + v, 3)
+    return tot
+
+
+def _instrument_xiao(m, g):
+    uart = g["uart"]
+    read = uart.read
+    uart.read = m.wrap(read, "uart", mark=True)
+    uart.write = m.wrap(uart.write, "uart")
+    g["handle_rx_buf"] = m.wrap(g["handle_rx_buf"], "uart")
+    if g.get("bme280") is not None:
+        m.wrap_methods(g["bme280"], "sensor", ["read_compensated_data"])
+    if g.get("sensor") is not None:
+        m.wrap_methods(g["sensor"], "sensor", ["get_temp_one_shot", "get_temp"])
+    m.wrap_methods(g["rtc"], "rtc", ["DateTime", "Date", "Time"])
+    if "log_values" in g:
+        g["log_values"] = m.wrap(g["log_values"], "log")
+    m.wrap_methods(g["oled"], "display", ["show", "fill", "text", "fill_rect", "blit"])
+    for fld in g.get("clock_fields", ()):
+        m.wrap_methods(fld, "display", ["update"])
+    if g.get("log") is not None:
+        m.wrap_methods(g["log"], "console", ["drain", "flush"])
+    g["time"] = _TimeProxy(m, g["time"])
+    for mnt in m.board.mounts.values():
+        timer = getattr(mnt.dev, "timer", None)
+        if timer is not None:
+            timer._fire = m.wrap(timer._fire, "timer")
+
+
+def _instrument_pico(m, g):
+    ticks_ms = g["ticks_ms"]
+
+    def marked_ticks_ms():
+        m.iteration()
+        return ticks_ms()
+
+    g["ticks_ms"] = marked_ticks_ms
+    m.wrap_methods(g["wlan"], "wifi", ["active", "connect", "isconnected", "ifconfig",
+                                       "disconnect"])
+    g["do_connect"] = m.wrap(g["do_connect"], "wifi")
+    g["handle_ntp"] = m.wrap(g["handle_ntp"], "ntp")
+    m.wrap_methods(g["uart"], "uart", ["write", "read"])
+    g["sleep"] = m.wrap(g["sleep"], "idle")
+
+
+def run(board="xiao", iterations=50, warmup=1, seconds=None, workdir=None, seed=1, out=None,
+        console_bps=None):
+    """ Run the loop of one board for the given iterations; returns the summary. """
+    meters = {}
+
+    def entry(b, g):
+        m = meters[b.name] = Meter(b, iterations, warmup)
+        (_instrument_xiao if b.name == "xiao" else _instrument_pico)(m, g)
+        m.last = m.snapshot()
+        g["main"]()
+
+    if seconds is None:
+        # enough for the intro, the warm-up and the iterations (1 s or 10 s each)
+        seconds = 60 + (iterations + warmup + 2) * (2 if board == "xiao" else 12)
+    workdir = workdir or tempfile.mkdtemp(prefix="mpsim-bench-")
+    sim = Simulation(workdir, (board,), seconds=seconds, seed=seed, quiet=True,
+                     out=out, entry=entry, console_bps=console_bps)
+    wall = sim.run()
+    m = meters.get(board)
+    if m is None or board in sim.errors:
+        raise RuntimeError("%s did not reach its loop: %r" % (board, sim.errors.get(board)))
+    res = m.summary()
+    res["wall_s"] = round(wall, 3)
+    return res
+
+
+# --- output ---
+
+def _devices(stages):
+    names = set()
+    for acc in stages.values():
+        for k in acc:
+            if k.endswith(".transactions"):
+                names.add(k[: -len(".transactions")])
+    return sorted(names)
+
+
+def print_summary(name, res, f=sys.stdout):
+    stages = res["stages"]
+    order = [s for s in STAGES.get(name, ()) if s in stages]
+    order += sorted(s for s in stages if s not in order)
+    f.write("%s: %d iterations, busy %s us (min/median/max)\n" % (
+        name, res["iterations"], "/".join("%d" % res["busy_us"].get(k, 0)
+                                          for k in ("min", "median", "max"))))
+    f.write("  %-8s %10s %10s %8s\n" % ("stage", "sim us", "cpu us", "mem B"))
+    for s in order + ["total"]:
+        acc = res["total"] if s == "total" else stages[s]
+        f.write("  %-8s %10.0f %10.0f %8.0f\n" % (s, acc.get("t_us", 0), acc.get("cpu_us", 0),
+                                                  acc.get("mem", 0)))
+    devs = _devices(stages)
+    if devs:
+        f.write("  per iteration: transactions / bytes\n")
+        f.write("  %-8s" % "" + "".join(" %18s" % d for d in devs) + "\n")
+        for s in order + ["total"]:
+            acc = res["total"] if s == "total" else stages[s]
+            if not any(acc.get(d + ".transactions") for d in devs):
+                continue
+            f.write("  %-8s" % s + "".join(" %18s" % ("%.1f / %.0f" % (
+                acc.get(d + ".transactions", 0), acc.get(d + ".bytes", 0))) for d in devs) + "\n")
+
+
+def compare(old, new, threshold=0.05, cpu_threshold=0.5, f=sys.stdout):
+    """
+    Compare two result files (as loaded from JSON); prints the changes above
+    the thresholds and returns the list of regressions.
+    """
+    regressions = []
+    for name in sorted(set(old["boards"]) & set(new["boards"])):
+        o, n = old["boards"][name], new["boards"][name]
+        f.write("%s:\n" % name)
+        stages = sorted(set(o["stages"]) | set(n["stages"])) + ["total"]
+        for s in stages:
+            a = o["total"] if s == "total" else o["stages"].get(s, {})
+            b = n["total"] if s == "total" else n["stages"].get(s, {})
+            for k in sorted(set(a) | set(b)):
+                va, vb = a.get(k, 0), b.get(k, 0)
+                kind = k.rsplit(".", 1)[-1]
+                th = cpu_threshold if kind == "cpu_us" else threshold
+                d = vb - va
+                if abs(d) <= MIN_DELTA.get(kind, 0) or abs(d) <= th * abs(va):
+                    continue
+                worse = d > 0
+                pct = ("%+.1f%%" % (100.0 * d / va)) if va else "new"
+                f.write("  %-4s %-8s %-32s %12.1f -> %12.1f  %s\n" % (
+                    "REGR" if worse else "ok", s, k, va, vb, pct))
+                if worse:
+                    regressions.append((name, s, k, va, vb))
+    f.write("%d regression(s)\n" % len(regressions))
+    return regressions
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="mpsim.bench", description="Per-stage cost of the board "
+                                "loops in the simulator.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="run the loops and write the results")
+    r.add_argument("boards", nargs="?", default="both", choices=("xiao", "pico", "both"))
+    r.add_argument("-n", "--iterations", type=int, default=50)
+    r.add_argument("--warmup", type=int, default=1, help="loop passes not counted")
+    r.add_argument("--seed", type=int, default=1)
+    r.add_argument("--console-bps", type=float,
+                   help="bytes per second the USB host reads from the console (default: no limit)")
+    r.add_argument("-o", "--out", help="JSON result file")
+    c = sub.add_parser("compare", help="flag regressions between two result files")
+    c.add_argument("old")
+    c.add_argument("new")
+    c.add_argument("-t", "--threshold", type=float, default=0.05,
+                   help="relative change that counts (default 0.05)")
+    c.add_argument("--cpu-threshold", type=float, default=0.5,
+                   help="the same for the host CPU time, which is noisy (default 0.5)")
+    args = p.parse_args(argv)
+
+    if args.cmd == "compare":
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        return 1 if compare(old, new, args.threshold, args.cpu_threshold) else 0
+
+    boards = ("xiao", "pico") if args.boards == "both" else (args.boards,)
+    results = {"version": 1, "iterations": args.iterations, "warmup": args.warmup,
+               "seed": args.seed, "console_bps": args.console_bps, "python": sys.version.split()[0], "boards": {}}
+    for name in boards:
+        res = run(name, args.iterations, args.warmup, seed=args.seed,
+                  console_bps=args.console_bps)
+        results["boards"][name] = res
+        print_summary(name, res)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print("results in", os.path.abspath(args.out))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,165 @@
+# A simulated board: its pins, buses, UARTs, PIO and file system root
+#
+# The fake machine/rp2/network modules look up the board of the calling
+# thread with current(), so two boards can run side by side in one process,
+# each in its own thread.
+#
+# License: MIT
+
+import threading
+
+_local = threading.local()
+
+
+def current():
+    board = getattr(_local, "board", None)
+    if board is None:
+        raise RuntimeError("no simulated board in this thread")
+    return board
+
+
+def pin_id(p):
+    """ Normalise a pin given as int, "GP5", Pin.board.GP5 or a Pin. """
+    p = getattr(p, "id", p)
+    if isinstance(p, str) and p.startswith("GP") and p[2:].isdigit():
+        return int(p[2:])
+    return p
+
+
+class PinState:
+    def __init__(self, pid):
+        self.id = pid
+        self.value = 0
+        self.mode = -1
+        self.listeners = []  # called with the new value
+        self.changes = 0
+
+    def set(self, v):
+        v = 1 if v else 0
+        if v != self.value:
+            self.value = v
+            self.changes += 1
+            for fn in self.listeners:
+                fn(v)
+
+
+class I2CBusModel:
+    """ Devices on one I2C bus, keyed by address. """
+
+    def __init__(self, board, bus_id, freq=100000):
+        self.board = board
+        self.id = bus_id
+        self.freq = freq
+        self.devices = {}
+        self.transactions = 0
+        self.bytes = 0
+        self.per_addr = {}  # address -> [transactions, bytes]
+
+    def attach(self, dev):
+        self.devices[dev.addr] = dev
+        dev.bus = self
+        return dev
+
+    def device(self, addr):
+        dev = self.devices.get(addr)
+        if dev is None:
+            raise OSError(5)  # EIO, no ACK
+        return dev
+
+    def spend(self, nbytes, addr=None):
+        # address byte + data bytes, 9 clocks each, plus start/stop
+        self.transactions += 1
+        self.bytes += nbytes
+        c = self.per_addr.get(addr)
+        if c is None:
+            c = self.per_addr[addr] = [0, 0]
+        c[0] += 1
+        c[1] += nbytes
+        self.board.clock.sleep_us((nbytes + 1) * 9 * 1e6 / self.freq + 10)
+
+
+class SPIBusModel:
+    """ Devices on one SPI bus, each selected by its chip select pin. """
+
+    def __init__(self, board, bus_id):
+        self.board = board
+        self.id = bus_id
+        self.baudrate = 1000000
+        self.devices = []
+        self.transactions = 0
+        self.bytes = 0
+        self.per_device = {}  # device class name -> [transfers, bytes]
+
+    def attach(self, dev, cs):
+        pin = self.board.pin(cs)
+        pin.value = 1
+        pin.listeners.append(dev.select)
+        self.devices.append(dev)
+        dev.bus = self
+        return dev
+
+    def xfer(self, out):
+        """ Clock out the bytes of out and return the bytes read back. """
+        self.transactions += 1
+        self.bytes += len(out)
+        self.board.clock.sleep_us(len(out) * 8 * 1e6 / self.baudrate)
+        for dev in self.devices:
+            if dev.selected:
+                c = self.per_device.get(type(dev).__name__)
+                if c is None:
+                    c = self.per_device[type(dev).__name__] = [0, 0]
+                c[0] += 1
+                c[1] += len(out)
+                return dev.xfer(out)
+        return b"\xff" * len(out)
+
+
+class Board:
+    def __init__(self, name, root, clock):
+        # root: host directory that stands for the flash file system "/"
+        self.name = name
+        self.root = root
+        self.clock = clock
+        self.pins = {}
+        self.i2c = {}
+        self.spi = {}
+        self.uarts = {}
+        self.state_machines = {}
+        self.leds = []  # (time, GRB word) pushed to a PIO state machine
+        self.mounts = {}  # mount point -> vfs.Mount
+        self.cwd = "/"
+        self.wlan = None  # network model, see fakes/network.py
+        self.ntp = None   # callable returning the NTP server time
+        self.rtc_offset = 0.0  # machine.RTC minus the true time, in seconds
+        self.ppm = 0.0  # crystal error: ticks_ms()/ticks_us() and the sleeps run this much fast
+        self.stdout = None
+
+    def bind(self):
+        """ Make this the board of the calling thread. """
+        _local.board = self
+
+    def pin(self, p):
+        pid = pin_id(p)
+        st = self.pins.get(pid)
+        if st is None:
+            st = self.pins[pid] = PinState(pid)
+        return st
+
+    def i2c_bus(self, bus_id):
+        bus = self.i2c.get(bus_id)
+        if bus is None:
+            bus = self.i2c[bus_id] = I2CBusModel(self, bus_id)
+        return bus
+
+    def spi_bus(self, bus_id):
+        bus = self.spi.get(bus_id)
+        if bus is None:
+            bus = self.spi[bus_id] = SPIBusModel(self, bus_id)
+        return bus
+
+    def uart(self, uart_id):
+        from .uart import UARTModel
+        u = self.uarts.get(uart_id)
+        if u is None:
+            u = self.uarts[uart_id] = UARTModel(self, uart_id)
+        return u
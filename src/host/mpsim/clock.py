@@ -0,0 +1,150 @@
+# Virtual time for the simulated boards
+#
+# All boards share one Clock. Time only moves when code sleeps or spends
+# time on a bus transfer (sleep_us()). Each board runs in its own thread;
+# when every thread taking part is asleep, the clock jumps to the earliest
+# wake-up or timer, so a day of device time runs in seconds and every run
+# is repeatable.
+#
+# Timer callbacks (machine.Timer) run in the thread of the board that
+# created them, while that thread sleeps, like an interrupt that arrives
+# during time.sleep().
+#
+# License: MIT
+
+import heapq
+import threading
+
+TICKS_PERIOD = 1 << 30  # as MicroPython's ticks_ms()/ticks_us()
+
+
+class SimStop(BaseException):
+    """ Raised in the board threads when the simulation time is over. """
+
+
+class Clock:
+    def __init__(self, epoch=1746700000, until_s=None):
+        # epoch:   unix time (UTC) at the start of the simulation
+        # until_s: stop the board threads after this many seconds
+        self.epoch = epoch
+        self.now_us = 0
+        self.until_us = None if until_s is None else int(until_s * 1e6)
+        self.stopped = False
+        self._cond = threading.Condition()
+        self._members = set()
+        self._sleeping = {}  # thread ident -> wake time
+        self._timers = []  # heap of [due, seq, owner ident, timer]
+        self._seq = 0
+
+    # --- threads ---
+
+    def join(self):
+        """ The calling thread takes part in the time keeping. """
+        with self._cond:
+            self._members.add(threading.get_ident())
+
+    def leave(self):
+        with self._cond:
+            me = threading.get_ident()
+            self._members.discard(me)
+            self._sleeping.pop(me, None)
+            self._timers = [t for t in self._timers if t[2] != me]
+            heapq.heapify(self._timers)
+            self._advance()
+            self._cond.notify_all()
+
+    def stop(self):
+        with self._cond:
+            self.stopped = True
+            self._cond.notify_all()
+
+    # --- time ---
+
+    def time(self):
+        return self.epoch + self.now_us / 1e6
+
+    def sleep_us(self, us):
+        me = threading.get_ident()
+        with self._cond:
+            if me not in self._members:
+                # setup code outside the board threads
+                self.now_us += max(int(us), 0)
+                return
+            wake = self.now_us + max(int(us), 0)
+            while True:
+                if self._run_timers(me):
+                    continue
+                if self.now_us >= wake:
+                    return
+                if self.stopped:
+                    raise SimStop()
+                self._sleeping[me] = wake
+                self._advance()
+                if self.now_us < wake and not self._due(me) and not self.stopped:
+                    self._cond.wait()
+                self._sleeping.pop(me, None)
+
+    def _due(self, me):
+        return any(t[0] <= self.now_us and t[2] == me for t in self._timers)
+
+    def _advance(self):
+        # jump to the next event when every member sleeps and none is due
+        if not self._members or set(self._sleeping) != self._members:
+            return
+        nxt = min(self._sleeping.values())
+        if self._timers:
+            nxt = min(nxt, self._timers[0][0])
+        if nxt <= self.now_us:
+            return  # a thread is about to wake up
+        if self.until_us is not None and nxt > self.until_us:
+            self.now_us = self.until_us
+            self.stopped = True
+        else:
+            self.now_us = nxt
+        self._cond.notify_all()
+
+    # --- timers ---
+
+    def add_timer(self, timer, delay_us):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._timers, [self.now_us + delay_us, self._seq,
+                                          threading.get_ident(), timer])
+            self._cond.notify_all()
+
+    def remove_timer(self, timer):
+        with self._cond:
+            self._timers = [t for t in self._timers if t[3] is not timer]
+            heapq.heapify(self._timers)
+
+    def _run_timers(self, me):
+        # called with the lock held; runs the callbacks without it
+        for i, t in enumerate(self._timers):
+            if t[0] <= self.now_us and t[2] == me:
+                del self._timers[i]
+                heapq.heapify(self._timers)
+                timer = t[3]
+                self._cond.release()
+                try:
+                    timer._fire()
+                finally:
+                    self._cond.acquire()
+                return True
+        return False
+
+    # --- MicroPython time functions ---
+
+    def ticks_us(self):
+        return self.now_us & (TICKS_PERIOD - 1)
+
+    def ticks_ms(self):
+        return (self.now_us // 1000) & (TICKS_PERIOD - 1)
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & (TICKS_PERIOD - 1)
+
+
+def ticks_diff(a, b):
+    d = (a - b) & (TICKS_PERIOD - 1)
+    return d - TICKS_PERIOD if d >= TICKS_PERIOD // 2 else d
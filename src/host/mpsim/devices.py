@@ -0,0 +1,470 @@
+# Register-level models of the I2C devices of the XIAO RP2350 setup
+#
+#   PCF8563  real-time clock, ticks with the virtual clock (optional ppm drift)
+#   BME280   temperature/pressure/humidity with calibration data; the raw
+#            ADC values are found by inverting the data sheet compensation,
+#            so the driver reads back the values of the Environment
+#   MCP9808  temperature sensor with shutdown and one-shot conversions
+#   SSD1306  OLED controller; parses the command stream and keeps the
+#            display RAM, which frame() renders as text
+#
+# A device read above its max_freq returns corrupted data (the low bit of
+# each byte flipped), so lib.i2cbus.negotiate_speeds() has something to find.
+#
+# License: MIT
+
+import calendar
+import datetime
+import math
+import random
+import struct
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _fields(secs):
+    """ (year, month, day, hour, minute, second, weekday Mon=0) of unix time secs. """
+    d = _EPOCH + datetime.timedelta(seconds=int(secs))
+    return d.year, d.month, d.day, d.hour, d.minute, d.second, d.weekday()
+
+
+def _bcd(v):
+    return (v // 10) << 4 | (v % 10)
+
+
+def _unbcd(v):
+    return (v >> 4) * 10 + (v & 0x0F)
+
+
+class Environment:
+    """
+    Ambient conditions as a function of the simulated time: a daily cycle
+    plus a little noise. Override the methods for other scenarios.
+    """
+
+    def __init__(self, clock, seed=1):
+        self.clock = clock
+        self.rng = random.Random(seed)
+
+    def _day(self):
+        return math.sin(2 * math.pi * (self.clock.time() % 86400) / 86400)
+
+    def temperature(self):
+        return 22.4 + 1.5 * self._day() + self.rng.gauss(0, 0.02)
+
+    def pressure(self):
+        return 100068.0 + 120 * self._day() + self.rng.gauss(0, 2)
+
+    def humidity(self):
+        return 43.85 - 5 * self._day() + self.rng.gauss(0, 0.05)
+
+
+class I2CDevice:
+    addr = 0
+    max_freq = 400000
+
+    def __init__(self):
+        self.bus = None
+        self.reads = 0
+        self.writes = 0
+
+    def i2c_write(self, data):
+        self.writes += 1
+        self.write(bytes(data))
+
+    def i2c_read(self, n):
+        self.reads += 1
+        data = self.read(n)
+        if self.bus is not None and self.bus.freq > self.max_freq:
+            data = bytes(b ^ 1 for b in data)
+        return data
+
+    def write(self, data):
+        pass
+
+    def read(self, n):
+        return b"\xff" * n
+
+
+class RegDevice(I2CDevice):
+    """ Device with an 8-bit register pointer that auto-increments. """
+
+    def __init__(self):
+        super().__init__()
+        self.regs = bytearray(256)
+        self.ptr = 0
+
+    def write(self, data):
+        if not data:
+            return
+        self.ptr = data[0]
+        for b in data[1:]:
+            self.write_reg(self.ptr, b)
+            self.ptr = (self.ptr + 1) & 0xFF
+
+    def read(self, n):
+        out = bytearray(n)
+        for i in range(n):
+            out[i] = self.read_reg(self.ptr)
+            self.ptr = (self.ptr + 1) & 0xFF
+        return bytes(out)
+
+    def write_reg(self, reg, v):
+        self.regs[reg] = v
+
+    def read_reg(self, reg):
+        return self.regs[reg]
+
+
+class PCF8563(RegDevice):
+    addr = 0x51
+    max_freq = 400000
+
+    def __init__(self, clock, offset_s=0.0, ppm=0.0):
+        # offset_s: clock time minus true time at the start
+        # ppm:      frequency error of the crystal
+        super().__init__()
+        self.clock = clock
+        self.ppm = ppm
+        self.base_s = clock.time() + offset_s
+        self.base_us = clock.now_us
+        self.wday_delta = 0
+        self.prescaler_reset = True  # writing the seconds restarts the second
+
+    def now(self):
+        """ The time the RTC counts, as unix seconds (float). """
+        return self.base_s + (self.clock.now_us - self.base_us) * (1 + self.ppm * 1e-6) / 1e6
+
+    def set_time(self, secs):
+        self.base_s = secs
+        self.base_us = self.clock.now_us
+
+    def read_reg(self, reg):
+        if 2 <= reg <= 8:
+            y, mo, d, h, mi, s, wd = _fields(self.now())
+            return (_bcd(s), _bcd(mi), _bcd(h), _bcd(d), (wd + self.wday_delta) % 7,
+                    _bcd(mo), _bcd(y % 100))[reg - 2]
+        return self.regs[reg]
+
+    def write(self, data):
+        # the time registers of one write are taken together, so a date is
+        # not invalid in between (day 31 written before the month)
+        if len(data) < 3 or not 2 <= data[0] <= 8:
+            super().write(data)
+            return
+        self.ptr = data[0]
+        regs = {}
+        for b in data[1:]:
+            if 2 <= self.ptr <= 8:
+                regs[self.ptr] = b
+            else:
+                self.regs[self.ptr] = b
+            self.ptr = (self.ptr + 1) & 0xFF
+        self._set(regs)
+
+    def write_reg(self, reg, v):
+        if not 2 <= reg <= 8:
+            self.regs[reg] = v
+            return
+        self._set({reg: v})
+
+    def _set(self, regs):
+        cur = self.now()
+        y, mo, d, h, mi, s, wd = _fields(cur)
+        frac = cur - int(cur)
+        wd_now = (wd + self.wday_delta) % 7
+        if 2 in regs:
+            s = _unbcd(regs[2] & 0x7F)
+            if self.prescaler_reset:
+                frac = 0.0
+        if 3 in regs:
+            mi = _unbcd(regs[3] & 0x7F)
+        if 4 in regs:
+            h = _unbcd(regs[4] & 0x3F)
+        if 5 in regs:
+            d = _unbcd(regs[5] & 0x3F)
+        if 6 in regs:
+            # the weekday is a free running counter set by software
+            wd_now = regs[6] & 7
+        if 7 in regs:
+            mo = _unbcd(regs[7] & 0x1F)
+        if 8 in regs:
+            y = 2000 + _unbcd(regs[8])
+        try:
+            secs = calendar.timegm((y, mo, d, h, mi, s, 0, 0, 0))
+        except (ValueError, OverflowError):
+            return  # e.g. day 31 while the month is set to February
+        self.set_time(secs + frac)
+        self.wday_delta = (wd_now - _fields(secs)[6]) % 7
+
+
+class BME280(RegDevice):
+    addr = 0x76
+    max_freq = 3400000
+
+    CALIB = dict(T1=27504, T2=26435, T3=-1000,
+                 P1=36477, P2=-10685, P3=3024, P4=2855, P5=140, P6=-7,
+                 P7=15500, P8=-14600, P9=6000,
+                 H1=75, H2=370, H3=0, H4=313, H5=50, H6=30)
+
+    def __init__(self, env, addr=0x76):
+        super().__init__()
+        self.addr = addr
+        self.env = env
+        self.clock = env.clock
+        c = self.CALIB
+        self.regs[0x88:0xA2] = struct.pack("<HhhHhhhhhhhhBB", c["T1"], c["T2"], c["T3"],
+                                           c["P1"], c["P2"], c["P3"], c["P4"], c["P5"],
+                                           c["P6"], c["P7"], c["P8"], c["P9"], 0, c["H1"])
+        h4, h5 = c["H4"], c["H5"]
+        self.regs[0xE1:0xE8] = struct.pack("<hBBBBb", c["H2"], c["H3"], (h4 >> 4) & 0xFF,
+                                           (h4 & 0x0F) | ((h5 & 0x0F) << 4), (h5 >> 4) & 0xFF,
+                                           c["H6"])
+        self.regs[0xD0] = 0x60
+        self.busy_until = 0
+        self.pending = None
+        self.measurements = 0
+
+    def write_reg(self, reg, v):
+        self.regs[reg] = v
+        if reg == 0xE0 and v == 0xB6:
+            self.regs[0xF2:0xF6] = bytes(4)
+        elif reg == 0xF4 and v & 3 in (1, 2):
+            # forced mode: one measurement, then back to sleep
+            osr = [0, 1, 2, 4, 8, 16, 16, 16]
+            t_ms = (1.25 + 2.3 * osr[v >> 5] + (2.3 * osr[(v >> 2) & 7] + 0.575)
+                    + (2.3 * osr[self.regs[0xF2] & 7] + 0.575))
+            self.busy_until = self.clock.now_us + int(t_ms * 1000)
+            self.pending = self._raw(self.env.temperature(), self.env.pressure(),
+                                     self.env.humidity())
+            self.regs[0xF4] = v & ~3
+            self.measurements += 1
+
+    def read_reg(self, reg):
+        self._latch()
+        if reg == 0xF3:
+            return 0x08 if self.clock.now_us < self.busy_until else 0
+        return self.regs[reg]
+
+    def _latch(self):
+        if self.pending is not None and self.clock.now_us >= self.busy_until:
+            t, p, h = self.pending
+            self.pending = None
+            self.regs[0xF7:0xFF] = bytes(((p >> 12) & 0xFF, (p >> 4) & 0xFF, (p << 4) & 0xF0,
+                                          (t >> 12) & 0xFF, (t >> 4) & 0xFF, (t << 4) & 0xF0,
+                                          (h >> 8) & 0xFF, h & 0xFF))
+
+    # data sheet compensation (floating point), as in lib/bme280_f.py
+    def _comp_t(self, adc):
+        c = self.CALIB
+        var1 = (adc / 16384.0 - c["T1"] / 1024.0) * c["T2"]
+        var2 = adc / 131072.0 - c["T1"] / 8192.0
+        var2 = var2 * var2 * c["T3"]
+        return (var1 + var2) / 5120.0, int(var1 + var2)
+
+    def _comp_p(self, adc, t_fine):
+        c = self.CALIB
+        var1 = t_fine / 2.0 - 64000.0
+        var2 = var1 * var1 * c["P6"] / 32768.0 + var1 * c["P5"] * 2.0
+        var2 = var2 / 4.0 + c["P4"] * 65536.0
+        var1 = (c["P3"] * var1 * var1 / 524288.0 + c["P2"] * var1) / 524288.0
+        var1 = (1.0 + var1 / 32768.0) * c["P1"]
+        p = ((1048576.0 - adc) - var2 / 4096.0) * 6250.0 / var1
+        return p + (c["P9"] * p * p / 2147483648.0 + p * c["P8"] / 32768.0 + c["P7"]) / 16.0
+
+    def _comp_h(self, adc, t_fine):
+        c = self.CALIB
+        dig_h4 = c["H4"]
+        h = t_fine - 76800.0
+        h = ((adc - (dig_h4 * 64.0 + c["H5"] / 16384.0 * h)) *
+             (c["H2"] / 65536.0 * (1.0 + c["H6"] / 67108864.0 * h * (1.0 + c["H3"] / 67108864.0 * h))))
+        return h * (1.0 - c["H1"] * h / 524288.0)
+
+    @staticmethod
+    def _search(f, target, lo, hi, increasing=True):
+        # smallest adc value whose compensated value reaches target
+        while lo < hi:
+            mid = (lo + hi) // 2
+            v = f(mid)
+            if (v < target) if increasing else (v > target):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _raw(self, temp, press, hum):
+        t = self._search(lambda a: self._comp_t(a)[0], temp, 0, (1 << 20) - 1)
+        t_fine = self._comp_t(t)[1]
+        p = self._search(lambda a: self._comp_p(a, t_fine), press, 0, (1 << 20) - 1, False)
+        h = self._search(lambda a: self._comp_h(a, t_fine), hum, 0, 0xFFFF)
+        return t, p, h
+
+
+class MCP9808(I2CDevice):
+    addr = 0x18
+    max_freq = 400000
+    CONV_US = (30000, 65000, 130000, 250000)
+
+    def __init__(self, env, addr=0x18):
+        super().__init__()
+        self.addr = addr
+        self.env = env
+        self.clock = env.clock
+        self.ptr = 0
+        self.regs = {1: 0, 2: 0, 3: 0, 4: 0, 6: 0x0054, 7: 0x0400}
+        self.resolution = 3
+        self.temp = self.env.temperature()
+        self.conv_start = self.clock.now_us
+        self.conversions = 0
+
+    def _shutdown(self):
+        return self.regs[1] & 0x0100
+
+    def _update(self):
+        # a conversion completes every CONV_US while not shut down
+        if self._shutdown():
+            return
+        if self.clock.now_us - self.conv_start >= self.CONV_US[self.resolution]:
+            self.temp = self.env.temperature()
+            self.conv_start = self.clock.now_us
+            self.conversions += 1
+
+    def write(self, data):
+        if not data:
+            return
+        self.ptr = data[0] & 0x0F
+        if len(data) == 1:
+            return
+        if self.ptr == 8:
+            self.resolution = data[1] & 3
+        elif self.ptr in (1, 2, 3, 4) and len(data) >= 3:
+            if self.ptr == 1:
+                self._update()
+                was_shutdown = self._shutdown()
+                self.regs[1] = data[1] << 8 | data[2]
+                if was_shutdown and not self._shutdown():
+                    self.conv_start = self.clock.now_us  # wake: start a conversion
+            else:
+                self.regs[self.ptr] = data[1] << 8 | data[2]
+
+    def read(self, n):
+        self._update()
+        if self.ptr == 8:
+            v = bytes((self.resolution,))
+        elif self.ptr == 5:
+            step = 0.5 / (1 << self.resolution)
+            raw = int(round(self.temp / step) * step * 16) & 0x1FFF
+            v = bytes((raw >> 8, raw & 0xFF))
+        else:
+            r = self.regs.get(self.ptr, 0)
+            v = bytes((r >> 8, r & 0xFF))
+        return (v + b"\x00" * n)[:n]
+
+
+class SSD1306(I2CDevice):
+    addr = 0x3C
+    max_freq = 1000000
+
+    # number of argument bytes of the commands that have any
+    ARGS = {0x20: 1, 0x21: 2, 0x22: 2, 0x81: 1, 0xA8: 1, 0xD3: 1, 0xDA: 1, 0xD5: 1,
+            0xD9: 1, 0xDB: 1, 0x8D: 1, 0xA3: 2, 0x26: 6, 0x27: 6, 0x29: 5, 0x2A: 5}
+
+    def __init__(self, width=128, height=32, addr=0x3C):
+        super().__init__()
+        self.addr = addr
+        self.width = width
+        self.height = height
+        self.ram = bytearray(128 * 8)
+        self.on = False
+        self.inverted = False
+        self.contrast = 0x7F
+        self.mode = 2  # page addressing after reset
+        self.col0, self.col1, self.page0, self.page1 = 0, 127, 0, 7
+        self.col, self.page = 0, 0
+        self.cmd = None
+        self.args = []
+        self.data_bytes = 0
+        self.commands = 0
+
+    def write(self, data):
+        i = 0
+        while i < len(data):
+            ctrl = data[i]
+            i += 1
+            co, dc = ctrl & 0x80, ctrl & 0x40
+            if co:
+                # one byte follows, then another control byte
+                if i < len(data):
+                    self._data(data[i]) if dc else self._command(data[i])
+                i += 1
+                continue
+            for b in data[i:]:
+                self._data(b) if dc else self._command(b)
+            return
+
+    def read(self, n):
+        # status byte: bit 6 set while the display is off
+        return bytes((0x40 if not self.on else 0,)) * n
+
+    def _command(self, b):
+        self.commands += 1
+        if self.cmd is not None:
+            self.args.append(b)
+            if len(self.args) < self.ARGS[self.cmd]:
+                return
+            cmd, args = self.cmd, self.args
+            self.cmd, self.args = None, []
+            if cmd == 0x20:
+                self.mode = args[0] & 3
+            elif cmd == 0x21:
+                self.col0, self.col1 = args[0] & 0x7F, args[1] & 0x7F
+                self.col = self.col0
+            elif cmd == 0x22:
+                self.page0, self.page1 = args[0] & 7, args[1] & 7
+                self.page = self.page0
+            elif cmd == 0x81:
+                self.contrast = args[0]
+            return
+        if b in self.ARGS:
+            self.cmd = b
+            self.args = []
+        elif b in (0xAE, 0xAF):
+            self.on = b == 0xAF
+        elif b in (0xA6, 0xA7):
+            self.inverted = b == 0xA7
+        elif 0xB0 <= b <= 0xB7:
+            self.page = b & 7
+        elif b <= 0x0F:
+            self.col = (self.col & 0xF0) | b
+        elif b <= 0x1F:
+            self.col = (self.col & 0x0F) | ((b & 0x0F) << 4)
+
+    def _data(self, b):
+        self.data_bytes += 1
+        self.ram[self.page * 128 + self.col] = b
+        if self.mode == 0:
+            # horizontal addressing inside the column/page window
+            if self.col >= self.col1:
+                self.col = self.col0
+                self.page = self.page0 if self.page >= self.page1 else self.page + 1
+            else:
+                self.col += 1
+        else:
+            self.col = min(self.col + 1, 127)
+
+    def pixel(self, x, y):
+        return (self.ram[(y // 8) * 128 + x] >> (y & 7)) & 1
+
+    def frame(self, on="#", off="."):
+        """ The display contents as lines of text, one character per pixel. """
+        lines = []
+        for y in range(self.height):
+            lines.append("".join(on if self.pixel(x, y) ^ self.inverted else off
+                                 for x in range(self.width)))
+        return lines
+
+    def save_pbm(self, path):
+        with open(path, "w") as f:
+            f.write("P1\n%d %d\n" % (self.width, self.height))
+            for line in self.frame("1 ", "0 "):
+                f.write(line + "\n")
@@ -0,0 +1,173 @@
+# framebuf for CPython: the drawing methods of MicroPython's FrameBuffer
+# on the same buffer layouts (MONO_VLSB, MONO_HLSB, MONO_HMSB, GS8, RGB565)
+#
+# text() draws with the 5x7 font of mpsim.font5x7 instead of the 8x8 font
+# built into MicroPython.
+#
+# License: MIT
+
+from mpsim.font5x7 import glyph
+
+MONO_VLSB = 0
+MVLSB = MONO_VLSB
+RGB565 = 1
+GS4_HMSB = 2
+MONO_HLSB = 3
+MONO_HMSB = 4
+GS2_HMSB = 5
+GS8 = 6
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format, stride=None):
+        self.buf = buffer
+        self.width = width
+        self.height = height
+        self.format = format
+        self.stride = width if stride is None else stride
+        if format not in (MONO_VLSB, MONO_HLSB, MONO_HMSB, GS8, RGB565):
+            raise ValueError("invalid format")
+
+    # --- pixels ---
+
+    def _get(self, x, y):
+        f = self.format
+        b = self.buf
+        if f == MONO_VLSB:
+            return (b[(y >> 3) * self.stride + x] >> (y & 7)) & 1
+        if f == MONO_HLSB:
+            return (b[(y * self.stride + x) >> 3] >> (7 - (x & 7))) & 1
+        if f == MONO_HMSB:
+            return (b[(y * self.stride + x) >> 3] >> (x & 7)) & 1
+        if f == GS8:
+            return b[y * self.stride + x]
+        i = (y * self.stride + x) * 2
+        return b[i] | b[i + 1] << 8
+
+    def _set(self, x, y, c):
+        f = self.format
+        b = self.buf
+        if f == MONO_VLSB:
+            i = (y >> 3) * self.stride + x
+            m = 1 << (y & 7)
+        elif f == MONO_HLSB:
+            i = (y * self.stride + x) >> 3
+            m = 0x80 >> (x & 7)
+        elif f == MONO_HMSB:
+            i = (y * self.stride + x) >> 3
+            m = 1 << (x & 7)
+        elif f == GS8:
+            b[y * self.stride + x] = c & 0xFF
+            return
+        else:
+            i = (y * self.stride + x) * 2
+            b[i] = c & 0xFF
+            b[i + 1] = (c >> 8) & 0xFF
+            return
+        if c & 1:
+            b[i] |= m
+        else:
+            b[i] &= ~m & 0xFF
+
+    def pixel(self, x, y, c=None):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        if c is None:
+            return self._get(x, y)
+        self._set(x, y, c)
+
+    # --- shapes ---
+
+    def fill(self, c):
+        if self.format in (MONO_VLSB, MONO_HLSB, MONO_HMSB):
+            v = 0xFF if c & 1 else 0
+            for i in range(len(self.buf)):
+                self.buf[i] = v
+        else:
+            self.fill_rect(0, 0, self.width, self.height, c)
+
+    def fill_rect(self, x, y, w, h, c):
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, self.width), min(y + h, self.height)
+        for yy in range(y0, y1):
+            for xx in range(x0, x1):
+                self._set(xx, yy, c)
+
+    def hline(self, x, y, w, c):
+        self.fill_rect(x, y, w, 1, c)
+
+    def vline(self, x, y, h, c):
+        self.fill_rect(x, y, 1, h, c)
+
+    def rect(self, x, y, w, h, c, f=False):
+        if f:
+            self.fill_rect(x, y, w, h, c)
+            return
+        self.fill_rect(x, y, w, 1, c)
+        self.fill_rect(x, y + h - 1, w, 1, c)
+        self.fill_rect(x, y, 1, h, c)
+        self.fill_rect(x + w - 1, y, 1, h, c)
+
+    def line(self, x0, y0, x1, y1, c):
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+        err = dx + dy
+        while True:
+            self.pixel(x0, y0, c)
+            if x0 == x1 and y0 == y1:
+                return
+            e2 = 2 * err
+            if e2 >= dy:
+                err += dy
+                x0 += sx
+            if e2 <= dx:
+                err += dx
+                y0 += sy
+
+    def ellipse(self, x, y, xr, yr, c, f=False, m=0xF):
+        for yy in range(-yr, yr + 1):
+            for xx in range(-xr, xr + 1):
+                d = (xx * xx) / max(xr * xr, 1) + (yy * yy) / max(yr * yr, 1)
+                if d <= 1 and (f or d > 1 - 2.0 / max(xr, yr, 1)):
+                    self.pixel(x + xx, y + yy, c)
+
+    # --- text and blit ---
+
+    def text(self, s, x, y, c=1):
+        for ch in s:
+            cols = glyph(ch)
+            for i, col in enumerate(cols):
+                for j in range(8):
+                    if (col >> j) & 1:
+                        self.pixel(x + 1 + i, y + j, c)
+            x += 8
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        if isinstance(fbuf, tuple):
+            fbuf = FrameBuffer(*fbuf)
+        for yy in range(fbuf.height):
+            ty = y + yy
+            if not 0 <= ty < self.height:
+                continue
+            for xx in range(fbuf.width):
+                tx = x + xx
+                if not 0 <= tx < self.width:
+                    continue
+                c = fbuf._get(xx, yy)
+                if c == key:
+                    continue
+                if palette is not None:
+                    c = palette._get(c, 0)
+                self._set(tx, ty, c)
+
+    def scroll(self, dx, dy):
+        w, h = self.width, self.height
+        src = [[self._get(x, y) for x in range(w)] for y in range(h)]
+        for y in range(h):
+            for x in range(w):
+                sx, sy = x - dx, y - dy
+                if 0 <= sx < w and 0 <= sy < h:
+                    self._set(x, y, src[sy][sx])
+
+
+FrameBuffer1 = FrameBuffer
@@ -0,0 +1,374 @@
+# machine module for CPython, backed by the board of the calling thread
+# (see mpsim.board): Pin, I2C/SoftI2C, SPI, UART, Timer, RTC, WDT, ADC
+#
+# License: MIT
+
+from mpsim import board as _board
+from mpsim.clock import SimStop as _SimStop
+
+
+def _cur():
+    return _board.current()
+
+
+# --- Pin ---
+
+class _PinNames:
+    """ Pin.board / Pin.cpu: any attribute is a pin name. """
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return name
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    ALT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+    board = _PinNames()
+    cpu = _PinNames()
+
+    def __init__(self, id, mode=-1, pull=-1, value=None, **kw):
+        self.id = _board.pin_id(id)
+        self._st = _cur().pin(self.id)
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None, **kw):
+        if mode != -1 and mode is not None:
+            self._st.mode = mode
+        if pull == Pin.PULL_UP and self._st.mode == Pin.IN:
+            self._st.value = 1
+        if value is not None:
+            self._st.set(value)
+
+    def value(self, v=None):
+        if v is None:
+            return self._st.value
+        self._st.set(v)
+
+    __call__ = value
+
+    def on(self):
+        self._st.set(1)
+
+    def off(self):
+        self._st.set(0)
+
+    high = on
+    low = off
+
+    def toggle(self):
+        self._st.set(not self._st.value)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, **kw):
+        if handler is not None:
+            def fire(v, pin=self):
+                if (v and trigger & Pin.IRQ_RISING) or (not v and trigger & Pin.IRQ_FALLING):
+                    handler(pin)
+            self._st.listeners.append(fire)
+
+    def __repr__(self):
+        return "Pin(%s)" % (self.id,)
+
+
+class Signal:
+    def __init__(self, pin, invert=False):
+        self.pin = pin
+        self.invert = invert
+
+    def value(self, v=None):
+        if v is None:
+            return self.pin.value() ^ self.invert
+        self.pin.value(bool(v) ^ self.invert)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+
+# --- I2C ---
+
+class I2C:
+    def __init__(self, id=0, scl=None, sda=None, freq=100000, timeout=50000):
+        self.id = id
+        self._bus = _cur().i2c_bus(id)
+        self._bus.freq = freq
+
+    def init(self, scl=None, sda=None, freq=100000, timeout=50000):
+        self._bus.freq = freq
+
+    def deinit(self):
+        pass
+
+    def __repr__(self):
+        return "I2C(%s, freq=%d)" % (self.id, self._bus.freq)
+
+    def scan(self):
+        self._bus.spend(0, None)
+        return sorted(self._bus.devices)
+
+    def writeto(self, addr, buf, stop=True):
+        dev = self._bus.device(addr)
+        self._bus.spend(len(buf), addr)
+        dev.i2c_write(bytes(buf))
+        return len(buf)
+
+    def writevto(self, addr, vector, stop=True):
+        data = b"".join(bytes(b) for b in vector)
+        return self.writeto(addr, data, stop)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        dev = self._bus.device(addr)
+        self._bus.spend(nbytes, addr)
+        return dev.i2c_read(nbytes)
+
+    def readfrom_into(self, addr, buf, stop=True):
+        buf[:] = self.readfrom(addr, len(buf), stop)
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        self.writeto(addr, _memaddr(memaddr, addrsize) + bytes(buf))
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        dev = self._bus.device(addr)
+        self._bus.spend(addrsize // 8 + nbytes + 1, addr)
+        dev.i2c_write(_memaddr(memaddr, addrsize))
+        return dev.i2c_read(nbytes)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        buf[:] = self.readfrom_mem(addr, memaddr, len(buf), addrsize)
+
+
+def _memaddr(memaddr, addrsize):
+    n = addrsize // 8
+    return bytes((memaddr >> (8 * (n - 1 - i))) & 0xFF for i in range(n))
+
+
+SoftI2C = I2C
+
+
+# --- SPI ---
+
+class SPI:
+    MSB = 0
+    LSB = 1
+    CONTROLLER = 0
+
+    def __init__(self, id=0, baudrate=1000000, polarity=0, phase=0, bits=8, firstbit=0,
+                 sck=None, mosi=None, miso=None):
+        self.id = id
+        self._bus = _cur().spi_bus(id)
+        self._bus.baudrate = baudrate
+
+    def init(self, baudrate=1000000, polarity=0, phase=0, bits=8, firstbit=0, **kw):
+        self._bus.baudrate = baudrate
+
+    def deinit(self):
+        pass
+
+    def __repr__(self):
+        return "SPI(%s, baudrate=%d)" % (self.id, self._bus.baudrate)
+
+    def write(self, buf):
+        self._bus.xfer(bytes(buf))
+
+    def read(self, nbytes, write=0x00):
+        return self._bus.xfer(bytes((write,)) * nbytes)
+
+    def readinto(self, buf, write=0x00):
+        buf[:] = self._bus.xfer(bytes((write,)) * len(buf))
+
+    def write_readinto(self, write_buf, read_buf):
+        read_buf[:] = self._bus.xfer(bytes(write_buf))
+
+
+SoftSPI = SPI
+
+
+# --- UART ---
+
+class UART:
+    INV_TX = 1
+    INV_RX = 2
+    RTS = 1
+    CTS = 2
+
+    def __init__(self, id, baudrate=115200, bits=8, parity=None, stop=1, tx=None, rx=None,
+                 timeout=0, **kw):
+        self.id = id
+        self._u = _cur().uart(id)
+        self._u.baudrate = baudrate
+
+    def init(self, baudrate=115200, bits=8, parity=None, stop=1, **kw):
+        self._u.baudrate = baudrate
+
+    def deinit(self):
+        pass
+
+    def any(self):
+        return self._u.available()
+
+    def read(self, nbytes=-1):
+        data = self._u.read(nbytes)
+        return data if data else None
+
+    def readinto(self, buf, nbytes=None):
+        n = len(buf) if nbytes is None else nbytes
+        data = self._u.read(n)
+        if not data:
+            return None
+        buf[: len(data)] = data
+        return len(data)
+
+    def readline(self):
+        u = self._u
+        n = u.available()
+        for i, (t, b) in enumerate(list(u.rx)[:n]):
+            if b == 0x0A:
+                return u.read(i + 1)
+        return u.read(n) or None
+
+    def write(self, buf):
+        return self._u.write(bytes(buf))
+
+    def flush(self):
+        c = self._u.board.clock
+        c.sleep_us(max(0, self._u.line_free_us - c.now_us))
+
+    def txdone(self):
+        return self._u.board.clock.now_us >= self._u.line_free_us
+
+    def sendbreak(self):
+        pass
+
+
+# --- Timer ---
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, mode=PERIODIC, period=-1, freq=-1, callback=None, **kw):
+        self._board = _cur()
+        self._callback = None
+        if callback is not None:
+            self.init(mode=mode, period=period, freq=freq, callback=callback)
+
+    def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None, **kw):
+        self.deinit()
+        if freq > 0:
+            period = 1000 / freq
+        self._mode = mode
+        self._period_us = int(period * 1000)
+        self._callback = callback
+        self._board.clock.add_timer(self, self._period_us)
+
+    def deinit(self):
+        if self._callback is not None:
+            self._board.clock.remove_timer(self)
+            self._callback = None
+
+    def _fire(self):
+        cb = self._callback
+        if cb is None:
+            return
+        if self._mode == Timer.PERIODIC:
+            self._board.clock.add_timer(self, self._period_us)
+        else:
+            self._callback = None
+        cb(self)
+
+
+# --- RTC, WDT, ADC ---
+
+class RTC:
+    def __init__(self, id=0):
+        self._board = _cur()
+
+    def datetime(self, dt=None):
+        from mpsim import mptime
+        if dt is None:
+            t = mptime.gmtime(mptime.time())
+            return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
+        secs = mptime.mktime((dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], 0, 0))
+        self._board.rtc_offset = secs - self._board.clock.time()
+
+
+class WDT:
+    def __init__(self, id=0, timeout=5000):
+        self.timeout = timeout
+
+    def feed(self):
+        pass
+
+
+class ADC:
+    CORE_TEMP = 4
+
+    def __init__(self, pin, **kw):
+        self.pin = pin
+
+    def read_u16(self):
+        if self.pin == ADC.CORE_TEMP:
+            return int((0.706 - (27 - 25) * 0.001721) / 3.3 * 65535)  # 25 C
+        return 32768
+
+
+# --- misc ---
+
+_freq = 150000000
+PWRON_RESET = 1
+WDT_RESET = 3
+
+
+def freq(hz=None):
+    global _freq
+    if hz is None:
+        return _freq
+    _freq = hz
+
+
+def unique_id():
+    return _cur().name.encode()[:8].ljust(8, b"\0")
+
+
+def reset():
+    raise _SimStop("machine.reset()")
+
+
+soft_reset = reset
+
+
+def reset_cause():
+    return PWRON_RESET
+
+
+def idle():
+    _cur().clock.sleep_us(1)
+
+
+def lightsleep(ms=None):
+    if ms is not None:
+        _cur().clock.sleep_us(ms * 1000)
+
+
+deepsleep = lightsleep
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
+
+
+def bootloader():
+    raise _SimStop("machine.bootloader()")
@@ -0,0 +1,55 @@
+# micropython module for CPython
+#
+# License: MIT
+
+
+def const(x):
+    return x
+
+
+def native(f):
+    return f
+
+
+viper = native
+asm_thumb = native
+
+
+def schedule(func, arg):
+    # the simulator runs timer callbacks while the board thread sleeps,
+    # which is already a safe point to run the scheduled function
+    func(arg)
+
+
+def alloc_emergency_exception_buf(n):
+    pass
+
+
+def opt_level(level=None):
+    return 0 if level is None else None
+
+
+def heap_lock():
+    return 0
+
+
+def heap_unlock():
+    return 0
+
+
+def kbd_intr(c):
+    pass
+
+
+def mem_info(verbose=False):
+    import gc
+    print("mem: total={:d}, current={:d}, peak=0".format(gc.mem_alloc() + gc.mem_free(),
+                                                         gc.mem_alloc()))
+
+
+def qstr_info(verbose=False):
+    pass
+
+
+def stack_use():
+    return 0
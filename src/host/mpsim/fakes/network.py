@@ -0,0 +1,75 @@
+# network module for CPython: a WLAN that connects after a short virtual
+# delay when the SSID matches board.wlan_ssid (any SSID when that is None)
+#
+# License: MIT
+
+from mpsim import board as _board
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+CONNECT_DELAY_US = 2500000
+
+
+class WLAN:
+    def __init__(self, interface_id=STA_IF, **kw):
+        self._board = _board.current()
+        self._board.wlan = self
+        self.interface = interface_id
+        self._active = False
+        self._ssid = None
+        self._up_at = None
+        self.connects = 0
+
+    def active(self, v=None):
+        if v is None:
+            return self._active
+        self._active = bool(v)
+        if not v:
+            self._up_at = None
+
+    def connect(self, ssid=None, key=None, **kw):
+        if not self._active:
+            raise OSError("WLAN not active")
+        self._ssid = ssid
+        want = getattr(self._board, "wlan_ssid", None)
+        if want is None or want == ssid:
+            self._up_at = self._board.clock.now_us + CONNECT_DELAY_US
+            self.connects += 1
+
+    def disconnect(self):
+        self._up_at = None
+
+    def isconnected(self):
+        return self._up_at is not None and self._board.clock.now_us >= self._up_at
+
+    def status(self, param=None):
+        if param == "rssi":
+            return -60
+        if self.isconnected():
+            return STAT_GOT_IP
+        return STAT_CONNECTING if self._up_at is not None else STAT_IDLE
+
+    def ifconfig(self, cfg=None):
+        return ("192.168.1.77", "255.255.255.0", "192.168.1.1", "192.168.1.1")
+
+    def config(self, *args, **kw):
+        if args == ("mac",):
+            return b"\x28\xcd\xc1\x00\x00\x01"
+        if args == ("ssid",):
+            return self._ssid
+        return None
+
+    def scan(self):
+        return []
+
+
+def hostname(name=None):
+    return "mpsim" if name is None else None
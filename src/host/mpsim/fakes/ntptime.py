@@ -0,0 +1,27 @@
+# ntptime for CPython: time() is the true (simulated) unix time as an NTP
+# server would send it, with the round trip of a query spent on the clock
+#
+# License: MIT
+
+from mpsim import board as _board
+
+host = "pool.ntp.org"
+timeout = 1
+ROUND_TRIP_US = 30000
+
+
+def time():
+    b = _board.current()
+    w = b.wlan
+    if w is None or not w.isconnected():
+        raise OSError(-2)  # no route to the server
+    b.clock.sleep_us(ROUND_TRIP_US)
+    if b.ntp is not None:
+        return int(b.ntp())
+    return int(b.clock.time())
+
+
+def settime():
+    b = _board.current()
+    t = time()
+    b.rtc_offset = t - b.clock.time()
@@ -0,0 +1,130 @@
+# rp2 module for CPython: PIO programs are assembled into a list of
+# instructions (not executed); a StateMachine records the words put into
+# its FIFO in board.leds, which is what the WS2812 driver of main.py sends
+#
+# License: MIT
+
+import types as _types
+
+from mpsim import board as _board
+
+
+class PIO:
+    IN_LOW = 0
+    IN_HIGH = 1
+    OUT_LOW = 2
+    OUT_HIGH = 3
+    SHIFT_LEFT = 0
+    SHIFT_RIGHT = 1
+    IRQ_SM0 = 0x100
+    JOIN_NONE = 0
+    JOIN_TX = 1
+    JOIN_RX = 2
+
+    def __init__(self, id):
+        self.id = id
+
+    def state_machine(self, id, *args, **kw):
+        return StateMachine(self.id * 4 + id, *args, **kw)
+
+    def remove_program(self, program=None):
+        pass
+
+
+class _Instr:
+    def __init__(self, prog, name, args):
+        self.op = [name, args, None, 0]  # name, args, side set, delay
+        prog.append(self.op)
+
+    def side(self, v):
+        self.op[2] = v
+        return self
+
+    def __getitem__(self, delay):
+        self.op[3] = delay
+        return self
+
+
+_OPERANDS = ("x", "y", "null", "isr", "osr", "pins", "pindirs", "pc", "exec", "status",
+             "not_x", "not_y", "x_dec", "y_dec", "x_not_y", "not_osre", "pin", "block",
+             "noblock", "clear", "rel", "irq", "gpio")
+_INSTRS = ("jmp", "wait", "in_", "out", "push", "pull", "mov", "irq", "set", "nop")
+
+
+def asm_pio(**settings):
+    """ Assemble the decorated function; returns (instructions, settings). """
+
+    def assemble(f):
+        prog = []
+        g = dict(f.__globals__)
+        for name in _OPERANDS:
+            g[name] = name
+        for name in _INSTRS:
+            g[name] = (lambda n: lambda *a: _Instr(prog, n, a))(name)
+        g["label"] = lambda name: prog.append(["label", (name,), None, 0])
+        g["wrap_target"] = lambda: prog.append(["wrap_target", (), None, 0])
+        g["wrap"] = lambda: prog.append(["wrap", (), None, 0])
+        g["word"] = lambda *a: _Instr(prog, "word", a)
+        _types.FunctionType(f.__code__, g, f.__name__, f.__defaults__, f.__closure__)()
+        return (prog, settings)
+
+    return assemble
+
+
+class StateMachine:
+    def __init__(self, id, program=None, freq=-1, **kw):
+        self.id = id
+        self._board = _board.current()
+        self._active = 0
+        self.words = 0
+        self._board.state_machines[id] = self
+        if program is not None:
+            self.init(program, freq, **kw)
+
+    def init(self, program, freq=-1, **kw):
+        self.program = program
+        self.freq = freq
+        self.settings = kw
+
+    def active(self, v=None):
+        if v is None:
+            return self._active
+        self._active = 1 if v else 0
+
+    def put(self, value, shift=0):
+        vals = value if hasattr(value, "__len__") else (value,)
+        for v in vals:
+            self._board.leds.append((self._board.clock.now_us, (v << shift) & 0xFFFFFFFF))
+            self.words += 1
+
+    def get(self, buf=None, shift=0):
+        return 0
+
+    def rx_fifo(self):
+        return 0
+
+    def tx_fifo(self):
+        return 0
+
+    def exec(self, instr):
+        pass
+
+    def restart(self):
+        pass
+
+    def irq(self, handler=None, trigger=0, hard=False):
+        pass
+
+
+_country = "XX"
+
+
+def country(code=None):
+    global _country
+    if code is None:
+        return _country
+    _country = code
+
+
+def bootsel_button():
+    return 0
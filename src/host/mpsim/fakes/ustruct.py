@@ -0,0 +1,5 @@
+# ustruct: the struct module under its MicroPython alias
+#
+# License: MIT
+
+from struct import *  # noqa: F401,F403
@@ -0,0 +1,8 @@
+# utime: MicroPython's time functions on the virtual clock (see mpsim.clock)
+#
+# License: MIT
+
+from mpsim.mptime import (  # noqa: F401
+    time, time_ns, localtime, gmtime, mktime, sleep, sleep_ms, sleep_us,
+    ticks_ms, ticks_us, ticks_cpu, ticks_add, ticks_diff,
+)
@@ -0,0 +1,109 @@
+# MicroPython time functions on the virtual clock
+#
+# install() puts them into CPython's time module too, since the device code
+# does "import time" and calls time.sleep_ms(), time.ticks_us() etc.
+#
+# License: MIT
+
+import calendar
+import datetime
+import time as _time
+
+from .clock import TICKS_PERIOD, ticks_add, ticks_diff  # noqa: F401
+
+_clock = None
+_EPOCH = datetime.datetime(1970, 1, 1)
+_saved = {}
+
+
+def _board_offset():
+    # machine.RTC of the calling board minus the true time
+    from . import board
+    try:
+        return board.current().rtc_offset
+    except RuntimeError:
+        return 0.0
+
+
+def _rate():
+    # clock rate of the calling board: 1 + its crystal error
+    from . import board
+    try:
+        return 1 + board.current().ppm * 1e-6
+    except RuntimeError:
+        return 1.0
+
+
+def time():
+    return int(_clock.time() + _board_offset())
+
+
+def time_ns():
+    return int((_clock.time() + _board_offset()) * 1e9)
+
+
+def gmtime(secs=None):
+    if secs is None:
+        secs = time()
+    d = _EPOCH + datetime.timedelta(seconds=int(secs))
+    return (d.year, d.month, d.day, d.hour, d.minute, d.second, d.weekday(),
+            d.timetuple().tm_yday)
+
+
+localtime = gmtime  # MicroPython has no time zones
+
+
+def mktime(t):
+    return calendar.timegm((t[0], t[1], t[2], t[3], t[4], t[5], 0, 0, 0))
+
+
+def sleep(s):
+    _clock.sleep_us(s * 1e6 / _rate())
+
+
+def sleep_ms(ms):
+    _clock.sleep_us(ms * 1000 / _rate())
+
+
+def sleep_us(us):
+    _clock.sleep_us(us / _rate())
+
+
+def ticks_ms():
+    r = _rate()
+    if r == 1.0:
+        return _clock.ticks_ms()
+    return int(_clock.now_us * r / 1000) & (TICKS_PERIOD - 1)
+
+
+def ticks_us():
+    r = _rate()
+    if r == 1.0:
+        return _clock.ticks_us()
+    return int(_clock.now_us * r) & (TICKS_PERIOD - 1)
+
+
+ticks_cpu = ticks_us
+
+_NAMES = ("time", "time_ns", "gmtime", "localtime", "mktime", "sleep", "sleep_ms", "sleep_us",
+          "ticks_ms", "ticks_us", "ticks_cpu", "ticks_add", "ticks_diff")
+
+
+def install(clock):
+    """ Use clock for the time functions and patch CPython's time module. """
+    global _clock
+    _clock = clock
+    g = globals()
+    for name in _NAMES:
+        if name not in _saved:
+            _saved[name] = getattr(_time, name, None)
+        setattr(_time, name, g[name])
+
+
+def uninstall():
+    for name, fn in _saved.items():
+        if fn is None:
+            delattr(_time, name)
+        else:
+            setattr(_time, name, fn)
+    _saved.clear()
@@ -0,0 +1,358 @@
+# Replay of a bus trace recorded by lib/bustrace.py on the XIAO
+#
+#   python -m mpsim.replay list TRACE/00.BTR
+#   python -m mpsim.replay run TRACE/00.BTR [--strict] [--cprofile 20]
+#
+# "run" starts the unmodified boot.py/main.py of the XIAO in the simulator
+# with the devices of I2C(1) replaced by ReplayDevices: each answers the
+# reads with the bytes recorded for its address, in order, and raises the
+# recorded OSErrors, so a failure seen on the device happens again at the
+# same point of the code, every run. Writes are checked against the trace
+# (when --strict) and passed on to the device model, so the OLED frame is
+# kept. The bytes the XIAO received on its UART arrive at the recorded
+# times; there is no sender.
+#
+# The replay follows the recorded timeline: a call that comes earlier than
+# on the device waits for the recorded time. Calls the trace does not have
+# (changed code, or the records dropped between the kept head part and the
+# ring part of the trace) are skipped up to LOOKAHEAD records ahead, else
+# answered by the device model; --strict stops at the first one instead.
+# The run ends when the trace is used up: at the first call for an address
+# without records left once the recorded timeline is over (at once with
+# --strict).
+#
+# Like mpsim.bench it prints the simulated time and bus traffic per loop
+# stage, and with --cprofile the host functions that took the most time.
+#
+# License: MIT
+
+import argparse
+import collections
+import cProfile
+import os
+import pstats
+import struct
+import sys
+import tempfile
+
+from . import devices
+from .bench import Meter, _instrument_xiao, print_summary
+from .clock import TICKS_PERIOD, SimStop
+from .runner import Simulation
+
+# as in lib/bustrace.py
+OP_WRITE, OP_READ, OP_WMEM, OP_RMEM, OP_SCAN, OP_FREQ = 1, 2, 3, 4, 5, 6
+OP_UTX, OP_URX, OP_MARK = 8, 9, 15
+ERR = 0x80
+NOREG = 0xFFFF
+HDR_FMT = "<IIBBHHH"
+FILE_FMT = "<4sBBHIIIII"
+FILE_MAGIC = b"BTRC"
+
+OP_NAMES = {OP_WRITE: "write", OP_READ: "read", OP_WMEM: "wmem", OP_RMEM: "rmem",
+            OP_SCAN: "scan", OP_FREQ: "freq", OP_UTX: "uart tx", OP_URX: "uart rx",
+            OP_MARK: "mark"}
+I2C_OPS = (OP_WRITE, OP_READ, OP_WMEM, OP_RMEM)
+LOOKAHEAD = 8
+
+Record = collections.namedtuple("Record", "t_us op addr reg n data errno part")
+
+
+class TraceError(ValueError):
+    pass
+
+
+class ReplayMismatch(RuntimeError):
+    """ The code made a bus call the trace does not have (with --strict). """
+
+
+def read_trace(path):
+    """
+    Parse a dump of lib/bustrace.py; returns (info, records). The record
+    times are in us since the first record, unwrapped with the ticks_ms()
+    value stored next to each ticks_us() one.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    hsize = struct.calcsize(FILE_FMT)
+    if len(raw) < hsize:
+        raise TraceError("%s: too short for a bus trace" % path)
+    magic, version, wmax, _, hrecs, rrecs, dropped, stamp, ticks_ms = struct.unpack_from(
+        FILE_FMT, raw)
+    if magic != FILE_MAGIC:
+        raise TraceError("%s: not a bus trace" % path)
+    if version != 1:
+        raise TraceError("%s: unknown version %d" % (path, version))
+    info = {"wmax": wmax, "head": hrecs, "ring": rrecs, "dropped": dropped, "stamp": stamp,
+            "ticks_ms": ticks_ms}
+    rsize = struct.calcsize(HDR_FMT)
+    records = []
+    pos = hsize
+    prev_ms = None
+    ms = 0
+    t0 = None
+    mask = TICKS_PERIOD - 1
+    for i in range(hrecs + rrecs):
+        if pos + rsize > len(raw):
+            raise TraceError("%s: truncated at record %d" % (path, i))
+        tus, tms, op, addr, reg, n, stored = struct.unpack_from(HDR_FMT, raw, pos)
+        pos += rsize
+        data = raw[pos:pos + stored]
+        pos += stored
+        ms = tms if prev_ms is None else ms + ((tms - prev_ms) & mask)
+        prev_ms = tms
+        # the ticks_us() value nearest to the ticks_ms() one
+        d = (tus - ms * 1000) & mask
+        if d >= TICKS_PERIOD // 2:
+            d -= TICKS_PERIOD
+        t = ms * 1000 + d
+        if t0 is None:
+            t0 = t
+        errno = data[0] if op & ERR and data else None
+        records.append(Record(t - t0, op & ~ERR, addr, reg, n, data, errno,
+                              "head" if i < hrecs else "ring"))
+    return info, records
+
+
+def format_record(r):
+    name = OP_NAMES.get(r.op, "op%d" % r.op)
+    if r.op == OP_MARK:
+        return "%12.6f  %-4s -- %s" % (r.t_us / 1e6, r.part, r.data.decode(errors="replace"))
+    if r.op == OP_FREQ:
+        return "%12.6f  %-4s      %-7s %d kHz" % (r.t_us / 1e6, r.part, name, r.n)
+    s = "%12.6f  %-4s 0x%02X %-7s" % (r.t_us / 1e6, r.part, r.addr, name)
+    if r.reg != NOREG:
+        s += " reg 0x%02X" % r.reg
+    s += " n %d" % r.n
+    if r.errno is not None:
+        return s + "  OSError %d" % r.errno
+    if r.data:
+        s += ": " + r.data.hex(" ")
+        if len(r.data) < r.n:
+            s += " ..."
+    return s
+
+
+class TracePlayer:
+    """ Serves the I2C records of a trace per address and keeps the replay on its timeline. """
+
+    def __init__(self, records, clock, strict=False, pace=True):
+        self.clock = clock
+        self.strict = strict
+        self.pace = pace
+        self.queues = {}
+        for r in records:
+            if r.op in I2C_OPS:
+                self.queues.setdefault(r.addr, collections.deque()).append(r)
+        self.remaining = sum(len(q) for q in self.queues.values())
+        self.end_us = max((q[-1].t_us for q in self.queues.values()), default=0)
+        self.uart_rx = [r for r in records if r.op == OP_URX]
+        self.uarts = {}
+        self.offset = None  # replay time minus trace time
+        self.served = collections.Counter()
+        self.errors = 0
+        self.skipped = 0
+        self.fallbacks = 0
+        self.max_late_us = 0
+
+    def _start(self, r):
+        self.offset = self.clock.now_us - r.t_us
+        for u in self.uart_rx:
+            model = self.uarts.get(u.addr)
+            if model is None:
+                continue
+            for b in u.data:
+                model.rx.append((self.offset + u.t_us - 1, b))
+
+    def _past_end(self):
+        return self.offset is not None and self.clock.now_us - self.offset >= self.end_us
+
+    def take(self, addr, ops, check=None):
+        """ The next record of addr with an op in ops, or None for the device model. """
+        q = self.queues.get(addr)
+        if self.remaining == 0 or (q is not None and not q and (self.strict or self._past_end())):
+            # the records of this address are used up: the replay is over
+            self.clock.stop()
+            raise SimStop("end of trace")
+        k = None
+        if q:
+            for i in range(min(len(q), 1 if self.strict else LOOKAHEAD)):
+                if q[i].op in ops and (check is None or check(q[i])):
+                    k = i
+                    break
+        if k is None:
+            if self.strict:
+                raise ReplayMismatch("0x%02X: no %s in the trace, next is %s" % (
+                    addr, "/".join(OP_NAMES[o] for o in ops),
+                    format_record(q[0]).strip() if q else "none"))
+            self.fallbacks += 1
+            return None
+        for _ in range(k):
+            q.popleft()
+        self.skipped += k
+        r = q.popleft()
+        self.remaining -= k + 1
+        if self.offset is None:
+            self._start(r)
+        due = self.offset + r.t_us
+        now = self.clock.now_us
+        if self.pace and due > now:
+            self.clock.sleep_us(due - now)
+        else:
+            self.max_late_us = max(self.max_late_us, now - due)
+        self.served[addr] += 1
+        if r.errno is not None:
+            self.errors += 1
+            raise OSError(r.errno, "replayed")
+        return r
+
+
+class ReplayDevice(devices.I2CDevice):
+    """ Answers one I2C address from the trace; writes also go to the model. """
+
+    def __init__(self, player, addr, model=None):
+        super().__init__()
+        self.player = player
+        self.addr = addr
+        self.model = model
+        self.pending = None  # readfrom_mem() record whose data is read next
+
+    def _model(self):
+        if self.model is None:
+            raise OSError(5)  # nothing answers at this address
+        return self.model
+
+    def i2c_write(self, data):
+        self.writes += 1
+        data = bytes(data)
+        check = None
+        if self.player.strict:
+            def check(r):
+                if r.op == OP_RMEM:
+                    return data[:1] == bytes((r.reg & 0xFF,))
+                got = data[1:] if r.op == OP_WMEM else data
+                return got[:len(r.data)] == r.data
+        r = self.player.take(self.addr, (OP_WRITE, OP_WMEM, OP_RMEM), check)
+        if r is not None and r.op == OP_RMEM:
+            self.pending = r
+        if self.model is not None:
+            self.model.i2c_write(data)
+        elif r is None:
+            self._model()
+
+    def i2c_read(self, n):
+        self.reads += 1
+        r, self.pending = self.pending, None
+        if r is None:
+            r = self.player.take(self.addr, (OP_READ,))
+        if r is None:
+            return self._model().i2c_read(n)
+        return r.data[:n].ljust(n, b"\xff")
+
+
+def replay(path, strict=False, pace=True, seconds=None, workdir=None, seed=1, quiet=True,
+           cprofile=0, out=None):
+    """ Run the XIAO scripts against a trace; returns (simulation, player, meter, stats). """
+    out = out or sys.stdout
+    info, records = read_trace(path)
+    if seconds is None:
+        seconds = (records[-1].t_us / 1e6 if records else 0) + 120
+    workdir = workdir or tempfile.mkdtemp(prefix="mpsim-replay-")
+    meters = []
+    prof = cProfile.Profile() if cprofile else None
+
+    def entry(b, g):
+        m = Meter(b, 1 << 30, warmup=0)
+        _instrument_xiao(m, g)
+        m.last = m.snapshot()
+        meters.append(m)
+        if prof is not None:
+            prof.runcall(g["main"])
+        else:
+            g["main"]()
+
+    sim = Simulation(workdir, ("xiao",), seconds=seconds, seed=seed, quiet=quiet, out=out,
+                     entry=entry, peer=False)
+    b = sim.boards["xiao"]
+    player = TracePlayer(records, sim.clock, strict=strict, pace=pace)
+    bus = b.i2c_bus(1)
+    addrs = set(player.queues)
+    for r in records:
+        if r.op == OP_SCAN and r.errno is None:
+            addrs.update(r.data)
+            break
+    for addr in sorted(addrs):
+        dev = ReplayDevice(player, addr, bus.devices.get(addr))
+        bus.devices[addr] = dev
+        dev.bus = bus
+    for r in player.uart_rx:
+        player.uarts[r.addr] = b.uart(r.addr)
+    wall = sim.run()
+    stats = None
+    if prof is not None:
+        stats = pstats.Stats(prof, stream=out)
+    return sim, player, (meters[0] if meters else None), stats, wall, info
+
+
+def _list(path, out):
+    info, records = read_trace(path)
+    for r in records:
+        out.write(format_record(r) + "\n")
+    per = collections.Counter((r.addr, OP_NAMES.get(r.op, str(r.op))) for r in records
+                              if r.op in I2C_OPS)
+    out.write("\n%d records (%d head, %d ring, %d dropped between), writes kept to %d bytes, "
+              "stamp %d\n" % (len(records), info["head"], info["ring"], info["dropped"],
+                              info["wmax"], info["stamp"]))
+    for (addr, op), n in sorted(per.items()):
+        out.write("  0x%02X %-6s %6d\n" % (addr, op, n))
+    errs = [r for r in records if r.errno is not None]
+    if errs:
+        out.write("  %d call(s) raised OSError\n" % len(errs))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="mpsim.replay", description="List or replay a bus trace "
+                                "of lib/bustrace.py.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    ls = sub.add_parser("list", help="print the records")
+    ls.add_argument("trace")
+    r = sub.add_parser("run", help="run the XIAO scripts against the trace")
+    r.add_argument("trace")
+    r.add_argument("--strict", action="store_true",
+                   help="stop at the first call the trace does not have")
+    r.add_argument("--no-pace", action="store_true",
+                   help="do not wait for the recorded time of a call")
+    r.add_argument("-s", "--seconds", type=float,
+                   help="simulated time limit (default: length of the trace + 120 s)")
+    r.add_argument("-d", "--workdir", help="flash copy and card image (default: temporary)")
+    r.add_argument("-v", "--verbose", action="store_true", help="show the board output")
+    r.add_argument("--cprofile", type=int, default=0, metavar="N",
+                   help="print the N host functions with the most cumulative time")
+    args = p.parse_args(argv)
+
+    out = sys.stdout
+    if args.cmd == "list":
+        _list(args.trace, out)
+        return 0
+    sim, player, meter, stats, wall, info = replay(
+        args.trace, strict=args.strict, pace=not args.no_pace, seconds=args.seconds,
+        workdir=args.workdir, quiet=not args.verbose, cprofile=args.cprofile, out=out)
+    sim.report(wall)
+    out.write("replay: %d records served, %d OSErrors raised, %d skipped, %d answered by "
+              "the models, %d left\n" % (sum(player.served.values()), player.errors,
+                                         player.skipped, player.fallbacks, player.remaining))
+    out.write("        at most %.1f ms behind the recorded timeline\n"
+              % (player.max_late_us / 1000))
+    if info["dropped"]:
+        out.write("        %d records were dropped on the device: after the gap the calls line "
+                  "up with the records only roughly\n" % info["dropped"])
+    if meter is not None:
+        print_summary("xiao", meter.summary(), out)
+    if stats is not None:
+        stats.sort_stats("cumulative").print_stats(args.cprofile)
+    print("files in", os.path.abspath(sim.workdir))
+    return 1 if any(not isinstance(e, SimStop) for e in sim.errors.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
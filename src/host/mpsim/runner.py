@@ -0,0 +1,390 @@
+# Run the unmodified boot.py/main.py of the boards on the simulated hardware
+#
+# Each board gets a copy of its source folder as flash file system, its own
+# thread and the devices of its setup:
+#
+#   xiao  Seeed XIAO RP2350: PCF8563, BME280, MCP9808 and SSD1306 on I2C(1),
+#         SD card on SPI(0) with CS on GP28, UART(0) to the Pico
+#   pico  Pimoroni Pico Plus 2: WLAN + NTP, UART(0) to the XIAO
+#
+# When only the XIAO runs, a scripted peer sends the NTP unixtime on its
+# UART the way the Pico does.
+#
+# License: MIT
+
+import builtins
+import gc
+import select
+import os
+import shutil
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+
+from . import board as _board
+from . import devices, mptime, vfs
+from .board import Board
+from .clock import Clock, SimStop
+from .sdcard import SDCardModel
+from .uart import link
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.normpath(os.path.join(HERE, "..", ".."))
+BOARD_DIRS = {"xiao": "Seeed_XIAO_RP2350", "pico": "Pimoroni_Pico_Plus2"}
+
+# what rp2's frozen _boot.py leaves in the globals of boot.py and main.py
+_BOOT = "import os, machine, rp2\n"
+
+
+class _Console:
+    """ sys.stdout that sends the output of each board thread to its own sink. """
+
+    def __init__(self, real):
+        self.real = real
+
+    def _sink(self):
+        try:
+            return _board.current().stdout or self.real
+        except RuntimeError:
+            return self.real
+
+    def write(self, s):
+        if not isinstance(s, str):
+            # MicroPython's sys.stdout also takes bytes and memoryviews
+            s = bytes(s).decode(errors="replace")
+        return self._sink().write(s)
+
+    def flush(self):
+        self._sink().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.real, name)
+
+
+class LinePrefix:
+    """
+    Console sink that prefixes each line with the board name and the time
+    the line was started; whole lines only, so two boards do not mix.
+
+    With bps set it also stands for a USB CDC console whose host reads that
+    many bytes per second: a write that does not fit into the CDC_BUF
+    bytes of the device's send buffer waits, as print() does on the board.
+    """
+
+    CDC_BUF = 256
+    PACKET = 64
+
+    def __init__(self, b, out, quiet=False, bps=None):
+        self.board = b
+        self.out = out
+        self.quiet = quiet
+        self.bps = bps
+        self.part = ""
+        self.t = 0.0
+        self.lines = 0
+        self.empty_us = 0  # when the send buffer will be empty
+        self.blocked_us = 0
+
+    def _send(self, n):
+        clock = self.board.clock
+        now = clock.now_us
+        self.empty_us = max(self.empty_us, now) + n * 1e6 / self.bps
+        wait = self.empty_us - now - self.CDC_BUF * 1e6 / self.bps
+        if wait > 0:
+            self.blocked_us += wait
+            clock.sleep_us(wait)
+
+    def writable(self):
+        """ POLLOUT: the host took a packet's worth of the send buffer. """
+        if not self.bps:
+            return True
+        backlog = max(0.0, self.empty_us - self.board.clock.now_us) * self.bps / 1e6
+        return self.CDC_BUF - backlog >= self.PACKET
+
+    def write(self, s):
+        if self.bps:
+            self._send(len(s))
+        if not self.part:
+            self.t = self.board.clock.now_us / 1e6
+        self.part += s
+        while "\n" in self.part:
+            line, self.part = self.part.split("\n", 1)
+            self.lines += 1
+            if not self.quiet:
+                self.out.write("[%-4s %9.3f] %s\n" % (self.board.name, self.t, line))
+            self.t = self.board.clock.now_us / 1e6
+        return len(s)
+
+    def flush(self):
+        self.out.flush()
+
+
+class _Poll:
+    """ select.poll() that also reports POLLOUT of the simulated consoles. """
+
+    def __init__(self, real):
+        self.real = real()
+        self.n_real = 0
+        self.console = 0  # event mask registered for sys.stdout
+
+    def register(self, obj, mask=select.POLLIN | select.POLLPRI | select.POLLOUT):
+        if isinstance(obj, _Console):
+            self.console = mask
+        else:
+            self.real.register(obj, mask)
+            self.n_real += 1
+
+    def modify(self, obj, mask):
+        if isinstance(obj, _Console):
+            self.console = mask
+        else:
+            self.real.modify(obj, mask)
+
+    def unregister(self, obj):
+        if isinstance(obj, _Console):
+            self.console = 0
+        else:
+            self.real.unregister(obj)
+            self.n_real -= 1
+
+    def poll(self, timeout=-1):
+        ev = []
+        if self.console & select.POLLOUT:
+            try:
+                sink = _board.current().stdout
+            except RuntimeError:
+                sink = None
+            if not isinstance(sink, LinePrefix) or sink.writable():
+                ev.append((sys.stdout, select.POLLOUT))
+        if self.n_real:
+            ev += self.real.poll(0 if ev else timeout)
+        return ev
+
+
+def _mem_alloc():
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+
+def _mem_free():
+    return max(0, 520 * 1024 - _mem_alloc())
+
+
+def _print_exception(exc, file=None):
+    traceback.print_exception(type(exc), exc, exc.__traceback__, file=file or sys.stdout)
+
+
+class Simulation:
+    def __init__(self, workdir, boards=("xiao", "pico"), seconds=600, epoch=1746700000,
+                 seed=1, rtc_offset_s=-3.0, rtc_ppm=20.0, sync_every_s=60, quiet=False,
+                 out=None, entry=None, peer=True, console_bps=None):
+        # workdir:      host directory for the flash copies and the card image
+        # rtc_offset_s: PCF8563 time minus the true time at the start
+        # rtc_ppm:      PCF8563 crystal error
+        # sync_every_s: send interval of the scripted peer (XIAO only)
+        # entry:        entry(board, globals) runs instead of the main() call
+        #               of main.py, which then runs with __name__ "__sim__"
+        # peer:         run the scripted sender when only the XIAO runs
+        # console_bps:  bytes per second the USB host reads from the
+        #               consoles, None for no delay
+        self.workdir = workdir
+        self.clock = Clock(epoch, seconds)
+        self.env = devices.Environment(self.clock, seed)
+        self.boards = {}
+        self.devices = {}
+        self.errors = {}
+        self.sync_every_s = sync_every_s
+        self.out = out or sys.stdout
+        self.quiet = quiet
+        self.entry = entry
+        self.peer = peer
+        self.console_bps = console_bps
+        os.makedirs(workdir, exist_ok=True)
+        for name in boards:
+            self.boards[name] = self._make(name, rtc_offset_s, rtc_ppm)
+        if "xiao" in self.boards and "pico" in self.boards:
+            link(self.boards["xiao"].uart(0), self.boards["pico"].uart(0))
+
+    def _make(self, name, rtc_offset_s, rtc_ppm):
+        root = os.path.join(self.workdir, name)
+        if not os.path.isdir(root):
+            shutil.copytree(os.path.join(SRC, BOARD_DIRS[name]), root,
+                            ignore=shutil.ignore_patterns("__pycache__"))
+        b = Board(name, os.path.realpath(root), self.clock)
+        b.stdout = LinePrefix(b, self.out, self.quiet, self.console_bps)
+        if name == "xiao":
+            i2c = b.i2c_bus(1)
+            d = self.devices
+            d["rtc"] = i2c.attach(devices.PCF8563(self.clock, rtc_offset_s, rtc_ppm))
+            d["bme280"] = i2c.attach(devices.BME280(self.env))
+            d["mcp9808"] = i2c.attach(devices.MCP9808(self.env))
+            d["oled"] = i2c.attach(devices.SSD1306(128, 32))
+            d["sd"] = b.spi_bus(0).attach(SDCardModel(os.path.join(self.workdir, "sd.img")),
+                                         cs=28)
+        return b
+
+    # --- threads ---
+
+    def _run_board(self, b, ready):
+        b.bind()
+        self.clock.join()
+        ready.wait()
+        g = {"__name__": "__main__"}
+        try:
+            exec(_BOOT, g)
+            for script in ("boot.py", "main.py"):
+                path = os.path.join(b.root, script)
+                if os.path.exists(path):
+                    with open(path) as f:
+                        code = compile(f.read(), path, "exec")
+                    g["__file__"] = path
+                    if script == "main.py" and self.entry is not None:
+                        g["__name__"] = "__sim__"
+                        exec(code, g)
+                        self.entry(b, g)
+                    else:
+                        exec(code, g)
+        except SimStop:
+            pass
+        except BaseException as exc:  # noqa: B902 - report what ended the board
+            self.errors[b.name] = exc
+            _print_exception(exc, b.stdout)
+        finally:
+            self.clock.leave()
+
+    def _run_peer(self, xiao, ready):
+        # stands in for the Pico: the NTP time as ">L" every sync_every_s
+        peer = Board("peer", self.workdir, self.clock)
+        peer.bind()
+        self.clock.join()
+        u = peer.uart(0)
+        u.baudrate = 9600
+        link(u, xiao.uart(0))
+        ready.wait()
+        try:
+            self.clock.sleep_us(5e6)
+            while True:
+                u.write(struct.pack(">L", int(self.clock.time())))
+                self.clock.sleep_us(self.sync_every_s * 1e6)
+        except SimStop:
+            pass
+        finally:
+            self.clock.leave()
+
+    def run(self):
+        """ Run the boards until the simulated time is over; returns the wall time. """
+        threads = []
+        peer = self.peer and "xiao" in self.boards and "pico" not in self.boards
+        ready = threading.Barrier(len(self.boards) + peer)
+        for b in self.boards.values():
+            threads.append(threading.Thread(target=self._run_board, args=(b, ready),
+                                            name=b.name, daemon=True))
+        if peer:
+            threads.append(threading.Thread(target=self._run_peer,
+                                            args=(self.boards["xiao"], ready),
+                                            name="peer", daemon=True))
+        saved = self._install()
+        t0 = time.perf_counter()
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                while t.is_alive():
+                    t.join(0.2)
+        except KeyboardInterrupt:
+            self.clock.stop()
+            for t in threads:
+                t.join(5)
+        finally:
+            wall = time.perf_counter() - t0
+            self._uninstall(saved)
+        sd = self.devices.get("sd")
+        if sd is not None:
+            sd.close()
+        return wall
+
+    # --- host patches ---
+
+    def _install(self):
+        saved = {"path": list(sys.path), "stdout": sys.stdout,
+                 "gc": (getattr(gc, "mem_alloc", None), getattr(gc, "mem_free", None)),
+                 "secrets": sys.modules.pop("secrets", None)}
+        paths = [os.path.join(HERE, "fakes")]
+        for b in self.boards.values():
+            paths.append(b.root)
+            if os.path.isdir(os.path.join(b.root, "sd")):
+                paths.append(os.path.join(b.root, "sd"))
+        sys.path[:0] = paths
+        sys.stdout = _Console(sys.stdout)
+        saved["poll"] = select.poll
+        real_poll = select.poll
+        select.poll = lambda: _Poll(real_poll)
+        sys.print_exception = _print_exception
+        # the MicroPython compiler folds const() even where it is not imported
+        builtins.const = lambda x: x
+        gc.mem_alloc = _mem_alloc
+        gc.mem_free = _mem_free
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            saved["tracemalloc"] = True
+        mptime.install(self.clock)
+        vfs.install()
+        return saved
+
+    def _uninstall(self, saved):
+        vfs.uninstall()
+        mptime.uninstall()
+        if saved.get("tracemalloc"):
+            tracemalloc.stop()
+        gc.mem_alloc, gc.mem_free = saved["gc"]
+        if gc.mem_alloc is None:
+            del gc.mem_alloc, gc.mem_free
+        del sys.print_exception
+        del builtins.const
+        sys.stdout = saved["stdout"]
+        select.poll = saved["poll"]
+        sys.path[:] = saved["path"]
+        for name in [n for n in sys.modules if n == "lib" or n.startswith("lib.")]:
+            del sys.modules[name]
+        sys.modules.pop("secrets", None)
+        if saved["secrets"] is not None:
+            sys.modules["secrets"] = saved["secrets"]
+
+    # --- report ---
+
+    def report(self, wall):
+        w = self.out.write
+        sim_s = self.clock.now_us / 1e6
+        w("\nsimulated %.1f s in %.1f s wall time (%.0fx)\n" % (sim_s, wall,
+                                                                sim_s / max(wall, 1e-9)))
+        for b in self.boards.values():
+            w("%s:\n" % b.name)
+            for bus in b.i2c.values():
+                w("  I2C(%d) %d transactions, %d bytes\n" % (bus.id, bus.transactions,
+                                                             bus.bytes))
+                for addr, dev in sorted(bus.devices.items()):
+                    w("    0x%02X %-8s %6d writes %6d reads\n" % (addr, type(dev).__name__,
+                                                                  dev.writes, dev.reads))
+            for bus in b.spi.values():
+                w("  SPI(%d) %d bytes at %d kHz\n" % (bus.id, bus.bytes, bus.baudrate // 1000))
+            for m in b.mounts.values():
+                w("  %s %d blocks read, %d written\n" % (m.point, m.blocks_read,
+                                                         m.blocks_written))
+            for u in b.uarts.values():
+                w("  UART(%d) %d bytes sent, %d received\n" % (u.id, u.tx_bytes, u.rx_bytes))
+            if b.stdout.blocked_us:
+                w("  console writes waited %.3f s for the USB host\n" % (b.stdout.blocked_us / 1e6))
+            if b.leds:
+                w("  RGB LED %d updates, last 0x%06X\n" % (len(b.leds), b.leds[-1][1] >> 8))
+            if b.name in self.errors:
+                w("  ended with %r\n" % (self.errors[b.name],))
+        rtc = self.devices.get("rtc")
+        if rtc is not None:
+            w("RTC minus true time: %+.3f s\n" % (rtc.now() - self.clock.time()))
+        oled = self.devices.get("oled")
+        if oled is not None:
+            w("OLED:\n")
+            for line in oled.frame():
+                w("  " + line + "\n")
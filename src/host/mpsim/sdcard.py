@@ -0,0 +1,210 @@
+# SD card in SPI mode, byte by byte, backed by an image file
+#
+# Implements what lib/sdcard.py uses: CMD0/8/9/12/13/16/17/18/23/24/25/32/
+# 33/38/55/58/59 and ACMD41/23, CRC7 on commands and CRC16 on data blocks
+# when CRC mode is on (CMD59), busy signalling after writes and erases, a
+# read latency before the data token, and data corruption above max_baud
+# so that SDCard.negotiate_baudrate() finds the limit.
+#
+# License: MIT
+
+import collections
+import mmap
+import os
+
+
+def crc7(data):
+    crc = 0
+    for b in data:
+        for i in range(8):
+            crc <<= 1
+            if ((b << i) & 0x80) ^ (crc & 0x80):
+                crc ^= 0x09
+    return ((crc & 0x7F) << 1) | 1
+
+
+def crc16(data):
+    crc = 0
+    for b in data:
+        crc ^= b << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc &= 0xFFFF
+    return crc
+
+
+class SDCardModel:
+    def __init__(self, image=None, nblocks=65536, hc=True, tran_speed=0x32, busy=3, latency=2,
+                 max_baud=25000000):
+        # image:      path of the card image; created with nblocks when missing,
+        #             None keeps the card in RAM
+        # tran_speed: CSD TRAN_SPEED byte (0x32 = 25 MHz)
+        # busy:       bytes of busy signalling after a block write
+        # latency:    0xFF bytes before a data token
+        self.bus = None
+        self.selected = False
+        self._f = None
+        if image is None:
+            self.img = bytearray(nblocks * 512)
+        else:
+            if not os.path.exists(image):
+                with open(image, "wb") as f:
+                    f.truncate(nblocks * 512)
+            self._f = open(image, "r+b")
+            self.img = mmap.mmap(self._f.fileno(), 0)
+        self.nblocks = len(self.img) // 512
+        self.hc = hc
+        self.tran_speed = tran_speed
+        self.busy = busy
+        self.latency = latency
+        self.max_baud = max_baud
+        self.out = collections.deque()
+        self.cmd = []
+        self.state = "idle"
+        self.idle = True
+        self.acmd = False
+        self.crc_on = False
+        self.erase_range = [0, 0]
+        self.log = []  # command numbers, ACMDs as 100 + n
+        self.blocks_read = 0
+        self.blocks_written = 0
+
+    def close(self):
+        if self._f is not None:
+            self.img.flush()
+            self.img.close()
+            self._f.close()
+            self._f = None
+
+    def select(self, pin_value):
+        self.selected = pin_value == 0
+
+    def csd(self):
+        c = bytearray(16)
+        c[0] = 0x40  # CSD version 2.0
+        c[3] = self.tran_speed
+        size = self.nblocks // 1024 - 1
+        c[7] = (size >> 16) & 0x3F
+        c[8] = (size >> 8) & 0xFF
+        c[9] = size & 0xFF
+        return c
+
+    def _addr(self, arg):
+        return arg if self.hc else arg // 512
+
+    def _data_block(self, data):
+        c = crc16(data)
+        d = bytearray(data)
+        if self.bus is not None and self.bus.baudrate > self.max_baud:
+            d[0] ^= 1
+        return [0xFF] * self.latency + [0xFE] + list(d) + [c >> 8, c & 0xFF]
+
+    def _block(self, a):
+        self.blocks_read += 1
+        return self.img[a * 512 : (a + 1) * 512]
+
+    def _exec(self, c):
+        idx = c[0] & 0x3F
+        arg = (c[1] << 24) | (c[2] << 16) | (c[3] << 8) | c[4]
+        acmd, self.acmd = self.acmd, False
+        self.log.append(100 + idx if acmd else idx)
+        if self.crc_on and idx != 0 and crc7(bytes(c[:5])) != c[5]:
+            self.out.extend([0xFF, 0x08])  # command CRC error
+            return
+        r1 = 1 if self.idle else 0
+        o = [0xFF]
+        if idx == 0:
+            self.idle = True
+            self.state = "idle"
+            o.append(1)
+        elif idx == 8:
+            o += [r1, 0, 0, 1, 0xAA]
+        elif idx == 55:
+            self.acmd = True
+            o.append(r1)
+        elif idx == 41 and acmd:
+            self.idle = False
+            o.append(0)
+        elif idx == 23 and acmd:
+            o.append(r1)
+        elif idx == 58:
+            o += [r1, 0xC0 if self.hc else 0x80, 0xFF, 0x80, 0]
+        elif idx == 59:
+            self.crc_on = bool(arg & 1)
+            o.append(r1)
+        elif idx == 9:
+            o.append(r1)
+            o += self._data_block(self.csd())
+        elif idx in (16, 13):
+            o.append(r1)
+            if idx == 13:
+                o.append(0)
+        elif idx == 17:
+            o.append(r1)
+            o += self._data_block(self._block(self._addr(arg)))
+        elif idx == 18:
+            o.append(r1)
+            self.state = "mread"
+            self.read_addr = self._addr(arg)
+        elif idx == 12:
+            self.state = "idle"
+            self.out.clear()
+            o = [0xFF, 0xFF, 0]
+        elif idx in (24, 25):
+            self.state = "wtok"
+            self.write_addr = self._addr(arg)
+            self.multi = idx == 25
+            o.append(r1)
+        elif idx == 32:
+            self.erase_range[0] = self._addr(arg)
+            o.append(r1)
+        elif idx == 33:
+            self.erase_range[1] = self._addr(arg)
+            o.append(r1)
+        elif idx == 38:
+            s, e = self.erase_range
+            self.img[s * 512 : (e + 1) * 512] = bytes((e + 1 - s) * 512)
+            o.append(r1)
+            o += [0] * self.busy
+        else:
+            o.append(r1 | 4)  # illegal command
+        self.out.extend(o)
+
+    def _xfer_byte(self, b):
+        if self.state == "mread" and not self.out:
+            a = self.read_addr
+            self.read_addr += 1
+            self.out.extend(self._data_block(self._block(a)))
+        r = self.out.popleft() if self.out else 0xFF
+        st = self.state
+        if st == "wtok":
+            if b in (0xFE, 0xFC):
+                self.state = "wdata"
+                self.wbuf = bytearray()
+            elif b == 0xFD and self.multi:
+                self.state = "idle"
+                self.out.extend([0xFF] + [0] * self.busy)
+            return r
+        if st == "wdata":
+            self.wbuf.append(b)
+            if len(self.wbuf) == 514:
+                d = self.wbuf[:512]
+                if self.crc_on and crc16(d) != (self.wbuf[512] << 8 | self.wbuf[513]):
+                    self.out.extend([0xEB])  # data rejected, CRC error
+                else:
+                    a = self.write_addr
+                    self.img[a * 512 : (a + 1) * 512] = bytes(d)
+                    self.write_addr += 1
+                    self.blocks_written += 1
+                    self.out.extend([0xE5] + [0] * self.busy)
+                self.state = "wtok" if self.multi else "idle"
+            return r
+        if self.cmd or (b & 0xC0) == 0x40:
+            self.cmd.append(b)
+            if len(self.cmd) == 6:
+                c, self.cmd = self.cmd, []
+                self._exec(c)
+        return r
+
+    def xfer(self, out):
+        return bytes(self._xfer_byte(b) for b in out)
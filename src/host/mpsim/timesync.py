@@ -0,0 +1,452 @@
+# How far the time of the XIAO is from UTC: the time sync path end to end
+#
+#   python -m mpsim.timesync model --days 7 -o base.json
+#   python -m mpsim.timesync scripts --hours 2
+#   python -m mpsim.timesync compare base.json new.json
+#
+# The error of the XIAO's clock after a sync is the sum of
+#
+#   ntp      error of the NTP time the Pico gets (server, network asymmetry)
+#   trunc    ntptime.time() returns whole seconds: -1 .. 0 s
+#   transit  NTP query to arrival at the XIAO: half the round trip, the
+#            Pico's print()s, 4 bytes at 9600 baud, link latency
+#   poll     arrival until the XIAO loop reads the UART: 0 .. one loop pass
+#   proc     read until the RTC write (LED, prints, a 10 ms sleep)
+#   set      the PCF8563 takes whole seconds; with its prescaler restarted
+#            by the write the second starts then
+#
+# and it grows with the crystal error of the PCF8563 until the next sync.
+# With --ping 1 (use_ping in both main.py) the XIAO times the link with
+# pings to the Pico and sets the RTC at the start of a second; transit,
+# poll and proc are then replaced by
+#
+#   delay    round trip of the ping used (the smallest of the burst)
+#   link     error the link leaves: half the asymmetry of that round trip
+#   write    end of the wait to the write of the RTC seconds
+#
+# ("scripts" measures link as the sync error minus the error of the
+# Pico's NTP reference, so it includes write).
+#
+# "model" runs an event model of both loops for days in seconds: the Pico
+# loop on its own (drifting) ticks, sending every send_interval_s, and the
+# XIAO loop passes of rx_loop_s, which read the UART and set the RTC as
+# main.py does. "scripts" runs the unmodified scripts of both boards in the
+# simulator with the same parameters (slower, about 9 min per simulated
+# day) and measures the same, so the model can be checked against the
+# code, and changes to the code can be measured directly.
+#
+# Both report distributions (mean, sd, percentiles) of
+#
+#   rtc      PCF8563 time minus true time, sampled every sample_s
+#   display  the time on the OLED minus true time, sampled the same way
+#            (whole seconds, updated once per loop pass)
+#   sync     the RTC error right after each sync
+#
+# after the first sync, in ms; the time zone offset is taken out.
+#
+# License: MIT
+
+import argparse
+import bisect
+import json
+import math
+import os
+import random
+import re
+import sys
+import tempfile
+
+# name: (default, help)
+PARAMS = {
+    "ntp_error_ms": (5.0, "standard deviation of the NTP time the Pico gets"),
+    "ntp_bias_ms": (0.0, "mean error of that time (asymmetric network path)"),
+    "ntp_rtt_ms": (30.0, "round trip of an NTP query"),
+    "ntp_truncate": (1, "1: ntptime.time() truncates to whole seconds (model only)"),
+    "sender_ppm": (10.0, "crystal error of the Pico"),
+    "send_interval_s": (60.0, "send interval of the Pico (interval_t of its main.py)"),
+    "sender_loop_s": (10.0, "sleep of the Pico loop"),
+    "sender_print_ms": (5.0, "NTP answer to UART write on the Pico (model only)"),
+    "baud": (9600, "UART speed (model only)"),
+    "link_latency_ms": (0.0, "extra UART latency per message"),
+    "link_jitter_ms": (0.0, "random extra latency, uniform 0 .. this"),
+    "rx_loop_s": (1.064, "one pass of the XIAO loop (model only; see mpsim.bench)"),
+    "rx_proc_ms": (12.0, "UART read to RTC write on the XIAO (model only)"),
+    "rtc_ppm": (20.0, "crystal error of the PCF8563"),
+    "rtc_offset_s": (-3.0, "PCF8563 minus true time at the start"),
+    "rtc_prescaler_reset": (1, "1: writing the seconds restarts the current second"),
+    "rtc_write_ms": (0.3, "end of the wait to the write of the RTC seconds, with ping (model only)"),
+    "ping": (0, "1: the XIAO sets the RTC from pings to the Pico (use_ping of both main.py)"),
+    "ping_count": (4, "pings per sync (PING_COUNT of the XIAO)"),
+    "sample_s": (10.0, "sampling interval of the rtc and display errors"),
+}
+
+PERCENTILES = (1, 5, 50, 95, 99)
+PING_LEN = 18  # uartping.MSG_LEN
+PING_POLL_S = 100e-6  # uartping._POLL_US: how late a board may stamp a message
+PING_LEAD_S = 0.05  # PING_LEAD_US of the XIAO
+
+
+def defaults():
+    return {k: v[0] for k, v in PARAMS.items()}
+
+
+class Dist:
+    """ Samples of one error, in ms. """
+
+    def __init__(self):
+        self.v = []
+
+    def add(self, ms):
+        self.v.append(ms)
+
+    def summary(self):
+        v = sorted(self.v)
+        n = len(v)
+        if not n:
+            return {"n": 0}
+        mean = sum(v) / n
+        sd = math.sqrt(sum((x - mean) ** 2 for x in v) / n)
+        a = sorted(abs(x) for x in v)
+        s = {"n": n, "mean": mean, "sd": sd, "min": v[0], "max": v[-1],
+             "abs_p95": a[min(n - 1, int(0.95 * n))], "abs_max": a[-1]}
+        for p in PERCENTILES:
+            s["p%d" % p] = v[min(n - 1, int(p / 100.0 * n))]
+        return {k: round(x, 3) if isinstance(x, float) else x for k, x in s.items()}
+
+    def histogram(self, bins=12):
+        """ [(low, high, count)] over the range of the samples. """
+        if not self.v:
+            return []
+        lo, hi = min(self.v), max(self.v)
+        if hi == lo:
+            return [(lo, hi, len(self.v))]
+        w = (hi - lo) / bins
+        counts = [0] * bins
+        for x in self.v:
+            counts[min(bins - 1, int((x - lo) / w))] += 1
+        return [(lo + i * w, lo + (i + 1) * w, c) for i, c in enumerate(counts)]
+
+
+class _RTC:
+    """ The PCF8563 of the model: counts with a ppm error, set in whole seconds. """
+
+    def __init__(self, offset_s, ppm, prescaler_reset):
+        self.rate = 1 + ppm * 1e-6
+        self.prescaler_reset = prescaler_reset
+        self.base_s = offset_s  # RTC minus the start time at t = 0
+        self.base_t = 0.0
+
+    def now(self, t):
+        return self.base_s + (t - self.base_t) * self.rate
+
+    def set(self, t, secs):
+        frac = 0.0 if self.prescaler_reset else self.now(t) % 1.0
+        self.base_s = secs + frac
+        self.base_t = t
+
+
+def _sends(p, rng, until):
+    """ (true time the message leaves the Pico, unixtime sent, components) of the Pico loop. """
+    rate = 1 + p["sender_ppm"] * 1e-6
+    rtt = p["ntp_rtt_ms"] / 1000.0
+    t = 2.5 + rng.uniform(0, 0.1)  # connected
+    start_ticks = t * rate
+    first = True
+    while t < until:
+        ticks = t * rate
+        if first or (ticks - start_ticks) * 1000 >= p["send_interval_s"] * 1000:
+            first = False
+            start_ticks = ticks
+            t += rtt
+            ntp = rng.gauss(p["ntp_bias_ms"], p["ntp_error_ms"]) / 1000.0
+            server = t - rtt / 2 + ntp  # the server time as received, to the start time
+            value = math.floor(server) if p["ntp_truncate"] else server
+            t += p["sender_print_ms"] / 1000.0
+            # value was the server time at t_mid, the Pico's ping reference
+            t_mid = t - rtt / 2 - p["sender_print_ms"] / 1000.0
+            yield t, value, t_mid, {"ntp": ntp * 1000, "trunc": (value - server) * 1000}
+            t += 1.0 / rate  # led on
+        t += p["sender_loop_s"] / rate
+
+
+def run_model(p, seconds, seed=1):
+    """ The event model for the given simulated seconds; returns {name: Dist}. """
+    rng = random.Random(seed)
+    wire = 4 * 10.0 / p["baud"]
+    def latency():
+        return (p["link_latency_ms"] + rng.uniform(0, p["link_jitter_ms"])) / 1000.0
+
+    arrivals = []  # (arrival time, value, ping reference, components)
+    last = 0.0
+    for t_tx, value, t_mid, comp in _sends(p, rng, seconds):
+        t_arr = max(t_tx + latency() + wire, last)
+        last = t_arr
+        if not p["ping"]:
+            comp["transit"] = (t_arr - t_mid) * 1000
+        arrivals.append((t_arr, value, t_mid, comp))
+    times = [a[0] for a in arrivals]
+
+    def burst(t, value, t_mid):
+        # the exchange of the smallest delay: (its delay, the error of the
+        # time it gives, the part of the link in that), and the end of the burst
+        ping_wire = PING_LEN * 10.0 / p["baud"]
+        best = None
+        for _ in range(int(p["ping_count"])):
+            l1 = ping_wire + latency()
+            l2 = ping_wire + latency()
+            e2 = rng.uniform(0, PING_POLL_S)  # T2 late on the Pico
+            e4 = rng.uniform(0, PING_POLL_S)  # T4 late on the XIAO
+            t3 = t + l1 + e2
+            link = (l1 - l2 + e2 - e4) / 2
+            err = value - t_mid + (t3 - t_mid) * p["sender_ppm"] * 1e-6 + link
+            d = l1 + e2 + l2 + e4
+            if best is None or d < best[0]:
+                best = (d, err, link)
+            t = t3 + l2 + e4
+        return best, t
+
+    rtc = _RTC(p["rtc_offset_s"], p["rtc_ppm"], p["rtc_prescaler_reset"])
+    dists = {k: Dist() for k in ("rtc", "display", "sync", "ntp", "trunc", "transit", "poll",
+                                 "proc", "delay", "link", "write")}
+    samples = [p["sample_s"] * (i + rng.random()) for i in range(int(seconds / p["sample_s"]))]
+    si = 0
+    synced_at = None
+    shown = None  # the RTC second on the display
+
+    def take(until):
+        # the samples before until, with the display as it is
+        nonlocal si
+        while si < len(samples) and samples[si] < until:
+            ts = samples[si]
+            si += 1
+            if synced_at is None or ts < synced_at:
+                continue
+            dists["rtc"].add((rtc.now(ts) - ts) * 1000)
+            if shown is not None:
+                dists["display"].add((shown - ts) * 1000)
+
+    r = 6.0 + rng.uniform(0, 0.2)  # intro_msg()
+    ai = 0
+    while r < seconds:
+        k = bisect.bisect_right(times, r)
+        got = None
+        while ai < k:
+            got = arrivals[ai]
+            ai += 1
+        show_t = r + 0.064
+        if got is not None:
+            t_arr, value, t_mid, comp = got
+            t_set = r + p["rx_proc_ms"] / 1000.0
+            if p["ping"]:
+                # wait for the start of the next second of the time the
+                # burst gave, then write
+                (d, err, link), t = burst(t_set, value, t_mid)
+                value = math.floor(t + err + PING_LEAD_S) + 1
+                t_set = value - err + p["rtc_write_ms"] / 1000.0
+                comp["delay"] = d * 1000
+                comp["link"] = link * 1000
+                comp["write"] = -p["rtc_write_ms"]
+            else:
+                comp["poll"] = (r - t_arr) * 1000
+                comp["proc"] = (t_set - r) * 1000
+            take(t_set)
+            rtc.set(t_set, value)
+            if synced_at is None:
+                synced_at = t_set
+            dists["sync"].add((rtc.now(t_set) - t_set) * 1000)
+            for name, v in comp.items():
+                dists[name].add(v)
+            r = t_set - p["rx_proc_ms"] / 1000.0 + 1.01  # the LED stays on for a second
+            show_t = r + 0.064
+        take(show_t)
+        if synced_at is not None:
+            shown = math.floor(rtc.now(show_t))
+        r += p["rx_loop_s"]
+    return dists
+
+
+def _set_flag(path, name):
+    # the flags of main.py are used while it is imported: set it in the copy
+    with open(path) as f:
+        src = f.read()
+    new = re.sub(r"^%s = False\b" % name, "%s = True" % name, src, count=1, flags=re.M)
+    if new == src:
+        raise ValueError("%s: no line %s = False" % (path, name))
+    with open(path, "w") as f:
+        f.write(new)
+
+
+def run_scripts(p, seconds, seed=1, workdir=None, out=None):
+    """ The unmodified scripts of both boards in the simulator; returns {name: Dist}. """
+    from .runner import Simulation
+    dists = {k: Dist() for k in ("rtc", "display", "sync", "delay", "link")}
+    state = {"synced": False, "shown": None, "ref_err": None}
+
+    def entry(b, g):
+        if b.name != "xiao":
+            if p["ping"]:
+                # the error of the Pico's reference, to take it out of the
+                # sync error: what is left is the link and the RTC write
+                server = g["ping"]
+                set_reference = server.set_reference
+
+                def set_ref(sec, ticks):
+                    set_reference(sec, ticks)
+                    t = sec + g["ticks_diff"](g["ticks_us"](), ticks) / 1e6
+                    state["ref_err"] = t - b.clock.time()
+
+                server.set_reference = set_ref
+            g["main"]()
+            return
+        import machine
+        clock = b.clock
+        rtc_dev = sim.devices["rtc"]
+        rtc_dev.prescaler_reset = bool(p["rtc_prescaler_reset"])
+        g["PING_COUNT"] = int(p["ping_count"])
+        tz = g.get("tz_offset", 0) * 3600
+
+        def err_ms(secs):
+            return (secs - tz - clock.time()) * 1000
+
+        handle = g["handle_rx_buf"]
+
+        def handle_rx_buf(rx_buf):
+            r = handle(rx_buf)
+            if r:
+                state["synced"] = True
+                dists["sync"].add(err_ms(rtc_dev.now()))
+                if p["ping"] and g["ping"].delay >= 0:
+                    dists["delay"].add(g["ping"].delay / 1000.0)
+                    dists["link"].add(err_ms(rtc_dev.now()) - state["ref_err"] * 1000)
+            return r
+
+        g["handle_rx_buf"] = handle_rx_buf
+        oled = g["oled"]
+        show = oled.show
+
+        def shown():
+            state["shown"] = math.floor(rtc_dev.now())
+            show()
+
+        oled.show = shown
+
+        def sample(t):
+            if state["synced"]:
+                dists["rtc"].add(err_ms(rtc_dev.now()))
+                if state["shown"] is not None:
+                    dists["display"].add(err_ms(state["shown"]))
+            # at random times, else the display would be sampled at one phase
+            t.init(mode=machine.Timer.ONE_SHOT, callback=sample,
+                   period=int(rng.uniform(0.5, 1.5) * p["sample_s"] * 1000))
+
+        sample(machine.Timer())
+        g["main"]()
+
+    workdir = workdir or tempfile.mkdtemp(prefix="mpsim-timesync-")
+    sim = Simulation(workdir, ("xiao", "pico"), seconds=seconds, seed=seed, quiet=True,
+                     out=out, entry=entry, rtc_offset_s=p["rtc_offset_s"],
+                     rtc_ppm=p["rtc_ppm"])
+    rng = random.Random(seed)
+    pico, xiao = sim.boards["pico"], sim.boards["xiao"]
+    if p["ping"]:
+        for b in (pico, xiao):
+            _set_flag(os.path.join(b.root, "main.py"), "use_ping")
+    pico.ppm = p["sender_ppm"]
+    rtt_s = p["ntp_rtt_ms"] / 1000.0
+    # ntptime of the simulator returns this at the end of the round trip
+    pico.ntp = lambda: (sim.clock.time() - rtt_s / 2
+                        + rng.gauss(p["ntp_bias_ms"], p["ntp_error_ms"]) / 1000.0)
+    for u in (pico.uart(0), xiao.uart(0)):
+        u.latency_us = p["link_latency_ms"] * 1000
+        u.jitter_us = p["link_jitter_ms"] * 1000
+        u.rng = rng
+    sim.run()
+    if sim.errors:
+        raise RuntimeError("the scripts stopped: %r" % (sim.errors,))
+    return dists
+
+
+# --- output ---
+
+def summarize(dists):
+    return {k: d.summary() for k, d in dists.items()}
+
+
+def print_summary(res, f=sys.stdout, hist=None):
+    cols = ["n", "mean", "sd", "min"] + ["p%d" % p for p in PERCENTILES] + ["max", "abs_p95"]
+    f.write("%-8s" % "ms" + "".join("%9s" % c for c in cols) + "\n")
+    for name, s in res.items():
+        if not s.get("n"):
+            continue
+        f.write("%-8s" % name + "".join(("%9d" if c == "n" else "%9.1f") % s[c]
+                                        for c in cols) + "\n")
+    if hist is not None:
+        for name in ("rtc", "display"):
+            h = hist[name].histogram()
+            if not h:
+                continue
+            f.write("\n%s error histogram (ms):\n" % name)
+            top = max(c for _, _, c in h)
+            for lo, hi, c in h:
+                f.write("  %9.1f .. %9.1f %7d %s\n" % (lo, hi, c, "#" * int(40 * c / top)))
+
+
+def compare(old, new, f=sys.stdout):
+    """ Side by side of two result files: the changes of mean, sd, p50, |p95| and max. """
+    for name in [n for n in old["results"] if n in new["results"]]:
+        a, b = old["results"][name], new["results"][name]
+        if not a.get("n") or not b.get("n"):
+            continue
+        f.write("%s:\n" % name)
+        for k in ("mean", "sd", "p50", "abs_p95", "abs_max"):
+            f.write("  %-8s %10.1f -> %10.1f  %+10.1f\n" % (k, a[k], b[k], b[k] - a[k]))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="mpsim.timesync", description="Error of the XIAO clock "
+                                "against UTC through the time sync path.")
+    sub = p.add_subparsers(dest="cmd", required=True)
+    runs = []
+    for name, hlp in (("model", "event model of the sync path, fast"),
+                      ("scripts", "the board scripts in the simulator")):
+        r = sub.add_parser(name, help=hlp)
+        r.add_argument("--days", type=float, default=0)
+        r.add_argument("--hours", type=float, default=0)
+        r.add_argument("--seed", type=int, default=1)
+        r.add_argument("-o", "--out", help="JSON result file")
+        r.add_argument("--hist", action="store_true", help="print histograms")
+        for k, (v, hlp) in PARAMS.items():
+            r.add_argument("--" + k.replace("_", "-"), type=type(v), default=v, help=hlp)
+        runs.append(r)
+    c = sub.add_parser("compare", help="compare two result files")
+    c.add_argument("old")
+    c.add_argument("new")
+    args = p.parse_args(argv)
+
+    if args.cmd == "compare":
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        compare(old, new)
+        return 0
+
+    params = {k: getattr(args, k) for k in PARAMS}
+    seconds = (args.days * 86400 + args.hours * 3600) or (7 * 86400 if args.cmd == "model"
+                                                          else 3600)
+    if args.cmd == "model":
+        dists = run_model(params, seconds, args.seed)
+    else:
+        dists = run_scripts(params, seconds, args.seed)
+    res = summarize(dists)
+    print("%s, %.1f simulated hours" % (args.cmd, seconds / 3600))
+    print_summary(res, hist=dists if args.hist else None)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"version": 1, "mode": args.cmd, "seconds": seconds, "seed": args.seed,
+                       "params": params, "results": res}, f, indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,73 @@
+# UART model: bytes written to one end arrive at the linked end after the
+# time they take on the wire (10 bits per byte at the sending baud rate),
+# plus latency_us and a random 0 .. jitter_us per write, e.g. for a level
+# shifter, an isolator or a radio link in between
+#
+# License: MIT
+
+import collections
+
+
+class UARTModel:
+    def __init__(self, board, uart_id):
+        self.board = board
+        self.id = uart_id
+        self.baudrate = 115200
+        self.peer = None
+        self.rx = collections.deque()  # (arrival time in us, byte)
+        self.line_free_us = 0
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+        self.writes = 0
+        self.reads = 0  # reads that returned data
+        self.taps = []  # called with (time_us, direction, data)
+        self.latency_us = 0
+        self.jitter_us = 0
+        self.rng = None  # random.Random for the jitter
+
+    def write(self, data):
+        clock = self.board.clock
+        t = max(clock.now_us, self.line_free_us)
+        per_byte = 10 * 1e6 / self.baudrate
+        for tap in self.taps:
+            tap(clock.now_us, "tx", bytes(data))
+        if self.peer is not None:
+            delay = self.latency_us
+            if self.jitter_us and self.rng is not None:
+                delay += self.rng.uniform(0, self.jitter_us)
+            if self.peer.rx:
+                delay = max(delay, self.peer.rx[-1][0] - t - per_byte)  # keep the order
+            for i, b in enumerate(bytes(data)):
+                self.peer.rx.append((t + delay + (i + 1) * per_byte, b))
+        self.line_free_us = t + len(data) * per_byte
+        self.tx_bytes += len(data)
+        self.writes += 1
+        return len(data)
+
+    def available(self):
+        now = self.board.clock.now_us
+        n = 0
+        for t, _ in self.rx:
+            if t > now:
+                break
+            n += 1
+        return n
+
+    def read(self, n=-1):
+        k = self.available()
+        if n >= 0:
+            k = min(k, n)
+        if k == 0:
+            return b""
+        data = bytes(self.rx.popleft()[1] for _ in range(k))
+        self.rx_bytes += k
+        self.reads += 1
+        for tap in self.taps:
+            tap(self.board.clock.now_us, "rx", data)
+        return data
+
+
+def link(a, b):
+    """ Connect the TX of each UART to the RX of the other. """
+    a.peer = b
+    b.peer = a
@@ -0,0 +1,405 @@
+# File system of the simulated boards
+#
+# Device paths are mapped into a host directory per board (board.root), so
+# "/sd/LOG/20250508.BIN" of the XIAO is <root>/sd/LOG/20250508.BIN on the
+# PC and can be read there with tslogtools while the simulation runs.
+#
+# os.mount(dev, "/sd") drives the block device the way VfsFat does (init,
+# block count and size, boot sector). Binary files opened below a mount
+# point then pass their I/O on to the block device like FatFs does: a one
+# sector window per file for partial sectors, direct multi-block transfers
+# for whole sectors, and a directory (plus FAT, when a file grows by a
+# cluster) read-modify-write when a file is synced. So lib/sdcard.py and
+# lib/sdcache.py see the SPI traffic of the real logger. The file contents
+# come from the host file; the blocks a file uses are a fixed region per
+# file, an approximation of the FAT allocation.
+#
+# install() patches builtins.open and the os functions; they only translate
+# paths when called from a board thread, and pass host paths (the board
+# root, the Python installation) through unchanged.
+#
+# License: MIT
+
+import builtins
+import os
+import sys
+
+from . import board as _board
+
+SECTOR = 512
+CLUSTER = 64  # sectors, 32 KiB clusters as on a FAT32 card of this size
+FAT_BLOCK = 32
+DIR_BLOCK = 8192
+DATA_BLOCK = 16384
+FILE_SPAN = 8192  # blocks reserved per file, 4 MiB
+
+_real = {}
+_host_prefixes = ()
+
+
+def _board_or_none():
+    try:
+        return _board.current()
+    except RuntimeError:
+        return None
+
+
+def _device_path(b, path):
+    if not path.startswith("/"):
+        path = (b.cwd.rstrip("/") + "/" + path) if path not in ("", ".") else b.cwd
+    parts = []
+    for p in path.split("/"):
+        if p in ("", "."):
+            continue
+        if p == "..":
+            if parts:
+                parts.pop()
+        else:
+            parts.append(p)
+    return "/" + "/".join(parts)
+
+
+def translate(path):
+    """ (host path, device path, mount) of a path used by the calling thread. """
+    b = _board_or_none()
+    if b is None or isinstance(path, int):
+        return path, None, None
+    path = os.fspath(path)
+    if isinstance(path, bytes):
+        path = path.decode()
+    if path.startswith(b.root) or path.startswith(_host_prefixes):
+        return path, None, None
+    dev = _device_path(b, path)
+    mount = None
+    for point, m in b.mounts.items():
+        if dev == point or dev.startswith(point + "/"):
+            mount = m
+            break
+    return b.root + dev, dev, mount
+
+
+class Mount:
+    """ A block device mounted at a point of a board's file system. """
+
+    def __init__(self, dev, point, b):
+        self.dev = dev
+        self.point = point
+        self.board = b
+        self.files = set()
+        self.alloc = {}  # host path -> first block
+        self.next_block = DATA_BLOCK
+        self.nblocks = 0
+        self.blocks_read = 0
+        self.blocks_written = 0
+        self.buf = bytearray(SECTOR)
+
+    def mount(self):
+        ioctl = getattr(self.dev, "ioctl", None)
+        if ioctl is not None:
+            ioctl(1, 0)  # init
+            self.nblocks = ioctl(4, 0) or 0
+            if (ioctl(5, 0) or SECTOR) != SECTOR:
+                raise OSError(19)  # ENODEV
+        self.read(0, 1)  # boot sector
+
+    def base(self, host):
+        blk = self.alloc.get(host)
+        if blk is None:
+            span = max(self.nblocks - DATA_BLOCK, FILE_SPAN)
+            blk = DATA_BLOCK + (self.next_block - DATA_BLOCK) % span
+            self.alloc[host] = blk
+            self.next_block += FILE_SPAN
+        return blk
+
+    def read(self, block, count):
+        buf = self.buf if count == 1 else bytearray(count * SECTOR)
+        self.dev.readblocks(block, buf)
+        self.blocks_read += count
+
+    def write(self, block, data):
+        self.dev.writeblocks(block, data)
+        self.blocks_written += len(data) // SECTOR
+
+    def touch_dir(self, grew_cluster=False):
+        self.read(DIR_BLOCK, 1)
+        self.write(DIR_BLOCK, self.buf)
+        if grew_cluster:
+            self.read(FAT_BLOCK, 1)
+            self.write(FAT_BLOCK, self.buf)
+
+    def sync(self):
+        for f in list(self.files):
+            f.flush()
+        ioctl = getattr(self.dev, "ioctl", None)
+        if ioctl is not None:
+            ioctl(3, 0)
+
+    def statvfs(self):
+        used = 0
+        root = self.board.root + self.point
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                used += (os.path.getsize(os.path.join(dirpath, name)) + SECTOR - 1) // SECTOR
+        free = max(self.nblocks - DATA_BLOCK - used, 0)
+        return (SECTOR, SECTOR, self.nblocks, free, free, 0, 0, 0, 0, 255)
+
+
+class SDFile:
+    """ A binary host file below a mount point that does the block I/O of FatFs. """
+
+    def __init__(self, f, host, mount):
+        self.f = f
+        self.host = host
+        self.m = mount
+        self.base = mount.base(host)
+        self.win = -1  # file sector in the window
+        self.dirty = False
+        self.size = self._host_size()
+        self.synced_size = self.size
+        mount.files.add(self)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.f)
+
+    def _host_size(self):
+        return os.fstat(self.f.fileno()).st_size
+
+    def _sector_data(self, sec, count=1):
+        # from a second handle: the file may be open for writing only
+        self.f.flush()
+        with _real["open"](self.host, "rb") as f:
+            f.seek(sec * SECTOR)
+            data = f.read(count * SECTOR)
+        return bytearray(data.ljust(count * SECTOR, b"\0"))
+
+    def _blk(self, sec):
+        return self.base + sec
+
+    def _flush_win(self):
+        if self.dirty:
+            self.m.write(self._blk(self.win), self._sector_data(self.win))
+            self.dirty = False
+
+    def _window(self, sec, load):
+        if sec != self.win:
+            self._flush_win()
+            if load:
+                self.m.read(self._blk(sec), 1)
+            self.win = sec
+
+    def _access(self, pos, n, write, old_size):
+        if n <= 0:
+            return
+        end = pos + n
+        first, last = pos // SECTOR, (end - 1) // SECTOR
+        sec = first
+        while sec <= last:
+            s0, s1 = sec * SECTOR, (sec + 1) * SECTOR
+            if pos <= s0 and end >= s1:
+                # whole sectors: one multi-block transfer, past the window
+                k = 1
+                while sec + k <= last and end >= (sec + k + 1) * SECTOR:
+                    k += 1
+                if self.win >= sec and self.win < sec + k:
+                    if write:
+                        self.dirty = False
+                    else:
+                        self._flush_win()
+                if write:
+                    self.m.write(self._blk(sec), self._sector_data(sec, k))
+                else:
+                    self.m.read(self._blk(sec), k)
+                sec += k
+                continue
+            # partial sector through the window; loaded unless it is new
+            self._window(sec, load=not write or s0 < old_size)
+            if write:
+                self.dirty = True
+            sec += 1
+
+    def read(self, n=-1):
+        pos = self.f.tell()
+        data = self.f.read(n) if n is not None and n >= 0 else self.f.read()
+        self._access(pos, len(data), False, self.size)
+        return data
+
+    def readinto(self, buf):
+        pos = self.f.tell()
+        n = self.f.readinto(buf)
+        self._access(pos, n or 0, False, self.size)
+        return n
+
+    def write(self, data):
+        pos = self.f.tell()
+        n = self.f.write(data)
+        self.f.flush()
+        old = self.size
+        self.size = max(self.size, pos + n)
+        self._access(pos, n, True, old)
+        return n
+
+    def flush(self):
+        self.f.flush()
+        self._flush_win()
+        if self.size != self.synced_size:
+            grew = self.size // (CLUSTER * SECTOR) != self.synced_size // (CLUSTER * SECTOR)
+            self.m.touch_dir(grew)
+            self.synced_size = self.size
+
+    def close(self):
+        if self.f.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.m.files.discard(self)
+            self.f.close()
+
+
+# --- patched functions ---
+
+def _open(file, mode="r", *args, **kw):
+    host, dev, mount = translate(file)
+    f = _real["open"](host, mode, *args, **kw)
+    if mount is not None and "b" in mode:
+        return SDFile(f, host, mount)
+    return f
+
+
+def _wrap1(name, dir_change=False):
+    real = _real[name]
+
+    def fn(path, *args, **kw):
+        host, dev, mount = translate(path)
+        r = real(host, *args, **kw)
+        if dir_change and mount is not None:
+            mount.touch_dir()
+        return r
+
+    fn.__name__ = name
+    return fn
+
+
+def _chdir(path):
+    b = _board_or_none()
+    if b is None:
+        return _real["chdir"](path)
+    host, dev, _ = translate(path)
+    if dev is None or not os.path.isdir(host):
+        raise OSError(2, "ENOENT")
+    b.cwd = dev
+
+
+def _getcwd():
+    b = _board_or_none()
+    return _real["getcwd"]() if b is None else b.cwd
+
+
+def _listdir(path=None):
+    b = _board_or_none()
+    if b is None:
+        return _real["listdir"](path) if path is not None else _real["listdir"]()
+    host, _, _ = translate(b.cwd if path is None else path)
+    return sorted(_real["listdir"](host))
+
+
+def _ilistdir(path="."):
+    host, _, _ = translate(path)
+    for name in sorted(_real["listdir"](host)):
+        st = _real["stat"](os.path.join(host, name))
+        kind = 0x4000 if os.path.isdir(os.path.join(host, name)) else 0x8000
+        yield (name, kind, 0, st.st_size)
+
+
+def _rename(src, dst):
+    hs, _, mount = translate(src)
+    hd, _, _ = translate(dst)
+    b = _board_or_none()
+    if b is not None and os.path.exists(hd):
+        raise OSError(17, "EEXIST")  # FatFs does not replace files
+    _real["rename"](hs, hd)
+    if mount is not None:
+        if hs in mount.alloc:
+            mount.alloc[hd] = mount.alloc.pop(hs)
+        mount.touch_dir()
+
+
+def _statvfs(path):
+    host, _, mount = translate(path)
+    if mount is not None:
+        return mount.statvfs()
+    return _real["statvfs"](host)
+
+
+def _mount(dev, point, readonly=False, mkfs=False):
+    b = _board.current()
+    point = _device_path(b, point)
+    if point in b.mounts:
+        raise OSError(1, "EPERM")
+    m = Mount(dev, point, b)
+    m.mount()
+    os.makedirs(b.root + point, exist_ok=True)
+    b.mounts[point] = m
+
+
+def _umount(point):
+    b = _board.current()
+    m = b.mounts.pop(getattr(point, "point", point), None)
+    if m is None:
+        raise OSError(22, "EINVAL")
+    m.sync()
+
+
+def _sync():
+    b = _board_or_none()
+    if b is None:
+        return _real["sync"]()
+    for m in b.mounts.values():
+        m.sync()
+
+
+def install():
+    global _host_prefixes
+    if _real:
+        return
+    here = os.path.dirname(os.path.abspath(__file__))
+    _host_prefixes = tuple({sys.prefix, sys.base_prefix, sys.exec_prefix, here})
+    _real["open"] = builtins.open
+    for name in ("chdir", "getcwd", "listdir", "stat", "statvfs", "mkdir", "rmdir", "remove",
+                 "rename", "sync"):
+        _real[name] = getattr(os, name)
+    builtins.open = _open
+    os.chdir = _chdir
+    os.getcwd = _getcwd
+    os.listdir = _listdir
+    os.ilistdir = _ilistdir
+    os.stat = _wrap1("stat")
+    os.statvfs = _statvfs
+    os.mkdir = _wrap1("mkdir", dir_change=True)
+    os.rmdir = _wrap1("rmdir", dir_change=True)
+    os.remove = _wrap1("remove", dir_change=True)
+    os.rename = _rename
+    os.sync = _sync
+    os.mount = _mount
+    os.umount = _umount
+
+
+def uninstall():
+    if not _real:
+        return
+    builtins.open = _real.pop("open")
+    for name, fn in _real.items():
+        setattr(os, name, fn)
+    _real.clear()
+    for name in ("ilistdir", "mount", "umount"):
+        if hasattr(os, name):
+            delattr(os, name)
@@ -0,0 +1,20 @@
+"""
+Host-side tools for the logs the XIAO RP2350 writes to its SD card.
+
+Copy the card (or its /LOG directory) to the host, then:
+
+    >>> from tslogtools import iter_log, to_csv
+    >>> for recs in iter_log("LOG"):
+    ...     print(len(recs), recs["ts"][0])
+    >>> to_csv("LOG", "log.csv")
+
+or from the shell: python -m tslogtools --help
+Needs NumPy; Parquet export needs pyarrow.
+"""
+
+from .format import (
+    REC_DTYPE, OUT_DTYPE, AGG_DTYPE, SECTOR_DTYPE,
+    FLAG_SYNCED, FLAG_BME280, FLAG_MCP9808,
+)
+from .reader import LogFile, iter_log, segment_paths, open_aggregates, decode_sectors
+from .export import to_csv, to_columnar, load_columnar
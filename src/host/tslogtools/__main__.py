@@ -0,0 +1,109 @@
+# Command line: python -m tslogtools {info,csv,columnar,agg,bench} ...
+#
+# License: MIT
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from . import bench
+from .export import to_csv, to_columnar
+from .reader import LogFile, iter_log, open_aggregates, segment_paths
+
+
+def _paths(args):
+    paths = []
+    for p in args.paths:
+        paths += segment_paths(p) if os.path.isdir(p) else [p]
+    return paths
+
+
+def cmd_info(args):
+    for path in _paths(args):
+        with LogFile(path) as log:
+            n = 0
+            t0 = t1 = None
+            for recs in log.iter_chunks(verify=args.verify):
+                if t0 is None:
+                    t0 = int(recs["ts"][0])
+                t1 = int(recs["ts"][-1])
+                n += len(recs)
+            print("{:s}: {:d} sectors ({:d} used), {:d} records, ts {} .. {}".format(
+                path, log.n_sectors, log.end(), n, t0, t1))
+
+
+def cmd_head(args):
+    left = args.n
+    for recs in iter_log(_paths(args), verify=args.verify):
+        for r in recs[:left]:
+            print(*r.tolist(), sep=",")
+        left -= min(left, len(recs))
+        if not left:
+            break
+
+
+def cmd_csv(args):
+    n = to_csv(_paths(args), args.out, verify=args.verify)
+    print("{:d} records -> {:s}".format(n, args.out))
+
+
+def cmd_columnar(args):
+    try:
+        n = to_columnar(_paths(args), args.out, fmt=args.format, verify=args.verify)
+    except ValueError as exc:
+        sys.exit("tslogtools: {}".format(exc))
+    print("{:d} records -> {:s}".format(n, args.out))
+
+
+def cmd_agg(args):
+    a = open_aggregates(args.path)
+    np.savetxt(sys.stdout, a[-args.n:] if args.n else a, fmt="%d", delimiter=",",
+               header=",".join(a.dtype.names), comments="")
+
+
+def cmd_bench(args):
+    bench.run(args.n, export=not args.no_export)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(prog="tslogtools", description="Read the XIAO RP2350 SD card logs")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    def logs(sp):
+        sp.add_argument("paths", nargs="+", help="log segments or directories of them")
+        sp.add_argument("--no-verify", dest="verify", action="store_false",
+                        help="do not check the CRC16 of each sector")
+
+    sp = sub.add_parser("info", help="sectors, records and time range per segment")
+    logs(sp)
+    sp.set_defaults(func=cmd_info)
+    sp = sub.add_parser("head", help="print the first records")
+    logs(sp)
+    sp.add_argument("-n", type=int, default=10)
+    sp.set_defaults(func=cmd_head)
+    sp = sub.add_parser("csv", help="export to CSV")
+    logs(sp)
+    sp.add_argument("-o", "--out", required=True)
+    sp.set_defaults(func=cmd_csv)
+    sp = sub.add_parser("columnar", help="export to Parquet or column files")
+    logs(sp)
+    sp.add_argument("-o", "--out", required=True)
+    sp.add_argument("--format", choices=("auto", "parquet", "npy"), default="auto")
+    sp.set_defaults(func=cmd_columnar)
+    sp = sub.add_parser("agg", help="print a MINUTES.AGG or HOURS.AGG file as CSV")
+    sp.add_argument("path")
+    sp.add_argument("-n", type=int, default=0, help="only the last n records")
+    sp.set_defaults(func=cmd_agg)
+    sp = sub.add_parser("bench", help="decode throughput on synthetic logs")
+    sp.add_argument("-n", type=int, default=1000000, help="records")
+    sp.add_argument("--no-export", action="store_true")
+    sp.set_defaults(func=cmd_bench)
+
+    args = p.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
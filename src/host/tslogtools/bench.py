@@ -0,0 +1,61 @@
+# Decode throughput of the host reader in records per second
+#
+#   $ python -m tslogtools bench -n 1000000
+#
+# Writes a synthetic raw and a compressed log of n records (see synth.py) to
+# a temporary directory, then times LogFile.iter_chunks() over each, with
+# and without CRC verification, and the CSV and columnar exports.
+#
+# License: MIT
+
+import os
+import tempfile
+import time
+
+from .export import to_csv, to_columnar
+from .reader import LogFile, CHUNK_SECTORS
+from .synth import make_records, write_log
+
+
+def _decode(path, chunk_sectors, verify):
+    n = 0
+    t0 = time.perf_counter()
+    with LogFile(path) as log:
+        for recs in log.iter_chunks(chunk_sectors, verify):
+            n += len(recs)
+    return n, time.perf_counter() - t0
+
+
+def run(n=1000000, chunk_sectors=CHUNK_SECTORS, export=True, out=print):
+    """ Returns a dict of records per second per case. """
+    results = {}
+    recs = make_records(n)
+    with tempfile.TemporaryDirectory() as tmp:
+        for compress in (False, True):
+            kind = "compressed" if compress else "raw"
+            path = os.path.join(tmp, kind + ".BIN")
+            sectors = write_log(path, recs, compress)
+            size = os.path.getsize(path)
+            out("{:s}: {:d} records, {:d} sectors, {:.2f} bytes per record".format(
+                kind, n, sectors, size / n))
+            for verify in (False, True):
+                got, dt = _decode(path, chunk_sectors, verify)
+                if got != n:
+                    raise RuntimeError("decoded {:d} of {:d} records".format(got, n))
+                key = kind + (" +crc" if verify else "")
+                results[key] = n / dt
+                out("  decode{:s}: {:.3f} s, {:.2f} M records/s, {:.1f} MB/s".format(
+                    " +crc" if verify else "", dt, n / dt / 1e6, size / dt / 1e6))
+            if export:
+                t0 = time.perf_counter()
+                to_columnar(path, os.path.join(tmp, kind + "_cols"), fmt="npy",
+                            chunk_sectors=chunk_sectors)
+                dt = time.perf_counter() - t0
+                results[kind + " columnar"] = n / dt
+                out("  columnar: {:.3f} s, {:.2f} M records/s".format(dt, n / dt / 1e6))
+                t0 = time.perf_counter()
+                to_csv(path, os.path.join(tmp, kind + ".csv"), chunk_sectors=chunk_sectors)
+                dt = time.perf_counter() - t0
+                results[kind + " csv"] = n / dt
+                out("  csv: {:.3f} s, {:.2f} M records/s".format(dt, n / dt / 1e6))
+    return results
@@ -0,0 +1,106 @@
+# Export of decoded logs to CSV and to columnar files
+#
+# Both stream chunk by chunk (see reader.iter_log), so memory stays bounded
+# whatever the size of the logs.
+#
+# to_columnar() writes Parquet when pyarrow is installed. Without it, it
+# writes one little-endian binary file per column plus schema.json, which
+# numpy.memmap() or numpy.fromfile() read back:
+#
+#   >>> cols = load_columnar("out")
+#   >>> cols["v1"].mean()
+#
+# License: MIT
+
+import json
+import os
+
+import numpy as np
+
+from .format import OUT_DTYPE
+from .reader import iter_log, CHUNK_SECTORS
+
+CSV_HEADER = ",".join(OUT_DTYPE.names)
+PARQUET_EXTS = (".parquet", ".pq")
+
+
+def to_csv(paths, out_path, chunk_sectors=CHUNK_SECTORS, verify=True):
+    """ Write the records of the log(s) as CSV. Returns the number of records. """
+    n = 0
+    with open(out_path, "w") as f:
+        f.write(CSV_HEADER + "\n")
+        for recs in iter_log(paths, chunk_sectors, verify):
+            np.savetxt(f, recs, fmt="%d", delimiter=",")
+            n += len(recs)
+    return n
+
+
+def to_columnar(paths, out, fmt="auto", chunk_sectors=CHUNK_SECTORS, verify=True):
+    """
+    Write the records column by column: fmt "parquet" (a file, needs
+    pyarrow), "npy" (a directory of column files) or "auto". Raises
+    ValueError when out is named for Parquet and the format is not.
+    Returns the number of records.
+    """
+    wanted = fmt
+    if fmt == "auto":
+        try:
+            import pyarrow  # noqa: F401
+            fmt = "parquet"
+        except ImportError:
+            fmt = "npy"
+    if fmt == "npy" and os.path.splitext(out)[1].lower() in PARQUET_EXTS:
+        if wanted == "auto":
+            raise ValueError("pyarrow is not installed, cannot write Parquet to " + out)
+        raise ValueError("npy format writes a directory, not " + out)
+    if fmt == "parquet":
+        return _to_parquet(paths, out, chunk_sectors, verify)
+    if fmt != "npy":
+        raise ValueError("unknown columnar format: " + fmt)
+    os.makedirs(out, exist_ok=True)
+    files = {name: open(os.path.join(out, name + ".bin"), "wb") for name in OUT_DTYPE.names}
+    n = 0
+    try:
+        for recs in iter_log(paths, chunk_sectors, verify):
+            for name, f in files.items():
+                recs[name].tofile(f)
+            n += len(recs)
+    finally:
+        for f in files.values():
+            f.close()
+    schema = {
+        "rows": n,
+        "columns": [{"name": name, "dtype": OUT_DTYPE[name].str, "file": name + ".bin"}
+                    for name in OUT_DTYPE.names],
+    }
+    with open(os.path.join(out, "schema.json"), "w") as f:
+        json.dump(schema, f, indent=1)
+    return n
+
+
+def _to_parquet(paths, out_path, chunk_sectors, verify):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(name, pa.from_numpy_dtype(OUT_DTYPE[name])) for name in OUT_DTYPE.names])
+    n = 0
+    with pq.ParquetWriter(out_path, schema) as w:
+        for recs in iter_log(paths, chunk_sectors, verify):
+            w.write_table(pa.Table.from_arrays([recs[name] for name in OUT_DTYPE.names],
+                                               schema=schema))
+            n += len(recs)
+    return n
+
+
+def load_columnar(out):
+    """ Memory-mapped columns of a directory written by to_columnar(fmt="npy"). """
+    with open(os.path.join(out, "schema.json")) as f:
+        schema = json.load(f)
+    cols = {}
+    for c in schema["columns"]:
+        if schema["rows"]:
+            cols[c["name"]] = np.memmap(os.path.join(out, c["file"]), dtype=c["dtype"],
+                                        mode="r", shape=(schema["rows"],))
+        else:
+            cols[c["name"]] = np.zeros(0, dtype=c["dtype"])
+    return cols
@@ -0,0 +1,95 @@
+# On-card formats of the XIAO RP2350 logs as NumPy dtypes
+#
+# Mirrors sd/lib/tslog.py (log sectors), sd/lib/tscodec.py (compressed
+# sectors) and sd/lib/tsrollup.py (aggregates). Keep them in step.
+#
+# License: MIT
+
+import numpy as np
+
+SECTOR = 512
+HDR_SIZE = 16
+CRC_POS = 12  # of the crc field in the header
+MAGIC = b"TSL1"
+MAGIC_Z = b"TSZ1"
+REC_SIZE = 20
+REC_PER_SECTOR = (SECTOR - HDR_SIZE) // REC_SIZE  # 24
+CLOSED = 0x8000  # bit in "used" of a compressed sector that is full
+KEY_SIZE = REC_SIZE  # the keyframe of a compressed sector is a raw record
+NFIELDS = 6
+FIELDS = ("ts", "v0", "v1", "v2", "sync", "flags")
+
+FLAG_SYNCED = 1
+FLAG_BME280 = 2
+FLAG_MCP9808 = 4
+
+HDR_DTYPE = np.dtype([
+    ("magic", "S4"),
+    ("seq", "<u4"),
+    ("count", "<u2"),
+    ("rec_size", "<u2"),
+    ("crc", "<u2"),
+    ("used", "<u2"),  # compressed sectors: payload bytes used | CLOSED
+])
+
+REC_DTYPE = np.dtype([
+    ("ts", "<u4"),     # local unix time
+    ("v0", "<i4"),     # e.g. temperature in 0.01 C
+    ("v1", "<i4"),     # e.g. pressure in Pa
+    ("v2", "<i4"),     # e.g. humidity in 0.01 %rH
+    ("sync", "<i2"),   # RTC minus NTP time at the last sync (s)
+    ("flags", "<u2"),  # FLAG_* bits
+])
+
+# a raw (TSL1) sector, so a file can be viewed as an array of sectors
+SECTOR_DTYPE = np.dtype([
+    ("hdr", HDR_DTYPE),
+    ("rec", REC_DTYPE, (REC_PER_SECTOR,)),
+    ("pad", "V%d" % (SECTOR - HDR_SIZE - REC_PER_SECTOR * REC_SIZE)),
+])
+assert SECTOR_DTYPE.itemsize == SECTOR
+
+# decoded records: the sector sequence number plus the record
+OUT_DTYPE = np.dtype([("seq", "<u4")] + [(n, REC_DTYPE[n]) for n in FIELDS])
+
+AGG_DTYPE = np.dtype([
+    ("ts", "<u4"),
+    ("count", "<u2"),
+    ("flags", "<u2"),
+    ("v0_min", "<i4"), ("v0_max", "<i4"), ("v0_mean", "<i4"),
+    ("v1_min", "<i4"), ("v1_max", "<i4"), ("v1_mean", "<i4"),
+    ("v2_min", "<i4"), ("v2_max", "<i4"), ("v2_mean", "<i4"),
+])
+assert AGG_DTYPE.itemsize == 44
+
+
+def _crc16_table():
+    # CRC-CCITT (x^16 + x^12 + x^5 + 1), initial value 0, as lib.sdcard.crc16
+    t = np.zeros(256, dtype=np.uint16)
+    for i in range(256):
+        c = i << 8
+        for _ in range(8):
+            c = ((c << 1) ^ 0x1021) if c & 0x8000 else (c << 1)
+        t[i] = c & 0xFFFF
+    return t
+
+
+CRC16_TABLE = _crc16_table()
+
+
+def crc16_rows(data, crc=None):
+    """
+    CRC16 of each row of a 2-D uint8 array, one column at a time. crc
+    continues the CRCs of the bytes before the rows.
+    """
+    t = CRC16_TABLE
+    if crc is None:
+        crc = np.zeros(data.shape[0], dtype=np.uint16)
+    for j in range(data.shape[1]):
+        crc = (crc << 8) ^ t[(crc >> 8) ^ data[:, j]]
+    return crc
+
+
+def sector_crc_rows(b):
+    """ The header CRC of each row of a 2-D uint8 array of sectors: all bytes but the crc field. """
+    return crc16_rows(b[:, CRC_POS + 2:], crc16_rows(b[:, :CRC_POS]))
@@ -0,0 +1,235 @@
+# Memory-mapped reader for the log segments of lib.tslog
+#
+# A LogFile maps the file read-only and views it as an array of sectors
+# (format.SECTOR_DTYPE) without copying. Records are decoded one chunk of
+# sectors at a time, so a log of any size is read in bounded memory:
+#
+#   >>> with LogFile("20250508.BIN") as log:
+#   ...     for recs in log.iter_chunks():
+#   ...         print(recs["ts"][0], recs["v0"].mean())
+#
+# Raw sectors (TSL1) are selected straight from the mapped records.
+# Compressed sectors (TSZ1) are decoded in batches: the varints of all
+# sectors of a chunk are split and summed with array operations, and the
+# deltas are added up per sector with one cumulative sum.
+#
+# Like tslog.iter_records() on the device, bad sectors are skipped and the
+# first empty (erased) sector ends the log.
+#
+# License: MIT
+
+import mmap
+import os
+
+import numpy as np
+
+from .format import (
+    SECTOR, HDR_SIZE, MAGIC, MAGIC_Z, REC_SIZE, REC_PER_SECTOR, CLOSED, KEY_SIZE,
+    NFIELDS, FIELDS, SECTOR_DTYPE, REC_DTYPE, OUT_DTYPE, AGG_DTYPE, sector_crc_rows,
+)
+
+CHUNK_SECTORS = 16384  # 8 MB of log per chunk
+
+
+class LogFile:
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, "rb")
+        size = os.fstat(self._f.fileno()).st_size
+        self.n_sectors = size // SECTOR
+        self._mm = None
+        if self.n_sectors:
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            # zero-copy views of the mapping
+            self.sectors = np.frombuffer(self._mm, dtype=SECTOR_DTYPE, count=self.n_sectors)
+            self.bytes = np.frombuffer(self._mm, dtype=np.uint8,
+                                       count=self.n_sectors * SECTOR).reshape(-1, SECTOR)
+        else:
+            self.sectors = np.zeros(0, dtype=SECTOR_DTYPE)
+            self.bytes = np.zeros((0, SECTOR), dtype=np.uint8)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sectors = self.bytes = None
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                pass  # a caller still holds a view; closed when it is freed
+            self._mm = None
+        self._f.close()
+
+    def end(self):
+        """ Number of sectors before the first empty one. """
+        step = CHUNK_SECTORS
+        for start in range(0, self.n_sectors, step):
+            empty = _empty(self.bytes[start : start + step])
+            hit = np.flatnonzero(empty)
+            if len(hit):
+                return start + int(hit[0])
+        return self.n_sectors
+
+    def raw_view(self, start=0, stop=None):
+        """
+        Zero-copy (sectors, REC_PER_SECTOR) view of the records of raw
+        sectors, with the record count of each sector. Slots beyond the
+        count and compressed sectors are not meaningful; see iter_chunks().
+        """
+        s = self.sectors[start:stop]
+        return s["rec"], s["hdr"]["count"]
+
+    def iter_chunks(self, chunk_sectors=CHUNK_SECTORS, verify=True):
+        """
+        Yields the decoded records (OUT_DTYPE arrays) chunk by chunk.
+        With verify the CRC16 of each sector is checked, as on the device.
+        """
+        end = self.end()
+        for start in range(0, end, chunk_sectors):
+            stop = min(start + chunk_sectors, end)
+            recs = decode_sectors(self.sectors[start:stop], self.bytes[start:stop], verify)
+            if len(recs):
+                yield recs
+
+    def records(self, verify=True):
+        """ All records of the file in one array. """
+        parts = list(self.iter_chunks(verify=verify))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=OUT_DTYPE)
+
+
+def _empty(b):
+    head = b[:, :HDR_SIZE]
+    return (head == 0).all(axis=1) | (head == 0xFF).all(axis=1)
+
+
+def _valid(hdr, b, verify):
+    magic = hdr["magic"]
+    count = hdr["count"]
+    used = hdr["used"] & ~np.uint16(CLOSED)
+    raw = (magic == MAGIC) & (count <= REC_PER_SECTOR)
+    z = (magic == MAGIC_Z) & (used <= SECTOR - HDR_SIZE) & (count > 0) & (used >= KEY_SIZE)
+    ok = (raw | z) & (hdr["rec_size"] == REC_SIZE)
+    if verify and ok.any():
+        idx = np.flatnonzero(ok)
+        ok[idx] = sector_crc_rows(b[idx]) == hdr["crc"][idx]
+    return ok & raw, ok & z
+
+
+def decode_sectors(sectors, b, verify=True):
+    """ Decode an array of sectors (and the same sectors as bytes) into records. """
+    hdr = sectors["hdr"]
+    raw, z = _valid(hdr, b, verify)
+    parts = []
+    if raw.any():
+        s = sectors[raw]
+        count = s["hdr"]["count"].astype(np.intp)
+        sel = np.arange(REC_PER_SECTOR) < count[:, None]
+        out = np.empty(int(count.sum()), dtype=OUT_DTYPE)
+        rec = s["rec"][sel]
+        for name in FIELDS:
+            out[name] = rec[name]
+        out["seq"] = np.repeat(s["hdr"]["seq"], count)
+        parts.append((np.repeat(np.flatnonzero(raw), count), out))
+    if z.any():
+        idx = np.flatnonzero(z)
+        ok, out, count = decode_compressed(hdr[idx], b[idx])
+        parts.append((np.repeat(idx[ok], count), out))
+    if not parts:
+        return np.zeros(0, dtype=OUT_DTYPE)
+    if len(parts) == 1:
+        return parts[0][1]
+    # both kinds in one chunk: back into sector order
+    order = np.argsort(np.concatenate([p[0] for p in parts]), kind="stable")
+    return np.concatenate([p[1] for p in parts])[order]
+
+
+def decode_compressed(hdr, b):
+    """
+    Batch decode of compressed sectors. Returns (ok, records, count):
+    the mask of the sectors that decoded, their records in sector order
+    and the record count of each of them.
+    """
+    count = hdr["count"].astype(np.int64)
+    used = (hdr["used"] & ~np.uint16(CLOSED)).astype(np.int64)
+    start = HDR_SIZE + KEY_SIZE
+    length = used - KEY_SIZE  # varint bytes per sector
+    width = SECTOR - start
+    sel = np.arange(width) < length[:, None]
+    flat = b[:, start:][sel]
+    sector_of = np.repeat(np.arange(len(b)), length)
+    term = flat < 0x80
+    # a sector decodes when its varints end with its region and there are
+    # 6 per delta record
+    nvar = np.bincount(sector_of[term], minlength=len(b))
+    last = np.cumsum(length) - 1
+    ends = np.ones(len(b), dtype=bool)
+    has = length > 0
+    ends[has] = term[last[has]]
+    ok = (nvar == (count - 1) * NFIELDS) & ends
+    if not ok.all():
+        if not ok.any():
+            return ok, np.zeros(0, dtype=OUT_DTYPE), count[ok]
+        sub_ok, out, sub_count = decode_compressed(hdr[ok], b[ok])
+        ok[np.flatnonzero(ok)[~sub_ok]] = False
+        return ok, out, sub_count
+
+    # varint values: 7 bits per byte, low group first
+    first = np.empty(len(flat), dtype=bool)
+    if len(flat):
+        first[0] = True
+        first[1:] = term[:-1]
+    starts = np.flatnonzero(first)
+    pos = np.arange(len(flat)) - np.repeat(starts, np.diff(np.append(starts, len(flat))))
+    vals = (flat & 0x7F).astype(np.uint64) << (7 * pos).astype(np.uint64)
+    zz = np.add.reduceat(vals, starts) if len(starts) else vals
+    deltas = (zz >> np.uint64(1)).astype(np.int64) ^ -(zz & np.uint64(1)).astype(np.int64)
+    deltas = deltas.reshape(-1, NFIELDS)
+
+    # keyframes followed by the deltas of their sector, then a cumulative
+    # sum per sector
+    n = int(count.sum())
+    off = np.cumsum(count) - count
+    key = np.ascontiguousarray(b[:, HDR_SIZE : HDR_SIZE + KEY_SIZE]).view(REC_DTYPE).reshape(-1)
+    vals = np.empty((n, NFIELDS), dtype=np.int64)
+    for i, name in enumerate(FIELDS):
+        vals[off, i] = key[name]
+    is_key = np.zeros(n, dtype=bool)
+    is_key[off] = True
+    vals[~is_key] = deltas
+    cs = np.cumsum(vals, axis=0)
+    cs -= np.repeat(cs[off] - vals[off], count, axis=0)
+
+    out = np.empty(n, dtype=OUT_DTYPE)
+    out["seq"] = np.repeat(hdr["seq"], count)
+    for i, name in enumerate(FIELDS):
+        out[name] = cs[:, i]
+    return ok, out, count
+
+
+def segment_paths(log_dir):
+    """ The daily segments "YYYYMMDD.BIN" of a copied log directory, oldest first. """
+    names = [n for n in os.listdir(log_dir)
+             if len(n) == 12 and n.upper().endswith(".BIN") and n[:8].isdigit()]
+    return [os.path.join(log_dir, n) for n in sorted(names)]
+
+
+def iter_log(paths, chunk_sectors=CHUNK_SECTORS, verify=True):
+    """ Records of several segments, one chunk at a time. """
+    if isinstance(paths, str):
+        paths = segment_paths(paths) if os.path.isdir(paths) else [paths]
+    for path in paths:
+        with LogFile(path) as log:
+            for recs in log.iter_chunks(chunk_sectors, verify):
+                yield recs
+
+
+def open_aggregates(path):
+    """ Zero-copy view of a MINUTES.AGG or HOURS.AGG file of lib.tsrollup. """
+    n = os.path.getsize(path) // AGG_DTYPE.itemsize  # a torn last record is left out
+    if n == 0:
+        return np.zeros(0, dtype=AGG_DTYPE)
+    return np.memmap(path, dtype=AGG_DTYPE, mode="r", shape=(n,))
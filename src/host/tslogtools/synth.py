@@ -0,0 +1,97 @@
+# Synthetic logs in the device format, for benchmarks and round-trip checks
+#
+# write_log() lays out sectors as TSLogger does on the card: raw sectors of
+# 24 records, or compressed sectors closed when the worst-case delta record
+# would not fit anymore.
+#
+# License: MIT
+
+import struct
+
+import numpy as np
+
+from .format import (
+    SECTOR, HDR_SIZE, CRC_POS, MAGIC, MAGIC_Z, REC_SIZE, REC_PER_SECTOR, CLOSED, KEY_SIZE,
+    FIELDS, REC_DTYPE, SECTOR_DTYPE, sector_crc_rows, FLAG_BME280,
+)
+
+_HDR_FMT = "<4sIHHHH"
+_MAX_DELTA_SIZE = 26
+
+
+def make_records(n, ts0=1746700000, seed=0):
+    """ n records that look like 1 Hz BME280 readings. """
+    rng = np.random.default_rng(seed)
+    recs = np.zeros(n, dtype=REC_DTYPE)
+    recs["ts"] = ts0 + np.arange(n)
+    recs["v0"] = 2240 + np.cumsum(rng.integers(-3, 4, n)) // 4
+    recs["v1"] = 100068 + rng.integers(-16, 16, n)
+    recs["v2"] = 4385 + np.cumsum(rng.integers(-8, 9, n)) // 8
+    recs["flags"] = FLAG_BME280
+    return recs
+
+
+def _put(buf, pos, d):
+    z = d << 1 if d >= 0 else ((-d) << 1) - 1
+    while z > 0x7F:
+        buf[pos] = (z & 0x7F) | 0x80
+        z >>= 7
+        pos += 1
+    buf[pos] = z
+    return pos + 1
+
+
+def _raw_sectors(recs):
+    n = (len(recs) + REC_PER_SECTOR - 1) // REC_PER_SECTOR
+    s = np.zeros(n, dtype=SECTOR_DTYPE)
+    padded = np.zeros(n * REC_PER_SECTOR, dtype=REC_DTYPE)
+    padded[: len(recs)] = recs
+    s["rec"] = padded.reshape(n, REC_PER_SECTOR)
+    h = s["hdr"]
+    h["magic"] = MAGIC
+    h["seq"] = np.arange(n)
+    h["count"] = REC_PER_SECTOR
+    h["count"][-1] = len(recs) - (n - 1) * REC_PER_SECTOR
+    h["rec_size"] = REC_SIZE
+    b = s.view(np.uint8).reshape(n, SECTOR)
+    h["crc"] = sector_crc_rows(b)
+    return s.tobytes()
+
+
+def _compressed_sectors(recs):
+    out = bytearray()
+    buf = bytearray(SECTOR)
+    rows = [tuple(int(r[f]) for f in FIELDS) for r in recs]
+    seq = 0
+    i = 0
+    while i < len(rows):
+        buf[:] = bytes(SECTOR)
+        struct.pack_into("<IiiihH", buf, HDR_SIZE, *rows[i])
+        prev = rows[i]
+        pos = HDR_SIZE + KEY_SIZE
+        count = 1
+        i += 1
+        while i < len(rows) and SECTOR - pos >= _MAX_DELTA_SIZE:
+            r = rows[i]
+            for k in range(len(FIELDS)):
+                pos = _put(buf, pos, r[k] - prev[k])
+            prev = r
+            count += 1
+            i += 1
+        used = pos - HDR_SIZE
+        if SECTOR - pos < _MAX_DELTA_SIZE:
+            used |= CLOSED
+        struct.pack_into(_HDR_FMT, buf, 0, MAGIC_Z, seq, count, REC_SIZE, 0, used)
+        crc = int(sector_crc_rows(np.frombuffer(bytes(buf), np.uint8)[None, :])[0])
+        struct.pack_into("<H", buf, CRC_POS, crc)
+        out += buf
+        seq += 1
+    return bytes(out)
+
+
+def write_log(path, recs, compress=False):
+    """ Write records (a REC_DTYPE array) as a log file. Returns the number of sectors. """
+    data = _compressed_sectors(recs) if compress else _raw_sectors(recs)
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data) // SECTOR